@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import zlib
+import threading
+import RankingCodec
+
+# 1日分のレスポンスを追記するファイル名と索引ファイル名
+ARCHIVE_NAME = "responses.ndjson.gz"
+INDEX_SUFFIX = ".idx"
+# 位置指定子の区切り(ファイル名#先頭バイト位置+バイト数)
+LOCATOR_SEPARATOR = "#"
+
+# 同じプロセスの複数のスレッドから同じファイルへ追記する場合の排他
+__append_lock = threading.Lock()
+
+
+def archive_path(output_base_dir: str, day: str) -> str:
+    """日付ごとのアーカイブファイル名(output_base_dir/YYYY-MM-DD/Data/responses.ndjson.gz)"""
+    return os.path.join(output_base_dir, day, "Data", ARCHIVE_NAME)
+
+
+def locator(path: str, offset: int, length: int) -> str:
+    """アーカイブ内の1レコードを指す位置指定子を作る"""
+    return "{}{}{}+{}".format(path, LOCATOR_SEPARATOR, offset, length)
+
+
+def parse_locator(value: str) -> tuple:
+    """位置指定子をファイル名、先頭バイト位置、バイト数に分解する。位置指定子でない場合はNoneを返す"""
+    path, separator, position = value.rpartition(LOCATOR_SEPARATOR)
+    if len(separator) == 0 or not path.endswith(ARCHIVE_NAME):
+        return None
+    offset, _, length = position.partition("+")
+    return path, int(offset), int(length)
+
+
+def append(path: str, record: dict, key: str) -> str:
+    """レコード追記処理
+
+    レコードを1行のjsonにし、gzipの1メンバーとしてアーカイブファイルの末尾に追記する。
+    gzipは複数のメンバーを連結したものも1つのgzipとして読めるため、ファイル全体をgzip.openで先頭から読める。
+    追記後に索引ファイルへキー、先頭バイト位置、バイト数を1行のjsonで追記する。
+
+    Parameters
+    ----------
+    path : str
+        アーカイブファイル名
+    record : dict
+        追記するレコード
+    key : str
+        索引に記録するキー(キーワードセットなど)
+
+    Returns
+    -------
+    locator : str
+        追記したレコードの位置指定子
+    """
+    line = RankingCodec.dumps(record) + b"\n"
+    member = gzip.compress(line)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with __append_lock:
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(path + INDEX_SUFFIX, 'a', encoding='UTF-8') as f:
+            f.write(RankingCodec.dumps({"key": key, "offset": offset, "length": len(member)}).decode('utf-8') + "\n")
+    return locator(path, offset, len(member))
+
+
+def read(value: str) -> dict:
+    """レコード読み込み処理
+
+    位置指定子の指すレコードだけを読み込む(ファイルの先頭から読み直さない)。
+
+    Parameters
+    ----------
+    value : str
+        appendが返した位置指定子
+
+    Returns
+    -------
+    record : dict
+        レコード
+    """
+    path, offset, length = parse_locator(value)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        member = f.read(length)
+    return RankingCodec.loads(gzip.decompress(member))
+
+
+def exists(value: str) -> bool:
+    """位置指定子の指すレコードがファイル内にあるか"""
+    parsed = parse_locator(value)
+    if parsed is None:
+        return False
+    path, offset, length = parsed
+    return os.path.exists(path) and os.path.getsize(path) >= offset + length
+
+
+def iter_records(path: str):
+    """レコード列挙処理
+
+    アーカイブファイルを先頭から少しずつ展開し、1レコードずつ返す。
+    ファイル全体をメモリに読み込まない。異常終了で書きかけになった末尾のメンバーは読み飛ばす。
+
+    Parameters
+    ----------
+    path : str
+        アーカイブファイル名
+
+    Yields
+    ------
+    record : dict
+        レコード
+    """
+    for _, _, line in __iter_members(path):
+        yield RankingCodec.loads(line)
+
+
+def __iter_members(path: str, chunk_size: int = 1024 * 1024):
+    """gzipのメンバーごとに(先頭バイト位置, バイト数, 展開したデータ)を返す"""
+    with open(path, 'rb') as f:
+        offset = 0
+        consumed = 0
+        parts = []
+        decompressor = zlib.decompressobj(wbits=31)
+        buffer = b""
+        while True:
+            if len(buffer) == 0:
+                buffer = f.read(chunk_size)
+                if len(buffer) == 0:
+                    # 書きかけのメンバーは捨てる
+                    return
+            parts.append(decompressor.decompress(buffer))
+            if decompressor.eof:
+                unused = decompressor.unused_data
+                length = consumed + len(buffer) - len(unused)
+                yield offset, length, b"".join(parts)
+                offset = offset + length
+                consumed = 0
+                parts = []
+                decompressor = zlib.decompressobj(wbits=31)
+                buffer = unused
+            else:
+                consumed = consumed + len(buffer)
+                buffer = b""
+
+
+def iter_locators(path: str):
+    """位置指定子列挙処理
+
+    索引ファイルからアーカイブ内のレコードの位置指定子を追記順に返す。
+    索引ファイルがない場合はアーカイブファイルを先頭から展開して位置を求める。
+
+    Parameters
+    ----------
+    path : str
+        アーカイブファイル名
+
+    Yields
+    ------
+    locator : str
+        レコードの位置指定子
+    """
+    index_path = path + INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        for offset, length, _ in __iter_members(path):
+            yield locator(path, offset, length)
+        return
+    with open(index_path, 'r', encoding='UTF-8') as f:
+        for line in f:
+            try:
+                entry = RankingCodec.loads(line)
+            except ValueError:
+                continue
+            yield locator(path, entry["offset"], entry["length"])
+
+
+def rebuild_index(path: str, key_func) -> int:
+    """索引再作成処理
+
+    アーカイブファイルを先頭から展開して索引ファイルを作り直す。
+    データの追記後、索引の追記前に異常終了した場合などに使う。
+
+    Parameters
+    ----------
+    path : str
+        アーカイブファイル名
+    key_func : Callable[[dict], str]
+        レコードから索引のキーを求める関数
+
+    Returns
+    -------
+    count : int
+        索引に記録したレコード数
+    """
+    count = 0
+    tmp_path = path + INDEX_SUFFIX + ".tmp"
+    with open(tmp_path, 'w', encoding='UTF-8') as f:
+        for offset, length, line in __iter_members(path):
+            key = key_func(RankingCodec.loads(line))
+            f.write(RankingCodec.dumps({"key": key, "offset": offset, "length": length}).decode('utf-8') + "\n")
+            count = count + 1
+    os.replace(tmp_path, path + INDEX_SUFFIX)
+    return count
+
+
+def find(path: str, key: str) -> list[str]:
+    """キー検索処理
+
+    索引ファイルから指定したキーのレコードの位置指定子を追記順に返す。
+
+    Parameters
+    ----------
+    path : str
+        アーカイブファイル名
+    key : str
+        appendで指定したキー
+
+    Returns
+    -------
+    locators : list[str]
+        位置指定子のリスト
+    """
+    locators = []
+    index_path = path + INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        return locators
+    with open(index_path, 'r', encoding='UTF-8') as f:
+        for line in f:
+            try:
+                entry = RankingCodec.loads(line)
+            except ValueError:
+                continue
+            if entry["key"] == key:
+                locators.append(locator(path, entry["offset"], entry["length"]))
+    return locators
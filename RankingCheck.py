@@ -2,102 +2,260 @@
 
 import sys
 import os
+import gzip
+import json
 import pprint
 import traceback
-import sqlalchemy
 import requests
+import threading
 import time
-from sqlalchemy.orm import scoped_session, sessionmaker
-from bs4 import BeautifulSoup
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sqlalchemy.orm import scoped_session
+from lxml import html as lxml_html
 from datetime import datetime
-from sqlalchemy.sql.expression import null
-from RankingModels import Base, TSearchM, TSearch, TRanking, TDoc
+from RankingModels import TSearchM, TSearch, TRanking, TDoc, TRankingSummary, open_db
+from RankingDocCache import doc_cache
+from RankingScheduler import SearchScheduler
+from RankingKeywords import read_keyword_sets
+
+# 検索先(テスト用のサーバーなどに差し替えられる)
+DEFAULT_BASE_URL = "https://www.google.co.jp"
+# 同じキーワードセットのページを取得する間隔(秒)
+DEFAULT_DELAY = 1.0
+# 失敗したときの再試行回数と待ち時間の係数(1, 2, 4, …秒と増やしながら待つ)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+# 1回の取得のタイムアウト(秒)
+REQUEST_TIMEOUT = 30
+# 検索結果を取り出すXPath(Googleのクラス名は変わることがあるため--selectorsオプションのjsonで置き換えられる)
+# result: 検索結果1件の要素、link: 結果の要素から見たURL、title: 結果の要素から見たタイトルの要素、next: 次のページへのリンク
+DEFAULT_SELECTORS = {
+    "result": "//*[@class='ZINbbc xpd O9g5cc uUPGi']",
+    "link": "((.//div)[1]//a)[1]/@href",
+    "title": "((((.//div)[1]//h3)[1])//div)[1]",
+    "next": "(//a[@aria-label='次のページ'])[1]/@href",
+}
+
+# スレッドごとのHTTPセッション
+__thread_local = threading.local()
+# 文字コードごとのhtmlパーサー
+__parsers = {}
+
+
+def create_http_session(pool_size: int = 10, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF) -> requests.Session:
+    """HTTPセッション作成処理
+
+    keep-aliveで接続を使いまわすコネクションプールつきのHTTPセッションを作成する。
+    接続エラーと429, 5xxの応答は、待ち時間を増やしながらretries回まで再試行する(Retry-Afterヘッダがあればそれに従う)。
 
-def __db_upsert(session: scoped_session,soup: BeautifulSoup, t_search: TSearch, ranking: int, max_ranking: int,search_time: datetime, my_url: str, wordjoin: str) -> int:
-    """DB登録更新処理
+    Parameters
+    ----------
+    pool_size : int
+        ホストごとに保持する接続数
+    retries : int
+        再試行回数
+    backoff : float
+        再試行の待ち時間の係数
+
+    Returns
+    -------
+    http : requests.Session
+        HTTPセッション
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    http = requests.Session()
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+
+def __thread_http(retries: int, backoff: float) -> requests.Session:
+    """スレッドごとのHTTPセッション(同じスレッドの取得では接続を使いまわす)"""
+    http = getattr(__thread_local, "http", None)
+    if http is None:
+        http = create_http_session(retries=retries, backoff=backoff)
+        __thread_local.http = http
+    return http
 
-    得られた検索結果をスクレイピングし検索結果をDBに登録する処理をおこなう
+
+def load_selectors(selector_file: str) -> dict:
+    """セレクタ読み込み処理
+
+    jsonファイルからDEFAULT_SELECTORSを置き換えるXPathを読み込む。ファイルにないキーは既定値を使う。
 
     Parameters
     ----------
-    session : scoped_session
-        データベース接続のセッション
-    soup : BeautifulSoup
-        検索結果読み込み済みのBeautifulSoupのオブジェクト
-    t_search : TSearch
-        検索テーブル
-    ranking : int
-        何位のランキングまで処理完了しているか
-    max_ranking : int
-        何位までランキングを検索するか
-    search_time : datetime
-        検索を開始した日時
-    my_url : str
-        自サイトのURL
+    selector_file : str
+        result, link, title, nextのいずれかをキーとするjsonファイル
 
     Returns
     -------
-    ranking : int
-        処理完了したランキング順位
+    selectors : dict
+        result, link, title, nextのXPathを持つディクショナリ
     """
+    with open(selector_file, 'r', encoding='UTF-8') as f:
+        loaded = json.load(f)
+    unknown = set(loaded.keys()) - set(DEFAULT_SELECTORS.keys())
+    if len(unknown) > 0:
+        raise ValueError("不明なセレクタです: {}".format(", ".join(sorted(unknown))))
+    selectors = dict(DEFAULT_SELECTORS)
+    selectors.update(loaded)
+    return selectors
+
+
+def __first_text(element, xpath: str) -> str:
+    """XPathで最初に見つかった要素の文字列(属性値または要素内のテキスト)を返す。見つからない場合はNone"""
+    found = element.xpath(xpath)
+    if isinstance(found, str):
+        return found
+    if len(found) == 0:
+        return None
+    first = found[0]
+    if isinstance(first, str):
+        return str(first)
+    return "".join(first.itertext())
+
+
+def parse_page(content: bytes, selectors: dict = DEFAULT_SELECTORS, encoding: str = 'utf-8') -> tuple:
+    """検索結果解析処理
+
+    検索結果の1ページ分のhtmlから、順位順のURLとタイトルと次のページへのリンクを取り出す。
+    受信したバイト列をlxmlで直接解析し、XPathで必要な要素だけを取り出す。
 
-    output_dir = search_time.strftime('%Y-%m-%d') + os.sep + search_time.strftime('%H%M%S')
-    #search_time_string = search_time.strftime('%Y%m%d_%H%M%S')
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    with open("{}{}{}_{}.html".format(output_dir,os.sep,wordjoin,str(ranking)), 'w', encoding='UTF-8') as f:
-        f.write(soup.prettify())
+    Parameters
+    ----------
+    content : bytes
+        検索結果のhtml
+    selectors : dict
+        result, link, title, nextのXPath
+    encoding : str
+        htmlの文字コード
 
-    divs = soup.select("[class='ZINbbc xpd O9g5cc uUPGi']")
-    for div_b in divs:
-        if ( div_b.div.a is not None ) and (div_b.div.h3 is not None):
-            ranking = ranking + 1
-            link_text=div_b.div.a.get("href")
-            link_text=link_text.replace('/url?q=','').split('&')[0]
-            doc_title=div_b.div.h3.div.get_text().strip()
+    Returns
+    -------
+    results : list[tuple[str, str]]
+        (URL, タイトル)のリスト
+    next_link : str
+        次のページへのリンク。ない場合はNone
+    """
+    parser = __parsers.get(encoding)
+    if parser is None:
+        parser = lxml_html.HTMLParser(encoding=encoding)
+        __parsers[encoding] = parser
+    root = lxml_html.fromstring(content, parser=parser)
+    results = []
+    for element in root.xpath(selectors["result"]):
+        link_text = __first_text(element, selectors["link"])
+        doc_title = __first_text(element, selectors["title"])
+        if link_text is None or doc_title is None:
+            continue
+        link_text=link_text.replace('/url?q=','').split('&')[0]
+        results.append((link_text, doc_title.strip()))
+
+    next_link = __first_text(root, selectors["next"])
+    return results, next_link
+
+
+def fetch(http: requests.Session, keywords: list[str], max_ranking: int, search_time: datetime, base_url: str = DEFAULT_BASE_URL,
+          delay: float = DEFAULT_DELAY, output_base_dir: str = '.', selectors: dict = DEFAULT_SELECTORS, gzip_flg: bool = False) -> list[tuple]:
+    """検索結果取得処理
+
+    検索結果のページを次のページへのリンクをたどりながら順に取得し、順位順のURLとタイトルを返す。
+    max_rankingまで見つかるか次のページがなくなった時点で終わる。
+    取得したページは受信したままのhtmlを日付と時刻のフォルダの下に保存する。
 
-            t_doc = TDoc()
-            t_doc.link_url = link_text
-            t_doc.title = doc_title
-            if len(my_url) > 0 and my_url in link_text:
-                t_doc.mypage_flg = True
-            else:
-                t_doc.mypage_flg = False
-            t_doc = TDoc().upsert(t_doc, session)
+    Parameters
+    ----------
+    http : requests.Session
+        HTTPセッション
+    keywords : list[str]
+        検索キーワードの配列
+    max_ranking : int
+        何位までランキングを検索するか
+    search_time : datetime
+        検索を開始した日時
+    base_url : str
+        検索先のURL(base_url/search?q=...を取得する)
+    delay : float
+        ページを取得する間隔(秒)
+    output_base_dir : str
+        htmlを出力するフォルダ
+    selectors : dict
+        検索結果を取り出すXPath
+    gzip_flg : bool
+        Trueのときhtmlをgzipで圧縮して保存する(拡張子は.html.gz)
 
-            t_ranking = TRanking()
-            t_ranking.search_id = t_search.id
-            t_ranking.ranking = ranking
-            t_ranking.doc_id = t_doc.id
-            has_ranking = TRanking().hasRanking(t_ranking, session)
-            if has_ranking == True:
-                # 二重にランキング計上されているためインサートせずrankingから1を引いておく
-                ranking = ranking - 1
-            else:
-                #t_ranking = TRanking().upsert(t_ranking, session)
-                t_ranking = TRanking().insert(t_ranking, session)
-            if ranking == max_ranking:
-                return max_ranking
-    return ranking
+    Returns
+    -------
+    results : list[tuple[str, str]]
+        順位順に並んだ(URL, タイトル)のリスト。同じURLが二重に出てきた場合は最初の1つだけを残す
+    """
+    search_word=""
+    for keyword in keywords:
+        #search_word = "{} \"{}\"".format(search_word,keyword)
+        search_word = search_word + " " + keyword
 
-def __search_next(session: scoped_session,t_search: TSearch, link_text: str, ranking: int, max_ranking: int,search_time: datetime, my_url: str, wordjoin: str) -> int:
-    """検索開始
+    wordjoin = "_".join(keywords)
+    output_dir = os.path.join(output_base_dir, search_time.strftime('%Y-%m-%d'), search_time.strftime('%H%M%S'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    seen = set()
+    google_url = urljoin(base_url, "/search")
+    params = {'q': search_word}
+    while True:
+        r = http.get(google_url, params=params, timeout=REQUEST_TIMEOUT)
+        r.raise_for_status()
+        # Content-Typeに文字コードがない場合はUTF-8とみなす
+        encoding = r.encoding if 'charset' in r.headers.get('Content-Type', '') else 'utf-8'
+        page_results, next_link = parse_page(r.content, selectors, encoding)
+
+        output_file = "{}{}{}_{}.html".format(output_dir,os.sep,wordjoin,str(len(results)))
+        if gzip_flg:
+            with gzip.open(output_file + ".gz", 'wb') as f:
+                f.write(r.content)
+        else:
+            with open(output_file, 'wb') as f:
+                f.write(r.content)
+
+        for link_text, doc_title in page_results:
+            link_text = doc_cache.normalize_url(link_text)
+            if link_text in seen:
+                # 二重にランキング計上されるためスキップし順位を進めない
+                continue
+            seen.add(link_text)
+            results.append((link_text, doc_title))
+            if len(results) >= max_ranking:
+                return results
+
+        if next_link is None:
+            return results
+        google_url = urljoin(base_url, next_link)
+        params = None
+        time.sleep(delay)
+
+
+def __db_upsert(session: scoped_session, keywords: list[str], results: list[tuple], search_time: datetime, my_url: str) -> int:
+    """DB登録更新処理
 
-    検索結果の2ページ以降の処理とおこなう。次項がある場合は再帰的に自身を呼び出す。
+    得られた検索結果をDBに登録する処理をおこなう。検索・ドキュメント・ランキング・最新順位集計は1トランザクションで登録する。
 
     Parameters
     ----------
     session : scoped_session
         データベース接続のセッション
-    t_search : TSearch
-        検索テーブル
-    link_text : str
-        検索結果の次頁へのリンクテキスト
-    ranking : int
-        何位のランキングまで処理完了しているか
-    max_ranking : int
-        何位までランキングを検索するか
+    keywords : list[str]
+        検索キーワードの配列
+    results : list[tuple[str, str]]
+        fetchで取得した順位順の(URL, タイトル)のリスト
     search_time : datetime
         検索を開始した日時
     my_url : str
@@ -108,78 +266,150 @@ def __search_next(session: scoped_session,t_search: TSearch, link_text: str, ran
     ranking : int
         処理完了したランキング順位
     """
+    try:
+        t_search_m = TSearchM()
+        t_search_m.keywords="\t".join(keywords)
+        t_search_m = TSearchM().upsert(t_search_m,session,commit=False)
 
-    google_url = "https://www.google.co.jp{}".format(link_text)
-    
-    r = requests.get(google_url)
-    soup = BeautifulSoup(r.text, 'lxml') #要素を抽出
+        t_search = TSearch()
+        t_search.search_m_id=t_search_m.id
+        t_search.search_datetime = search_time
+        t_search = TSearch().upsert(t_search,session,commit=False)
 
-    ret_ranking = __db_upsert(session, soup, t_search, ranking, max_ranking, search_time, my_url, wordjoin)
-    if ret_ranking >= max_ranking:
-        return ret_ranking
+        t_docs = []
+        for link_text, doc_title in results:
+            t_doc = TDoc()
+            t_doc.link_url = link_text
+            t_doc.title = doc_title
+            if len(my_url) > 0 and my_url in link_text:
+                t_doc.mypage_flg = True
+            else:
+                t_doc.mypage_flg = False
+            t_docs.append(t_doc)
+        doc_id_dic = doc_cache.resolve(t_docs, session)
 
-    a = soup.select_one("a[aria-label='次のページ']")
-    if a is None:
-        return ret_ranking
+        t_rankings = []
+        for ranking, (link_text, _) in enumerate(results, start=1):
+            t_ranking = TRanking()
+            t_ranking.search_id = t_search.id
+            t_ranking.ranking = ranking
+            t_ranking.doc_id = doc_id_dic[link_text]
+            t_rankings.append(t_ranking)
+        TRanking.bulk_insert(t_rankings, session)
+        TRankingSummary.apply(t_search, t_rankings, session)
 
-    link_text=a.get("href")
-    time.sleep(1)
-    return __search_next(session, t_search, link_text, ret_ranking, max_ranking, search_time, my_url, wordjoin)
+        session.commit()
+        doc_cache.commit()
+    except Exception:
+        session.rollback()
+        doc_cache.rollback()
+        raise
+    return len(t_rankings)
 
 
-def __search_start(session: scoped_session,t_search: TSearch, keywords: list[str], max_ranking: int,search_time: datetime, my_url: str) -> int:
-    """検索開始
+def search_batch(keyword_sets: list[dict], dbfile: str, my_url: str, max_ranking: int, drop_flg: bool, warm_cache: int = 0,
+                 workers: int = 1, base_url: str = DEFAULT_BASE_URL, delay: float = DEFAULT_DELAY, retries: int = DEFAULT_RETRIES,
+                 output_base_dir: str = '.', report = sys.stdout, selectors: dict = DEFAULT_SELECTORS, gzip_flg: bool = False) -> list[dict]:
+    """一括検索処理
 
-    検索結果の最初の1ページの処理をおこないDB登録処理を呼び出す
+    複数のキーワードセットをSearchSchedulerで検索する。
+    取得はworkers個のスレッドで並行しておこない(スレッドごとにkeep-aliveのHTTPセッションを使いまわす)、
+    DBへの登録は1つの書き込みスレッドで順におこなう。
+    1つのキーワードセットで失敗しても残りのキーワードセットの検索は続ける。
 
     Parameters
     ----------
-    session : scoped_session
-        データベース接続のセッション
-    t_search : TSearch
-        検索テーブル
-    keywords : list[str]
-        検索キーワード
-    max_ranking : int
-        何位までランキングを検索するか
-    search_time : datetime
-        検索を開始した日時
+    keyword_sets : list[dict]
+        read_keyword_setsで読み込んだキーワードセットのリスト
+    dbfile : str
+        データベースファイル名
     my_url : str
-        自サイトのURL
+        自サイトのURL(キーワードセットにurlがない場合に使う)
+    max_ranking : int
+        何位までランキングを検索するか(キーワードセットにmax_rankingがない場合に使う)
+    drop_flg : bool
+        Trueのとき最初にテーブルをいったんDROPして作成しなおす
+    warm_cache : int
+        1以上のとき検索前にランキングへの登場回数の多いドキュメントをその件数だけキャッシュに読み込む
+    workers : int
+        キーワードセットを並行して取得するスレッド数
+    base_url : str
+        検索先のURL
+    delay : float
+        同じキーワードセットのページを取得する間隔(秒)
+    retries : int
+        取得に失敗したときの再試行回数
+    output_base_dir : str
+        htmlを出力するフォルダ
+    report : TextIO
+        キーワードセットごとの結果をタブ区切りで出力する先。Noneのときは出力しない
+    selectors : dict
+        検索結果を取り出すXPath
+    gzip_flg : bool
+        Trueのときhtmlをgzipで圧縮して保存する
 
     Returns
     -------
-    ranking : int
-        処理完了したランキング順位
+    results : list[dict]
+        キーワードセットごとのkeywords, ranking, errorを持つディクショナリのリスト
     """
+    engine, session = open_db(dbfile, drop_flg)
+    if warm_cache > 0:
+        doc_cache.warm(session, warm_cache)
+
+    jobs = []
+    for keyword_set in keyword_sets:
+        set_url = keyword_set.get("url")
+        set_max_ranking = keyword_set.get("max_ranking")
+        jobs.append({
+            "keywords": keyword_set["keywords"],
+            "url": my_url if set_url is None else set_url,
+            "max_ranking": max_ranking if set_max_ranking is None else int(set_max_ranking),
+        })
+
+    def fetch_job(job):
+        search_time = datetime.now()
+        http = __thread_http(retries, DEFAULT_BACKOFF)
+        return search_time, fetch(http, job["keywords"], job["max_ranking"], search_time, base_url, delay, output_base_dir, selectors, gzip_flg)
+
+    def write_job(job, fetched):
+        search_time, results = fetched
+        return __db_upsert(session, job["keywords"], results, search_time, job["url"])
+
+    def report_job(job_result):
+        error = job_result["error"]
+        if error is not None:
+            t = traceback.format_exception(type(error), error, error.__traceback__)
+            t.insert(0,"[ERROR]:{}".format(" ".join(job_result["job"]["keywords"])))
+            pprint.pprint(t, width=120,stream=sys.stderr)
+            status = "ERROR " + repr(error)
+        else:
+            status = "OK"
+        if report is not None:
+            report.write("{}\t{}\t{}\n".format(
+                " ".join(job_result["job"]["keywords"]), job_result["result"] or 0, status))
+            report.flush()
+
+    scheduler = SearchScheduler(fetch_job, write_job, workers=workers, report_func=report_job)
+    try:
+        job_results = scheduler.run(jobs)
+    finally:
+        session.close()
+        engine.dispose()
 
-    google_url = "https://www.google.co.jp/search"
+    return [{
+        "keywords": job_result["job"]["keywords"],
+        "ranking": job_result["result"] or 0,
+        "error": None if job_result["error"] is None else repr(job_result["error"]),
+    } for job_result in job_results]
 
-    search_word=""
-    for keyword in keywords:
-        #search_word = "{} \"{}\"".format(search_word,keyword)
-        search_word = search_word + " " + keyword
-    
-    wordjoin = "_".join(keywords)
 
-    r = requests.get(google_url,params={'q': search_word})
-    soup = BeautifulSoup(r.text, 'lxml') #要素を抽出
-    ranking=0
-    ret_ranking = __db_upsert(session, soup, t_search, ranking, max_ranking, search_time, my_url, wordjoin)
-    if ret_ranking >= max_ranking:
-        return ret_ranking
-
-    a = soup.select_one("a[aria-label='次のページ']")
-    if a is None:
-        return ret_ranking
-    link_text=a.get("href")
-    time.sleep(1)
-    return __search_next(session, t_search, link_text, ret_ranking, max_ranking, search_time, my_url, wordjoin)
-
-def search(keywords: list[str], dbfile: str, url: str, max_ranking: int, drop_flg: bool):
+def search(keywords: list[str], dbfile: str, url: str, max_ranking: int, drop_flg: bool, warm_cache: int = 0,
+           base_url: str = DEFAULT_BASE_URL, delay: float = DEFAULT_DELAY, retries: int = DEFAULT_RETRIES, output_base_dir: str = '.',
+           selectors: dict = DEFAULT_SELECTORS, gzip_flg: bool = False) -> int:
     """検索処理
 
-    検索処理に必要な前処理をおこない検索開始を呼び出す
+    検索処理に必要な前処理をおこない検索結果を取得してDBに登録する
 
     Parameters
     ----------
@@ -187,49 +417,66 @@ def search(keywords: list[str], dbfile: str, url: str, max_ranking: int, drop_fl
         検索キーワードの配列
     dbfile : str
         データベースファイル名
+    url : str
+        自サイトのURL
     max_ranking : int
         何位までランキングを検索するか
     drop_flg : bool
         TrueのときテーブルをいったんDROPして作成しなおす
-    """
-
-    connect_string = "sqlite:///{}".format(dbfile)
-    engine = sqlalchemy.create_engine(connect_string, echo=False) # SQLとデータを出力したい場合はecho=Trueにする
+    warm_cache : int
+        1以上のとき検索前にランキングへの登場回数の多いドキュメントをその件数だけキャッシュに読み込む
+    base_url : str
+        検索先のURL
+    delay : float
+        ページを取得する間隔(秒)
+    retries : int
+        取得に失敗したときの再試行回数
+    output_base_dir : str
+        htmlを出力するフォルダ
+    selectors : dict
+        検索結果を取り出すXPath
+    gzip_flg : bool
+        Trueのときhtmlをgzipで圧縮して保存する
 
+    Returns
+    -------
+    ranking : int
+        処理完了したランキング順位
+    """
+    engine, session = open_db(dbfile, drop_flg)
+    http = create_http_session(pool_size=1, retries=retries)
     try:
-        session = scoped_session(
-                    sessionmaker(
-                        autocommit = False,
-                        autoflush = True,
-                        bind = engine))
-
-        Base.query = session.query_property()
-
-        if drop_flg:
-            Base.metadata.drop_all(engine)
-
-        Base.metadata.create_all(engine)
+        if warm_cache > 0:
+            doc_cache.warm(session, warm_cache)
 
+        ranking = 0
         if len(keywords) > 0 and max_ranking > 0:
-            tab_keywords = "\t".join(keywords)
-            t_search_m = TSearchM()
-            t_search_m.keywords=tab_keywords
-            t_search_m = TSearchM().upsert(t_search_m,session)
-
-            t_search = TSearch()
-            dttime = datetime.now()
-            t_search.search_m_id=t_search_m.id
-            t_search.search_datetime = dttime
-            t_search = TSearch().upsert(t_search,session)
-
-            __search_start(session, t_search, keywords,max_ranking, dttime ,url)
-
+            search_time = datetime.now()
+            results = fetch(http, keywords, max_ranking, search_time, base_url, delay, output_base_dir, selectors, gzip_flg)
+            ranking = __db_upsert(session, keywords, results, search_time, url)
     except Exception:
         raise
     else:
         session.close()
     finally:
+        http.close()
         engine.dispose()
+    return ranking
+
+def __parse_number(value: str, option: str, number_type = int, minimum = 1):
+    """数値のオプション値を変換する。minimum未満の場合はエラーを出力して終了する"""
+    try:
+        ret = number_type(value)
+        if ret < minimum:
+            raise ValueError()
+    except ValueError as _:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        t.insert(0,"[ERROR]:{}オプションの値は{}以上の数を指定してください".format(option, minimum))
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+    return ret
+
 
 def main(argv):
     """メイン処理
@@ -247,6 +494,15 @@ def main(argv):
     keyword = []
     max_ranking = 20
     drop_flg = False
+    warm_cache = 0
+    keyword_file = None
+    workers = 1
+    base_url = DEFAULT_BASE_URL
+    delay = DEFAULT_DELAY
+    retries = DEFAULT_RETRIES
+    selectors = DEFAULT_SELECTORS
+    gzip_flg = False
+    usage = "py RankingCheck.py [--drop] [-m 最大ランキング数] [-u URL] [-o DBファイル名] [--warm-cache 件数] [-f キーワードファイル] [-w 並行キーワード数] [--base-url 検索先URL] [--delay 秒] [--retries 回数] [--selectors セレクタファイル] [--gzip] キーワード1 [キーワード2] [キーワード3] …"
     # 引数処理開始
     try:
         for i,arg in enumerate(argv):
@@ -257,17 +513,31 @@ def main(argv):
                 elif arg == '-u':
                     url = argv[i+1]
                     skip = True
+                elif arg == '-f':
+                    keyword_file = argv[i+1]
+                    skip = True
+                elif arg == '--base-url':
+                    base_url = argv[i+1]
+                    skip = True
+                elif arg == '--selectors':
+                    selectors = load_selectors(argv[i+1])
+                    skip = True
+                elif arg == '--gzip':
+                    gzip_flg = True
                 elif arg == '-m':
-                    try:
-                        max_ranking = int(argv[i+1])
-                        if max_ranking <= 0:
-                            raise ValueError()
-                    except ValueError as _:
-                        (exc_type, exc_value, exc_traceback) = sys.exc_info()
-                        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
-                        t.insert(0,"[ERROR]:mオプションの値は正の整数を指定してください")
-                        pprint.pprint(t, width=120,stream=sys.stderr)
-                        sys.exit(1)
+                    max_ranking = __parse_number(argv[i+1], arg)
+                    skip = True
+                elif arg == '--warm-cache':
+                    warm_cache = __parse_number(argv[i+1], arg)
+                    skip = True
+                elif arg == '-w':
+                    workers = __parse_number(argv[i+1], arg)
+                    skip = True
+                elif arg == '--retries':
+                    retries = __parse_number(argv[i+1], arg, minimum=0)
+                    skip = True
+                elif arg == '--delay':
+                    delay = __parse_number(argv[i+1], arg, float, minimum=0)
                     skip = True
                 elif arg == '--drop':
                     drop_flg = True
@@ -275,22 +545,36 @@ def main(argv):
                     keyword.append(arg)
             else:
                 skip = False
-        if 0 == len(keyword) and drop_flg == False:
+        if 0 == len(keyword) and keyword_file is None and drop_flg == False:
             errlist=[]
             errlist.append("[ERROR]:引数の形がちがいます")
-            errlist.append("py RankingCheck.py [--drop] [-m 最大ランキング数] [-u URL] [-o DBファイル名] キーワード1 [キーワード2] [キーワード3] …")
+            errlist.append(usage)
             pprint.pprint(errlist, width=120,stream=sys.stderr)
             sys.exit(1)
     except IndexError as e:
         (exc_type, exc_value, exc_traceback) = sys.exc_info()
         t = traceback.format_exception(exc_type, exc_value, exc_traceback)
         t.insert(0,"[ERROR]:引数の形がちがいます")
-        t.insert(1,"py RankingCheck.py [--drop] [-m 最大ランキング数] [-u URL] [-o DBファイル名] キーワード1 [キーワード2] [キーワード3] …")
+        t.insert(1,usage)
         pprint.pprint(t, width=120,stream=sys.stderr)
         sys.exit(1)
     # 引数処理完了
 
-    search(keyword, dbfile, url, max_ranking, drop_flg)
+    if keyword_file is None:
+        search(keyword, dbfile, url, max_ranking, drop_flg, warm_cache, base_url, delay, retries, selectors=selectors, gzip_flg=gzip_flg)
+        return
+
+    if keyword_file == '-':
+        keyword_sets = read_keyword_sets(sys.stdin)
+    else:
+        with open(keyword_file, 'r', encoding='UTF-8') as f:
+            keyword_sets = read_keyword_sets(f)
+    if len(keyword) > 0:
+        keyword_sets.insert(0, {"keywords": keyword, "url": None, "max_ranking": None})
+    results = search_batch(keyword_sets, dbfile, url, max_ranking, drop_flg, warm_cache, workers, base_url, delay, retries,
+                           selectors=selectors, gzip_flg=gzip_flg)
+    if len([result for result in results if result["error"] is not None]) > 0:
+        sys.exit(1)
 
 if __name__ == '__main__':
     try:
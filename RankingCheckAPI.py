@@ -4,16 +4,36 @@ import sys
 import os
 import pprint
 import traceback
-import sqlalchemy
-import json
-from sqlalchemy.orm import scoped_session, sessionmaker
+import threading
+from sqlalchemy.orm import scoped_session
 from datetime import datetime
-from sqlalchemy.sql.expression import null
-from RankingModels import Base, TSearchM, TSearch, TRanking, TDoc
+from RankingModels import TSearchM, TSearch, TRanking, TDoc, TRankingSummary, open_db
+from RankingDocCache import doc_cache
+from RankingRateLimiter import TokenBucket, DailyQuota
+from RankingScheduler import SearchScheduler, JobSkipped
+from RankingPlanner import plan
+from RankingKeywords import read_keyword_sets
+from RankingResponseCache import ResponseCache
+from RankingJournal import RunJournal, FETCHED, ARCHIVED, INGESTED
+import RankingArchive
+import RankingCodec
 from googleapiclient.discovery import build
-from time import sleep
+from googleapiclient.http import build_http
+from concurrent.futures import ThreadPoolExecutor
 
-def __db_upsert(dbfile: str, keywords: list[str], response_list: list, my_url: str, drop_flg = False) -> int:
+# 1ページあたりの取得件数
+PAGE_SIZE = 10
+# Custom Search APIで取得できる最大の順位
+MAX_API_RANKING = 100
+# 1秒あたりのAPI呼び出し回数の既定値
+DEFAULT_QPS = 1.0
+# レスポンスの保存形式(json: 検索ごとに1ファイル、ndjson: 1日1ファイルのgzip圧縮したjson lines)
+ARCHIVE_FORMATS = ('json', 'ndjson')
+
+__thread_local = threading.local()
+__usage_lock = threading.Lock()
+
+def __db_upsert(session: scoped_session, keywords: list[str], response_list: list, my_url: str, max_ranking: int = None, search_time: datetime = None, replace: bool = False, summary: bool = True) -> int:
     """DB登録更新処理
 
     Google Search APIのrensponseを元に順位をDBに登録する処理をおこなう
@@ -22,188 +42,845 @@ def __db_upsert(dbfile: str, keywords: list[str], response_list: list, my_url: s
     ----------
     session : scoped_session
         データベース接続のセッション
-    t_search : TSearch
-        検索テーブル
+    keywords : list[str]
+        検索キーワードの配列
     response_list : list
         レスポンスリスト
     my_url : str
         自サイトのURL
+    max_ranking : int
+        何位までランキングを検索する予定だったか。指定した場合は実際に調べた順位を検索テーブルに記録する
+    search_time : datetime
+        検索日時。Noneのときは現在日時
+    replace : bool
+        Trueのとき同じ検索日時のランキングが登録済みなら削除してから登録する
+        (登録済みかどうかわからないレスポンスを登録しなおす場合)
+    summary : bool
+        Falseのとき最新順位集計を更新しない(まとめて登録したあとで呼び出し元が作り直す場合)
 
     Returns
     -------
     ranking : int
         処理完了したランキング順位
     """
-    connect_string = "sqlite:///{}".format(dbfile)
-    engine = sqlalchemy.create_engine(connect_string, echo=False) # SQLとデータを出力したい場合はecho=Trueにする
-
     try:
-        session = scoped_session(
-                    sessionmaker(
-                        autocommit = False,
-                        autoflush = True,
-                        bind = engine))
-    
-        Base.query = session.query_property()
-
-        if drop_flg:
-            Base.metadata.drop_all(engine)
-
-        Base.metadata.create_all(engine)
-
         tab_keywords = "\t".join(keywords)
         t_search_m = TSearchM()
         t_search_m.keywords=tab_keywords
-        t_search_m = TSearchM().upsert(t_search_m,session)
+        t_search_m = TSearchM().upsert(t_search_m,session,commit=False)
 
         t_search = TSearch()
-        dttime = datetime.now()
+        dttime = datetime.now() if search_time is None else search_time
         t_search.search_m_id=t_search_m.id
         t_search.search_datetime = dttime
-        t_search = TSearch().upsert(t_search,session)
-
+        t_search.search_depth = None if max_ranking is None else search_depth(response_list, max_ranking)
+        t_search = TSearch().upsert(t_search,session,commit=False)
 
-
-        ranking = 0
+        # レスポンスからランキング順にドキュメントを洗い出す
+        # 同じURLが二重に出てきた場合は二重計上になるためスキップし順位を進めない
+        doc_dic = {}
         for response in response_list:
             items=response.get("items")
+            if items is None:
+                continue
             for item in items:
-                ranking = ranking + 1
-                link_text=item.get("formattedUrl")
-                doc_title=item.get("title")
-
+                link_text=doc_cache.normalize_url(item.get("formattedUrl"))
+                if link_text in doc_dic:
+                    continue
                 t_doc = TDoc()
                 t_doc.link_url = link_text
-                t_doc.title = doc_title
+                t_doc.title = item.get("title")
                 if len(my_url) > 0 and my_url in link_text:
                     t_doc.mypage_flg = True
                 else:
                     t_doc.mypage_flg = False
-                t_doc = TDoc().upsert(t_doc, session)
-
-                t_ranking = TRanking()
-                t_ranking.search_id = t_search.id
-                t_ranking.ranking = ranking
-                t_ranking.doc_id = t_doc.id
-                has_ranking = TRanking().hasRanking(t_ranking, session)
-                if has_ranking == True:
-                    # 二重にランキング計上されているためインサートせずrankingから1を引いておく
-                    ranking = ranking - 1
-                else:
-                    t_ranking = TRanking().insert(t_ranking, session)
+                doc_dic[link_text] = t_doc
+
+        # ドキュメントはまとめて登録更新し、ランキングは1回のexecutemanyで登録する
+        # キャッシュにないか変更のあったドキュメントだけをデータベースに問い合わせる
+        doc_id_dic = doc_cache.resolve(list(doc_dic.values()), session)
+
+        t_rankings = []
+        for ranking, link_text in enumerate(doc_dic.keys(), start=1):
+            t_ranking = TRanking()
+            t_ranking.search_id = t_search.id
+            t_ranking.ranking = ranking
+            t_ranking.doc_id = doc_id_dic[link_text]
+            t_rankings.append(t_ranking)
+        if replace:
+            session.query(TRanking).filter(TRanking.search_id == t_search.id).delete(synchronize_session=False)
+        TRanking.bulk_insert(t_rankings, session)
+        if summary:
+            TRankingSummary.apply(t_search, t_rankings, session)
+
+        # 検索・ドキュメント・ランキング・最新順位集計を1トランザクションで確定する
+        session.commit()
+        doc_cache.commit()
+        ranking = len(t_rankings)
 
     except Exception:
+        session.rollback()
+        doc_cache.rollback()
         raise
-    else:
-        session.close()
-    finally:
-        engine.dispose()
 
     return ranking
 
 
-def search(apikey: str,engineid: str, keywords: list[str], dbfile: str, my_url: str, max_ranking: int, drop_flg: bool, output_base_dir:str = '.'):
-    """検索処理
+def __thread_http():
+    """スレッドごとのHTTP接続を返す(httplib2.Httpはスレッドセーフではないため)"""
+    http = getattr(__thread_local, "http", None)
+    if http is None:
+        http = build_http()
+        __thread_local.http = http
+    return http
 
-    検索処理をおこない結果をディクショナリの配列に格納し、jsonに保存後、DB登録更新処理を呼び出す。
+
+def __fetch_page(service, engineid: str, search_word: str, start_index: int, limiter: TokenBucket, cache: ResponseCache = None, usage: dict = None) -> dict:
+    """1ページ取得処理
+
+    キャッシュにあればキャッシュを返し、なければレート制限のトークンを取得してから
+    Custom Search APIで1ページ分(10件)の検索結果を取得する。
 
     Parameters
     ----------
-    apikey : str
-        Google APIキー
+    service : Resource
+        Custom Search APIのサービスオブジェクト
     engineid : str
         Search Engine ID
-    keywords : list[str]
-        検索キーワードの配列
-    dbfile : str
-        データベースファイル名
+    search_word : str
+        検索文字列
+    start_index : int
+        取得するページの先頭の順位
+    limiter : TokenBucket
+        APIの呼び出し回数を制限するレート制限
+    cache : ResponseCache
+        レスポンスのキャッシュ。Noneのときはキャッシュを使わない
+    usage : dict
+        指定した場合は"api_calls"に実際にAPIを呼び出した回数を加算する
+
+    Returns
+    -------
+    res : dict
+        APIのレスポンス
+    """
+    # cse().listの全てのパラメータを知りたい場合には以下を参照
+    # https://developers.google.com/custom-search/v1/reference/rest/v1/cse/list?hl=ja
+    # 戻り値は以下を参照
+    # https://developers.google.com/custom-search/v1/reference/rest/v1/Search?hl=ja
+    params = {
+        "q": search_word,
+        "cx": engineid,
+        "lr": 'lang_ja',
+        "num": PAGE_SIZE,
+        "start": start_index
+    }
+    if cache is not None:
+        res = cache.get(params)
+        if res is not None:
+            return res
+
+    limiter.acquire()
+    if usage is not None:
+        with __usage_lock:
+            usage["api_calls"] = usage.get("api_calls", 0) + 1
+    request=service.cse().list(**params)
+    # 複数のスレッドから呼ばれるためスレッドごとのHTTP接続で取得する
+    res = request.execute(http=__thread_http())
+    if cache is not None:
+        cache.put(params, res)
+    return res
+
+
+def __has_next_page(res: dict) -> bool:
+    """レスポンスに次のページがあるか"""
+    next_page = res.get("queries", {}).get("nextPage")
+    if next_page is None or len(next_page) <= 0:
+        return False
+    return next_page[0].get("startIndex") is not None
+
+
+def __found_urls(res: dict, track_urls: set) -> set:
+    """レスポンスの検索結果に含まれる追跡URLの集合を返す"""
+    found = set()
+    for item in res.get("items") or []:
+        link_text = item.get("formattedUrl") or ""
+        link = item.get("link") or ""
+        for track_url in track_urls:
+            if track_url in link_text or track_url in link:
+                found.add(track_url)
+    return found
+
+
+def fetch_pages(service, engineid: str, search_word: str, max_ranking: int, concurrency: int, limiter: TokenBucket, track_urls: list[str] = None, margin: int = 0, cache: ResponseCache = None, usage: dict = None) -> list:
+    """検索結果取得処理
+
+    max_rankingまでのページの先頭の順位(1, 11, 21, …)はあらかじめわかるため、
+    concurrencyが2以上のときはスレッドプールで並行して取得し、順位順に並べなおして返す。
+    あるページで次のページがないことがわかった場合は、それより後ろのページは取得しない(取得済みでも捨てる)。
+    取得に失敗したページがあった場合はそのページより前のページまでを返す。
+
+    track_urlsを指定した場合は、concurrencyページずつ取得しながら追跡URLを探し、
+    すべて見つかったページからmarginページ先までで取得を打ち切る。
+
+    Parameters
+    ----------
+    service : Resource
+        Custom Search APIのサービスオブジェクト
+    engineid : str
+        Search Engine ID
+    search_word : str
+        検索文字列
     max_ranking : int
         何位までランキングを検索するか
-    drop_flg : bool
-        TrueのときテーブルをいったんDROPして作成しなおす
+    concurrency : int
+        並行して取得するスレッド数
+    limiter : TokenBucket
+        APIの呼び出し回数を制限するレート制限
+    track_urls : list[str]
+        順位を知りたいURLのリスト。Noneまたは空のときは打ち切らずmax_rankingまで取得する
+    margin : int
+        追跡URLがすべて見つかったあとに余分に取得するページ数
+    cache : ResponseCache
+        レスポンスのキャッシュ。Noneのときはキャッシュを使わない
+    usage : dict
+        指定した場合は"api_calls"に実際にAPIを呼び出した回数を加算する
+
+    Returns
+    -------
+    response : list[dict]
+        順位順に並んだAPIのレスポンスのリスト
     """
-    if len(keywords) == 0:
-        return 0
-    if max_ranking <= 0:
+    # Custom Search APIは100位までしか取得できない
+    start_indexes = list(range(1, PAGE_SIZE * page_count(max_ranking) + 1, PAGE_SIZE))
+
+    remaining_urls = set(track_urls) if track_urls is not None else set()
+    adaptive = len(remaining_urls) > 0
+    # 追跡URLを探す場合は並行数ずつ取得して、見つかった時点で打ち切れるようにする
+    wave_size = max(1, concurrency) if adaptive else len(start_indexes)
+
+    # 次のページがないとわかった先頭の順位。これより後ろのページは取得しない
+    last_index = [start_indexes[-1] if len(start_indexes) > 0 else 0]
+    lock = threading.Lock()
+
+    def fetch(start_index):
+        with lock:
+            if start_index > last_index[0]:
+                return None
+        try:
+            res = __fetch_page(service, engineid, search_word, start_index, limiter, cache, usage)
+        except Exception:
+            with lock:
+                last_index[0] = min(last_index[0], start_index)
+            raise
+        if not __has_next_page(res):
+            with lock:
+                last_index[0] = min(last_index[0], start_index)
+        return res
+
+    response = []
+    pos = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        while pos < len(start_indexes):
+            wave = start_indexes[pos:pos + wave_size]
+            pos = pos + len(wave)
+            futures = [executor.submit(fetch, start_index) for start_index in wave]
+            stop = False
+            for future in futures:
+                try:
+                    res = future.result()
+                except Exception as e:
+                    (exc_type, exc_value, exc_traceback) = sys.exc_info()
+                    t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+                    pprint.pprint(t, width=120,stream=sys.stderr)
+                    stop = True
+                    break
+                if res is None:
+                    stop = True
+                    break
+                response.append(res)
+                if not __has_next_page(res):
+                    stop = True
+                    break
+                if adaptive and len(remaining_urls) > 0:
+                    remaining_urls = remaining_urls - __found_urls(res, remaining_urls)
+                    if len(remaining_urls) == 0:
+                        # 追跡URLがすべて見つかったのでmarginページ先までで打ち切る
+                        start_indexes = start_indexes[:len(response) + margin]
+            # 不要になったページの取得を取り消す
+            for future in futures:
+                future.cancel()
+            if stop:
+                break
+
+    return response
+
+
+def search_depth(response: list, max_ranking: int) -> int:
+    """調査深さ取得処理
+
+    検索結果をどの順位まで実際に調べたかを返す。
+    最後まで取得したか、次のページがなく検索結果が尽きた場合はmax_ranking(APIで取得できる上限まで)を返し、
+    途中で打ち切った場合は最後に取得したページの最後の順位を返す。
+    この順位より深いところは「調べていない」、浅いところで出てこないものは「ランク外」と判断できる。
+
+    Parameters
+    ----------
+    response : list[dict]
+        順位順に並んだAPIのレスポンスのリスト
+    max_ranking : int
+        何位までランキングを検索する予定だったか
+
+    Returns
+    -------
+    depth : int
+        調べた順位
+    """
+    full_depth = min(max_ranking, MAX_API_RANKING)
+    if len(response) == 0:
         return 0
+    if len(response) >= page_count(max_ranking) or not __has_next_page(response[-1]):
+        return full_depth
+    start_index = response[-1].get("queries", {}).get("request", [{}])[0].get("startIndex", PAGE_SIZE * (len(response) - 1) + 1)
+    return min(full_depth, start_index + len(response[-1].get("items") or []) - 1)
 
-    search_time = datetime.now()
 
-    service = build("customsearch", "v1", developerKey=apikey)
+def page_count(max_ranking: int) -> int:
+    """max_rankingまで検索するために必要なページ数(APIの呼び出し回数)"""
+    return len(range(1, min(max_ranking, MAX_API_RANKING) + 1, PAGE_SIZE))
+
+
+def fetch(service, engineid: str, keywords: list[str], max_ranking: int, concurrency: int = 1, limiter: TokenBucket = None, track_urls: list[str] = None, margin: int = 0, cache: ResponseCache = None, usage: dict = None) -> list:
+    """検索結果取得処理
+
+    キーワードから検索文字列を組み立てて、max_rankingまでの検索結果を取得する。
+
+    Parameters
+    ----------
+    service : Resource
+        Custom Search APIのサービスオブジェクト
+    engineid : str
+        Search Engine ID
+    keywords : list[str]
+        検索キーワードの配列
+    max_ranking : int
+        何位までランキングを検索するか
+    concurrency : int
+        ページを並行して取得するスレッド数。1のときは1ページずつ順に取得する
+    limiter : TokenBucket
+        APIの呼び出し回数を制限するレート制限。Noneのときは1秒に1回に制限する
+    track_urls : list[str]
+        順位を知りたいURLのリスト。指定した場合はすべて見つかった時点で取得を打ち切る
+    margin : int
+        追跡URLがすべて見つかったあとに余分に取得するページ数
+    cache : ResponseCache
+        レスポンスのキャッシュ。Noneのときはキャッシュを使わない
+    usage : dict
+        指定した場合は"api_calls"に実際にAPIを呼び出した回数を加算する
 
+    Returns
+    -------
+    response : list[dict]
+        順位順に並んだAPIのレスポンスのリスト
+    """
     search_word=""
     for keyword in keywords:
         #search_word = "{} \"{}\"".format(search_word,keyword)
         search_word = search_word + " " + keyword
-    
-    wordjoin = "_".join(keywords)
 
-    page_limit = 10
-    start_index = 1
     # APIのレスポンスを格納する配列
-    # ここに10ページ分の検索結果のjsonレスポンスが配列として格納される。
-    response = []
-    for n_page in range(0,page_limit):
-        try:
-            sleep(1)
-            # cse().listの全てのパラメータを知りたい場合には以下を参照
-            # https://developers.google.com/custom-search/v1/reference/rest/v1/cse/list?hl=ja
-            # 戻り値は以下を参照
-            # https://developers.google.com/custom-search/v1/reference/rest/v1/Search?hl=ja
-            res=service.cse().list(
-                q=search_word,
-                cx=engineid,
-                lr='lang_ja',
-                num=10,
-                start=start_index
-            ).execute()
-            response.append(res)
-            # start_indexを自ページのトップに設定
-            next_page = res.get("queries").get("nextPage")
-            if next_page is None:
-                break
-            elif len(next_page) <= 0:
-                break
-            start_index = next_page[0].get("startIndex")
-            if start_index is not None:
-                if max_ranking < start_index:
-                    # 調べたい順位まで調べたらbreak
-                    break
-            else:
-                # 10ページ未満で終わる場合例外は発生しここでbreakする
-                break
-        except Exception as e:
-            (exc_type, exc_value, exc_traceback) = sys.exc_info()
-            t = traceback.format_exception(exc_type, exc_value, exc_traceback)
-            pprint.pprint(t, width=120,stream=sys.stderr)
-            break
+    # ここに最大10ページ分の検索結果のjsonレスポンスが順位順に配列として格納される。
+    if limiter is None:
+        limiter = TokenBucket(DEFAULT_QPS)
+    return fetch_pages(service, engineid, search_word, max_ranking, concurrency, limiter, track_urls, margin, cache, usage)
+
+
+def slim_response(response: list) -> list:
+    """レスポンス縮小処理
+
+    APIのレスポンスからDB登録と調査深さの判定に使う項目だけを残す。
+    pagemapやhtmlSnippetなどの大きな項目は捨てる。
+
+    Parameters
+    ----------
+    response : list[dict]
+        順位順に並んだAPIのレスポンスのリスト
+
+    Returns
+    -------
+    slim : list[dict]
+        items(formattedUrl, link, title, rank)とqueries(request, nextPageのsearchTerms, startIndex)だけを持つレスポンスのリスト。
+        rankはAPIが返した順位(同じURLの重複を除く前)
+    """
+    slim = []
+    for res in response:
+        queries = res.get("queries", {})
+        request = queries.get("request", [{}])[0]
+        start_index = request.get("startIndex", 1)
+        slim_queries = {"request": [{"searchTerms": request.get("searchTerms"), "startIndex": start_index}]}
+        if "nextPage" in queries:
+            slim_queries["nextPage"] = [{"startIndex": page.get("startIndex")} for page in queries["nextPage"]]
+        slim.append({
+            "items": [
+                {"formattedUrl": item.get("formattedUrl"), "link": item.get("link"), "title": item.get("title"), "rank": start_index + i}
+                for i, item in enumerate(res.get("items") or [])
+            ],
+            "queries": slim_queries,
+        })
+    return slim
+
+
+def save_response(keywords: list[str], search_time: datetime, response: list, output_base_dir: str = '.', max_ranking: int = None, archive_format: str = 'json', slim: bool = False, cold_dir: str = None) -> str:
+    """レスポンス保存処理
+
+    検索結果のレスポンスを日付のフォルダの下にjsonで保存する。
+    archive_formatがndjsonのときは日付ごとのresponses.ndjson.gzに1行追記する。
+    slimがTrueのときはslim_responseで縮小したレスポンスを保存し、
+    cold_dirを指定した場合は縮小前のレスポンスをcold_dirの日付ごとのresponses.ndjson.gzに追記する。
+
+    Parameters
+    ----------
+    keywords : list[str]
+        検索キーワードの配列
+    search_time : datetime
+        検索を開始した日時
+    response : list[dict]
+        APIのレスポンスのリスト
+    output_base_dir : str
+        jsonを出力するフォルダ
+    max_ranking : int
+        何位までランキングを検索する予定だったか(再登録時に調査深さを求めるために保存する)
+    archive_format : str
+        保存形式(ARCHIVE_FORMATSのいずれか)
+    slim : bool
+        Trueのときレスポンスを縮小して保存する
+    cold_dir : str
+        縮小前のレスポンスを保存するフォルダ。Noneのときは縮小前のレスポンスを保存しない
+
+    Returns
+    -------
+    output_file : str
+        保存したファイル名。ndjsonのときはアーカイブ内のレコードの位置指定子
+    """
+    wordjoin = "_".join(keywords)
 
     # ランキングjsonデータ文字列生成
     ranking_datetime=search_time.strftime('%Y-%m-%d %H:%M:%S.%f')
     ranking_json = {
         'ranking_datetime': ranking_datetime,
+        'keywords': keywords,
+        'max_ranking': max_ranking,
         'response': response
     }
-    json_output_string = json.dumps(ranking_json, ensure_ascii=False)
+    if slim:
+        if cold_dir is not None:
+            cold_path = RankingArchive.archive_path(cold_dir, search_time.strftime('%Y-%m-%d'))
+            ranking_json['cold'] = RankingArchive.append(cold_path, ranking_json, "\t".join(keywords))
+        ranking_json['response'] = slim_response(response)
+        ranking_json['slim'] = True
+    if archive_format == 'ndjson':
+        path = RankingArchive.archive_path(output_base_dir, search_time.strftime('%Y-%m-%d'))
+        return RankingArchive.append(path, ranking_json, "\t".join(keywords))
+
+    json_output = RankingCodec.dumps(ranking_json)
 
     # フォルダ作成
-    output_dir = os.path.join(search_time.strftime('%Y-%m-%d'),"Data")
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    output_dir = os.path.join(output_base_dir, search_time.strftime('%Y-%m-%d'),"Data")
+    os.makedirs(output_dir, exist_ok=True)
 
     # ファイル名取得
-    output_file = os.path.join(output_base_dir, output_dir ,'response-' + wordjoin + '-' + search_time.strftime('%Y%m%d%H%M%S')+'.json')
+    output_file = os.path.join(output_dir ,'response-' + wordjoin + '-' + search_time.strftime('%Y%m%d%H%M%S')+'.json')
 
     # ファイル書き込み
-    with open(output_file, 'w', encoding='UTF-8') as f:
-        f.write(json_output_string)
+    with open(output_file, 'wb') as f:
+        f.write(json_output)
+
+    return output_file
+
+
+def load_response(output_file: str) -> dict:
+    """レスポンス読み込み処理
+
+    save_responseで保存したjsonを読み込む。
+
+    Parameters
+    ----------
+    output_file : str
+        save_responseで保存したファイル名(またはアーカイブ内のレコードの位置指定子)
+
+    Returns
+    -------
+    ranking_json : dict
+        search_time(検索を開始した日時)、keywords、max_ranking、responseを持つディクショナリ
+        (keywordsとmax_rankingは古いjsonでは記録されていないためNone)
+    """
+    if RankingArchive.parse_locator(output_file) is not None:
+        ranking_json = RankingArchive.read(output_file)
+    else:
+        with open(output_file, 'rb') as f:
+            ranking_json = RankingCodec.loads(f.read())
+    return {
+        "search_time": datetime.strptime(ranking_json["ranking_datetime"], '%Y-%m-%d %H:%M:%S.%f'),
+        "keywords": ranking_json.get("keywords"),
+        "max_ranking": ranking_json.get("max_ranking"),
+        "response": ranking_json["response"],
+    }
+
+
+def response_exists(output_file: str) -> bool:
+    """save_responseで保存したファイル(またはアーカイブ内のレコード)が存在するか"""
+    if RankingArchive.parse_locator(output_file) is not None:
+        return RankingArchive.exists(output_file)
+    return os.path.exists(output_file)
+
+
+def ingest(session: scoped_session, keywords: list[str], response: list, my_url: str, max_ranking: int = None, search_time: datetime = None, replace: bool = False, summary: bool = True) -> int:
+    """登録処理
+
+    検索結果のレスポンスをDBに登録する。DB登録更新処理を外部のモジュールから呼び出すための関数。
+
+    Parameters
+    ----------
+    session : scoped_session
+        データベース接続のセッション
+    keywords : list[str]
+        検索キーワードの配列
+    response : list[dict]
+        APIのレスポンスのリスト
+    my_url : str
+        自サイトのURL
+    max_ranking : int
+        何位までランキングを検索する予定だったか。指定した場合は調査深さを記録する
+    search_time : datetime
+        検索日時。Noneのときは現在日時
+    replace : bool
+        Trueのとき同じ検索日時のランキングが登録済みなら削除してから登録する
+    summary : bool
+        Falseのとき最新順位集計を更新しない。呼び出し元で登録したキーワードセットのTRankingSummary.rebuildを呼び出すこと
+
+    Returns
+    -------
+    ranking : int
+        処理完了したランキング順位
+    """
+    return __db_upsert(session, keywords, response, my_url, max_ranking, search_time, replace, summary)
+
+
+def search(apikey: str,engineid: str, keywords: list[str], dbfile: str, my_url: str, max_ranking: int, drop_flg: bool, output_base_dir:str = '.', service = None, session: scoped_session = None, concurrency: int = 1, limiter: TokenBucket = None, track_urls: list[str] = None, margin: int = 0, cache: ResponseCache = None, archive_format: str = 'json', slim: bool = False, cold_dir: str = None):
+    """検索処理
+
+    検索処理をおこない結果をディクショナリの配列に格納し、jsonに保存後、DB登録更新処理を呼び出す。
+
+    Parameters
+    ----------
+    apikey : str
+        Google APIキー
+    engineid : str
+        Search Engine ID
+    keywords : list[str]
+        検索キーワードの配列
+    dbfile : str
+        データベースファイル名
+    max_ranking : int
+        何位までランキングを検索するか
+    drop_flg : bool
+        TrueのときテーブルをいったんDROPして作成しなおす
+    output_base_dir : str
+        jsonを出力するフォルダ
+    service : Resource
+        Custom Search APIのサービスオブジェクト。Noneのときはこの検索のために作成する
+    session : scoped_session
+        データベース接続のセッション。Noneのときはこの検索のためにdbfileへ接続する
+        (指定した場合はdbfileとdrop_flgは使われない)
+    concurrency : int
+        ページを並行して取得するスレッド数。1のときは1ページずつ順に取得する
+    limiter : TokenBucket
+        APIの呼び出し回数を制限するレート制限。Noneのときは1秒に1回に制限する
+    track_urls : list[str]
+        順位を知りたいURLのリスト。指定した場合はすべて見つかった時点で取得を打ち切る
+    margin : int
+        追跡URLがすべて見つかったあとに余分に取得するページ数
+    cache : ResponseCache
+        レスポンスのキャッシュ。Noneのときはキャッシュを使わない
+    archive_format : str
+        レスポンスの保存形式(ARCHIVE_FORMATSのいずれか)
+    slim : bool
+        Trueのときレスポンスを縮小して保存する
+    cold_dir : str
+        slimがTrueのとき縮小前のレスポンスを保存するフォルダ
+
+    Returns
+    -------
+    ranking : int
+        処理完了したランキング順位
+    """
+    if len(keywords) == 0:
+        return 0
+    if max_ranking <= 0:
+        return 0
+
+    search_time = datetime.now()
+
+    if service is None:
+        service = build("customsearch", "v1", developerKey=apikey)
+
+    response = fetch(service, engineid, keywords, max_ranking, concurrency, limiter, track_urls, margin, cache)
+
+    save_response(keywords, search_time, response, output_base_dir, max_ranking, archive_format, slim, cold_dir)
 
     # 検索結果のDB登録更新処理
-    ranking = __db_upsert(dbfile, keywords, response, my_url, output_base_dir, drop_flg)
+    if session is not None:
+        return __db_upsert(session, keywords, response, my_url, max_ranking, search_time)
+
+    engine, session = open_db(dbfile, drop_flg)
+    try:
+        ranking = __db_upsert(session, keywords, response, my_url, max_ranking, search_time)
+    except Exception:
+        raise
+    else:
+        session.close()
+    finally:
+        engine.dispose()
 
     return ranking
 
 
+def search_batch(apikey: str, engineid: str, keyword_sets: list[dict], dbfile: str, my_url: str, max_ranking: int, drop_flg: bool, output_base_dir: str = '.', report = sys.stdout, concurrency: int = 1, limiter: TokenBucket = None, workers: int = 1, quota: DailyQuota = None, progress_interval: float = 0, track_urls: list[str] = None, margin: int = 0, cache: ResponseCache = None, journal: RunJournal = None, archive_format: str = 'json', slim: bool = False, cold_dir: str = None) -> list[dict]:
+    """一括検索処理
+
+    複数のキーワードセットをSearchSchedulerで検索する。
+    取得はworkers個のスレッドで並行しておこない、DBへの登録は1つの書き込みスレッドで順におこなう。
+    Custom Search APIのサービスオブジェクト、データベースのエンジンとセッション、レート制限は全キーワードセットで共有する。
+    1つのキーワードセットで失敗しても残りのキーワードセットの検索は続ける。
+
+    journalを指定した場合はキーワードセットごとの進み具合を記録し、
+    既に登録済み(ingested)のキーワードセットは検索せず、保存済み(archived)のキーワードセットは
+    APIを呼ばずに保存したjsonから登録する。
+
+    Parameters
+    ----------
+    apikey : str
+        Google APIキー
+    engineid : str
+        Search Engine ID
+    keyword_sets : list[dict]
+        read_keyword_setsで読み込んだキーワードセットのリスト
+    dbfile : str
+        データベースファイル名
+    my_url : str
+        自サイトのURL(キーワードセットにurlがない場合に使う)
+    max_ranking : int
+        何位までランキングを検索するか(キーワードセットにmax_rankingがない場合に使う)
+    drop_flg : bool
+        Trueのとき最初にテーブルをいったんDROPして作成しなおす
+    output_base_dir : str
+        jsonを出力するフォルダ
+    report : TextIO
+        キーワードセットごとの結果をタブ区切りで出力する先。Noneのときは出力しない
+    concurrency : int
+        1つのキーワードセットのページを並行して取得するスレッド数
+    limiter : TokenBucket
+        全キーワードセットで共有するAPIのレート制限。Noneのときは1秒に1回に制限する
+    workers : int
+        キーワードセットを並行して取得するスレッド数
+    quota : DailyQuota
+        1日あたりのAPIの呼び出し回数の上限。上限に達した後のキーワードセットはスキップする。Noneのときは制限しない
+    progress_interval : float
+        0より大きいとき、その秒数ごとに進捗を標準エラー出力に出力する
+    track_urls : list[str]
+        順位を知りたいURLのリスト。指定した場合はキーワードセットの自サイトのURLとあわせて、
+        すべて見つかった時点で取得を打ち切る
+    margin : int
+        追跡URLがすべて見つかったあとに余分に取得するページ数
+    cache : ResponseCache
+        レスポンスのキャッシュ。Noneのときはキャッシュを使わない
+    journal : RunJournal
+        実行ジャーナル。Noneのときは記録しない
+    archive_format : str
+        レスポンスの保存形式(ARCHIVE_FORMATSのいずれか)
+    slim : bool
+        Trueのときレスポンスを縮小して保存する
+    cold_dir : str
+        slimがTrueのとき縮小前のレスポンスを保存するフォルダ
+
+    Returns
+    -------
+    results : list[dict]
+        キーワードセットごとのkeywords, ranking, error, skipped, resumedを持つディクショナリのリスト
+        (resumedは前回の実行で登録済みのため何もしなかった場合True)
+    """
+    service = build("customsearch", "v1", developerKey=apikey)
+    engine, session = open_db(dbfile, drop_flg)
+    if limiter is None:
+        limiter = TokenBucket(DEFAULT_QPS)
+
+    jobs = []
+    done = {}
+    for index, keyword_set in enumerate(keyword_sets):
+        set_url = keyword_set.get("url")
+        set_max_ranking = keyword_set.get("max_ranking")
+        job = {
+            "keywords": keyword_set["keywords"],
+            "url": my_url if set_url is None else set_url,
+            "max_ranking": max_ranking if set_max_ranking is None else int(set_max_ranking),
+            "archive": None,
+        }
+        record = None if journal is None else journal.state(job["keywords"])
+        if record is not None and record["state"] == INGESTED:
+            # 前回の実行で登録済み
+            done[index] = (job, record.get("ranking", 0))
+            continue
+        if record is not None and record["state"] == ARCHIVED and response_exists(record.get("archive", "")):
+            # 前回の実行で保存済みだが登録されていない
+            job["archive"] = record["archive"]
+        job["index"] = index
+        jobs.append(job)
+
+    def fetch_job(job):
+        if job["archive"] is not None:
+            # APIを呼ばずに保存したjsonから登録しなおす
+            fetched = load_response(job["archive"])
+            fetched["replace"] = True
+            return fetched
+        pages = page_count(job["max_ranking"])
+        if quota is not None and not quota.reserve(pages):
+            raise JobSkipped("1日のAPI呼び出し回数の上限に達しました")
+        search_time = datetime.now()
+        job_track_urls = None
+        if track_urls is not None:
+            job_track_urls = list(track_urls) + ([job["url"]] if len(job["url"]) > 0 else [])
+        usage = {"api_calls": 0}
+        response = fetch(service, engineid, job["keywords"], job["max_ranking"], concurrency, limiter, job_track_urls, margin, cache, usage)
+        if quota is not None:
+            # 途中で終わった場合やキャッシュにあった場合は使わなかった分を返す
+            quota.release(pages - usage["api_calls"])
+        if journal is not None:
+            journal.record(job["keywords"], FETCHED, search_datetime=search_time.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        output_file = save_response(job["keywords"], search_time, response, output_base_dir, job["max_ranking"], archive_format, slim, cold_dir)
+        if journal is not None:
+            journal.record(job["keywords"], ARCHIVED, archive=output_file)
+        return {"search_time": search_time, "max_ranking": job["max_ranking"], "response": response, "replace": False}
+
+    def write_job(job, fetched):
+        ranking = __db_upsert(session, job["keywords"], fetched["response"], job["url"], fetched["max_ranking"],
+                              fetched["search_time"], fetched["replace"])
+        if journal is not None:
+            journal.record(job["keywords"], INGESTED, ranking=ranking)
+        return ranking
+
+    def report_job(job_result):
+        error = job_result["error"]
+        if job_result["skipped"]:
+            status = "SKIPPED"
+        elif error is not None:
+            t = traceback.format_exception(type(error), error, error.__traceback__)
+            t.insert(0,"[ERROR]:{}".format(" ".join(job_result["job"]["keywords"])))
+            pprint.pprint(t, width=120,stream=sys.stderr)
+            status = "ERROR " + repr(error)
+        else:
+            status = "OK"
+        if report is not None:
+            report.write("{}\t{}\t{}\n".format(
+                " ".join(job_result["job"]["keywords"]), job_result["result"] or 0, status))
+            report.flush()
+
+    if report is not None:
+        for job, ranking in done.values():
+            report.write("{}\t{}\t{}\n".format(" ".join(job["keywords"]), ranking, "DONE"))
+        report.flush()
+
+    scheduler = SearchScheduler(fetch_job, write_job, workers=workers, report_func=report_job)
+    try:
+        job_results = scheduler.run(jobs, progress_interval=progress_interval)
+    finally:
+        session.close()
+        engine.dispose()
+
+    results = [None] * len(keyword_sets)
+    for index, (job, ranking) in done.items():
+        results[index] = {"keywords": job["keywords"], "ranking": ranking, "error": None, "skipped": False, "resumed": True}
+    for job_result in job_results:
+        error = job_result["error"]
+        results[job_result["job"]["index"]] = {
+            "keywords": job_result["job"]["keywords"],
+            "ranking": job_result["result"] or 0,
+            "error": None if error is None or job_result["skipped"] else repr(error),
+            "skipped": job_result["skipped"],
+            "resumed": False,
+        }
+    return results
+
+
+def __parse_positive_int(value: str, option: str) -> int:
+    """正の整数のオプション値を変換する。正の整数でない場合はエラーを出力して終了する"""
+    try:
+        ret = int(value)
+        if ret <= 0:
+            raise ValueError()
+    except ValueError as _:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        t.insert(0,"[ERROR]:{}オプションの値は正の整数を指定してください".format(option))
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+    return ret
+
+
+def __warm_doc_cache(dbfile: str, limit: int) -> int:
+    """ドキュメントIDキャッシュ暖機処理
+
+    データベースからランキングへの登場回数の多いドキュメントをキャッシュに読み込む
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    limit : int
+        読み込む最大件数
+
+    Returns
+    -------
+    count : int
+        読み込んだ件数
+    """
+    engine, session = open_db(dbfile)
+    try:
+        count = doc_cache.warm(session, limit)
+        session.close()
+    finally:
+        engine.dispose()
+    return count
+
+
+def __plan_keyword_sets(dbfile: str, keyword_sets: list[dict], budget: int, max_ranking: int) -> list[dict]:
+    """検索計画作成処理
+
+    過去の検索履歴をもとに予算の範囲でキーワードセットごとのページ数と検索順を決める
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    keyword_sets : list[dict]
+        read_keyword_setsで読み込んだキーワードセットのリスト
+    budget : int
+        使えるAPI呼び出し回数
+    max_ranking : int
+        何位までランキングを検索するか
+
+    Returns
+    -------
+    planned : list[dict]
+        RankingPlanner.planの戻り値
+    """
+    engine, session = open_db(dbfile)
+    try:
+        planned = plan(session, keyword_sets, budget, max_ranking)
+        session.close()
+    finally:
+        engine.dispose()
+    return planned
+
+
 def main(argv):
     """メイン処理
 
@@ -222,6 +899,27 @@ def main(argv):
     drop_flg = False
     apikey = ""
     engineid = ""
+    warm_cache = 0
+    cache_stats_flg = False
+    keyword_file = None
+    concurrency = 1
+    qps = DEFAULT_QPS
+    workers = 1
+    daily_quota = 0
+    progress_interval = 0
+    budget = 0
+    plan_only_flg = False
+    adaptive_flg = False
+    track_urls = []
+    margin = 0
+    cache_dir = None
+    cache_ttl = 86400
+    cache_max_mb = 1024
+    journal_file = None
+    resume_flg = False
+    archive_format = 'json'
+    slim_flg = False
+    cold_dir = None
     # 引数処理開始
     try:
         for i,arg in enumerate(argv):
@@ -233,7 +931,74 @@ def main(argv):
                     apikey = argv[i+1]
                     skip = True
                 elif arg == '--engineid':
-                    key = argv[i+1]
+                    engineid = argv[i+1]
+                    skip = True
+                elif arg == '-f':
+                    keyword_file = argv[i+1]
+                    skip = True
+                elif arg == '-c':
+                    concurrency = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '-w':
+                    workers = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--daily-quota':
+                    daily_quota = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--progress':
+                    progress_interval = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--budget':
+                    budget = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--plan-only':
+                    plan_only_flg = True
+                elif arg == '--adaptive':
+                    adaptive_flg = True
+                elif arg == '-t':
+                    track_urls.append(argv[i+1])
+                    skip = True
+                elif arg == '--margin':
+                    margin = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--cache-dir':
+                    cache_dir = argv[i+1]
+                    skip = True
+                elif arg == '--cache-ttl':
+                    cache_ttl = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--cache-max-mb':
+                    cache_max_mb = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--journal':
+                    journal_file = argv[i+1]
+                    skip = True
+                elif arg == '--resume':
+                    resume_flg = True
+                elif arg == '--slim':
+                    slim_flg = True
+                elif arg == '--cold-dir':
+                    cold_dir = argv[i+1]
+                    skip = True
+                elif arg == '--archive':
+                    archive_format = argv[i+1]
+                    if archive_format not in ARCHIVE_FORMATS:
+                        errlist=[]
+                        errlist.append("[ERROR]:--archiveオプションの値は{}のいずれかを指定してください".format(", ".join(ARCHIVE_FORMATS)))
+                        pprint.pprint(errlist, width=120,stream=sys.stderr)
+                        sys.exit(1)
+                    skip = True
+                elif arg == '--qps':
+                    try:
+                        qps = float(argv[i+1])
+                        if qps <= 0:
+                            raise ValueError()
+                    except ValueError as _:
+                        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+                        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+                        t.insert(0,"[ERROR]:--qpsオプションの値は正の数を指定してください")
+                        pprint.pprint(t, width=120,stream=sys.stderr)
+                        sys.exit(1)
                     skip = True
                 elif arg == '-u':
                     url = argv[i+1]
@@ -252,24 +1017,61 @@ def main(argv):
                     skip = True
                 elif arg == '--drop':
                     drop_flg = True
+                elif arg == '--warm-cache':
+                    warm_cache = __parse_positive_int(argv[i+1], arg)
+                    skip = True
+                elif arg == '--cache-stats':
+                    cache_stats_flg = True
                 else:
                     keyword.append(arg)
             else:
                 skip = False
-        if 0 == len(keyword) and drop_flg == False:
+        if 0 == len(keyword) and keyword_file is None and drop_flg == False:
             errlist=[]
             errlist.append("[ERROR]:引数の形がちがいます")
             errlist.append("py RankingCheckAPI.py [--drop] [-m 最大ランキング数] [-u URL] [-db DBファイル名] キーワード1 [キーワード2] [キーワード3] …")
+            errlist.append("py RankingCheckAPI.py [--drop] [-m 最大ランキング数] [-u URL] [-db DBファイル名] -f キーワードファイル(-で標準入力)")
             pprint.pprint(errlist, width=120,stream=sys.stderr)
             sys.exit(1)
     except IndexError as e:
         (exc_type, exc_value, exc_traceback) = sys.exc_info()
         t = traceback.format_exception(exc_type, exc_value, exc_traceback)
         t.insert(0,"[ERROR]:引数の形がちがいます")
-        t.insert(1,"py RankingCheckAPI.py [--drop] [--apikey GCPのAPIキー] [--engineid GCP検索エンジンID] [-m 最大ランキング数] [-u URL] [-db DBファイル名] キーワード1 [キーワード2] [キーワード3] …")
+        t.insert(1,"py RankingCheckAPI.py [--drop] [--apikey GCPのAPIキー] [--engineid GCP検索エンジンID] [-m 最大ランキング数] [-u URL] [-db DBファイル名] [--warm-cache 件数] [--cache-stats] [-f キーワードファイル] [-c 並行取得数] [--qps 1秒あたりの呼び出し回数] [-w 並行キーワード数] [--daily-quota 1日の呼び出し回数] [--progress 秒] [--budget 呼び出し回数 [--plan-only]] [--adaptive [-t 追跡URL]… [--margin ページ数]] [--cache-dir キャッシュフォルダ [--cache-ttl 秒] [--cache-max-mb MB]] [--journal ジャーナルファイル [--resume]] [--archive json|ndjson] [--slim [--cold-dir 元のレスポンスの保存先]] [キーワード1] [キーワード2] [キーワード3] …")
         pprint.pprint(t, width=120,stream=sys.stderr)
         sys.exit(1)
     # 引数処理完了
+    if warm_cache > 0 and drop_flg == False:
+        __warm_doc_cache(dbfile, warm_cache)
+
+    keyword_sets = None
+    if keyword_file is not None:
+        if keyword_file == '-':
+            keyword_sets = read_keyword_sets(sys.stdin)
+        else:
+            with open(keyword_file, 'r', encoding='UTF-8') as f:
+                keyword_sets = read_keyword_sets(f)
+        if len(keyword) > 0:
+            # コマンドラインのキーワードも1つのキーワードセットとして先頭で検索する
+            keyword_sets.insert(0, {"keywords": keyword, "url": None, "max_ranking": None})
+
+    skipped_sets = []
+    if budget > 0 and keyword_sets is not None:
+        keyword_sets = __plan_keyword_sets(dbfile, keyword_sets, budget, max_ranking)
+        skipped_sets = [keyword_set for keyword_set in keyword_sets if keyword_set["pages"] == 0]
+        keyword_sets = [keyword_set for keyword_set in keyword_sets if keyword_set["pages"] > 0]
+        if plan_only_flg:
+            for keyword_set in keyword_sets + skipped_sets:
+                print("{}\t{}\t{:.3f}\t{}".format(
+                    " ".join(keyword_set["keywords"]), keyword_set["pages"], keyword_set["priority"], keyword_set["reason"]))
+            return
+
+    if resume_flg and journal_file is None:
+        errlist=[]
+        errlist.append("[ERROR]:resumeオプションを指定する場合はjournalオプションでジャーナルファイルを指定してください")
+        pprint.pprint(errlist, width=120,stream=sys.stderr)
+        sys.exit(1)
+
     if len(apikey) == 0:
         apikey=os.environ.get('GCP_CUSTOM_SEARCH_API_KEY')
         if apikey is None:
@@ -285,7 +1087,51 @@ def main(argv):
             pprint.pprint(errlist, width=120,stream=sys.stderr)
             sys.exit(1)
 
-    search(apikey, engineid, keyword, dbfile, url, max_ranking, drop_flg)
+    limiter = TokenBucket(qps, max(1, int(qps)))
+    if adaptive_flg:
+        if len(track_urls) == 0 and len(url) == 0:
+            errlist=[]
+            errlist.append("[ERROR]:adaptiveオプションを指定する場合はuオプションかtオプションで追跡するURLを指定してください")
+            pprint.pprint(errlist, width=120,stream=sys.stderr)
+            sys.exit(1)
+    else:
+        track_urls = None
+    cache = None
+    if cache_dir is not None:
+        cache = ResponseCache(cache_dir, cache_ttl, cache_max_mb * 1024 * 1024)
+    if keyword_sets is None:
+        search_track_urls = None
+        if track_urls is not None:
+            search_track_urls = track_urls + ([url] if len(url) > 0 else [])
+        search(apikey, engineid, keyword, dbfile, url, max_ranking, drop_flg, concurrency=concurrency, limiter=limiter,
+               track_urls=search_track_urls, margin=margin, cache=cache, archive_format=archive_format,
+               slim=slim_flg, cold_dir=cold_dir)
+        error_count = 0
+    else:
+        quota = DailyQuota(daily_quota) if daily_quota > 0 else None
+        journal = None if journal_file is None else RunJournal(journal_file, resume_flg)
+        try:
+            results = search_batch(apikey, engineid, keyword_sets, dbfile, url, max_ranking, drop_flg,
+                                   concurrency=concurrency, limiter=limiter, workers=workers, quota=quota, progress_interval=progress_interval,
+                                   track_urls=track_urls, margin=margin, cache=cache, journal=journal, archive_format=archive_format,
+                                   slim=slim_flg, cold_dir=cold_dir)
+        finally:
+            if journal is not None:
+                journal.close()
+        error_count = len([result for result in results if result["error"] is not None])
+        for keyword_set in skipped_sets:
+            # 予算が足りず計画から外したキーワードセット
+            print("{}\t{}\t{}".format(" ".join(keyword_set["keywords"]), 0, "SKIPPED"))
+
+    if cache_stats_flg:
+        pprint.pprint(doc_cache.stats(), width=120,stream=sys.stderr)
+    if cache is not None:
+        stats = cache.stats()
+        sys.stderr.write("[CACHE] hits={} misses={} hit_rate={:.1%} size={}bytes\n".format(
+            stats["hits"], stats["misses"], stats["hit_rate"], stats["bytes"]))
+
+    if error_count > 0:
+        sys.exit(1)
 
 if __name__ == '__main__':
     try:
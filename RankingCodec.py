@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+# 使えるライブラリのうち最も速いものでjsonを変換する(orjson > msgspec > 標準のjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    CODEC_NAME = "orjson"
+elif msgspec is not None:
+    CODEC_NAME = "msgspec"
+    __encoder = msgspec.json.Encoder()
+    __decoder = msgspec.json.Decoder()
+else:
+    CODEC_NAME = "json"
+
+
+def dumps(obj) -> bytes:
+    """json変換処理
+
+    オブジェクトをUTF-8のjson(非ASCII文字はエスケープしない)に変換する。
+
+    Parameters
+    ----------
+    obj : Any
+        変換するオブジェクト(dict, list, str, int, float, bool, None)
+
+    Returns
+    -------
+    data : bytes
+        UTF-8のjson
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    if msgspec is not None:
+        return __encoder.encode(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """json解析処理
+
+    Parameters
+    ----------
+    data : bytes | str
+        json
+
+    Returns
+    -------
+    obj : Any
+        解析したオブジェクト
+
+    Raises
+    ------
+    ValueError
+        jsonとして解析できない場合
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        try:
+            return __decoder.decode(data)
+        except msgspec.DecodeError as e:
+            # 標準のjsonと同じく壊れたjsonはValueErrorにする
+            raise ValueError(str(e)) from e
+    return json.loads(data)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+import os
+import calendar
+from datetime import datetime, timezone
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+import RankingCodec
+
+# グラフの出力先フォルダの下に作成するダッシュボードのフォルダ名
+DASHBOARD_DIRNAME = "dashboard"
+# キーワードセットごとのデータファイルを置くフォルダ名
+DATA_DIRNAME = "data"
+# キーワードセットの一覧(追記して作り直すためにjsonでも持つ)
+INDEX_FILENAME = "index.json"
+HTML_FILENAME = "index.html"
+PLOTLYJS_FILENAME = "plotly.min.js"
+# データファイルはfile://で開いてもscriptタグで読み込めるように、この関数の呼び出しとして書き出す
+LOADER_NAME = "RankingDashboard.load"
+
+
+def __epoch_seconds(dates) -> list[int]:
+    """日付の配列をUNIX時間(秒)のリストにする(datetimeのリストとdatetime64の配列のどちらも受け付ける)
+
+    タイムゾーンを持たない日時をUTCとみなして変換し、表示するときも同じくUTCとして文字列にする。
+    """
+    if hasattr(dates, "astype"):
+        return dates.astype("datetime64[s]").astype("int64").tolist()
+    return [calendar.timegm(d.timetuple()) for d in dates]
+
+
+def __small_ints(values) -> list[int]:
+    """順位・調査深さを整数のリストにする(記録なしのNoneとNaNは0にする)
+
+    区切りの中央値(x.5)などの小数は切り捨てずに最も近い整数にする(ちょうど中間の場合は偶数)。
+    """
+    return [0 if v is None or v != v else int(round(v)) for v in values]
+
+
+def encode_chart(keyword: str, datas: dict) -> dict:
+    """グラフのデータの列指向の形式への変換処理
+
+    日付は先頭の日時(t0)と1つ前の日時との差(秒)の配列(dt)、順位は整数の配列で持ち、ランク外は0にする。
+    線ごとに日付がある場合(RankingDownsample.lttb_datas)は、線ごとに日付の位置(dtの添字)の配列も持つ。
+
+    Parameters
+    ----------
+    keyword : str
+        グラフの名前([検索マスタID]キーワード)
+    datas : dict
+        日付、サイト、調査深さを持つディクショナリ(selectRankingの値と同じ形)
+
+    Returns
+    -------
+    chart : dict
+        name, t0, dt, depth, sites(サイトの表示名), ranks(サイトごとの順位)を持つディクショナリ。
+        線ごとに日付がある場合はidx(サイトごとの日付の位置)、depth_idx(調査深さの日付の位置)も持つ
+    """
+    seconds = __epoch_seconds(datas["日付"])
+    t0 = seconds[0] if len(seconds) > 0 else 0
+    dt = [0] + [b - a for a, b in zip(seconds, seconds[1:])] if len(seconds) > 0 else []
+    site_dic = datas["サイト"]
+    chart = {
+        "name": keyword
+        ,"t0": t0
+        ,"dt": dt
+        ,"depth": __small_ints(datas.get("調査深さ", []))
+        ,"sites": list(site_dic.keys())
+        ,"ranks": [__small_ints(rank) for rank in site_dic.values()]
+    }
+    if "サイト日付" in datas:
+        positions = {second: i for i, second in enumerate(seconds)}
+        chart["idx"] = [[positions[second] for second in __epoch_seconds(datas["サイト日付"][site])] for site in chart["sites"]]
+        chart["depth_idx"] = [positions[second] for second in __epoch_seconds(datas["調査深さ日付"])]
+    return chart
+
+
+def data_filename(keyword: str) -> str:
+    """キーワードセットのデータファイル名"""
+    return keyword.replace("\t","_") + ".js"
+
+
+class DashboardWriter:
+    """ダッシュボード出力
+
+    1つのhtml(index.html)と、キーワードセットごとのデータファイル(data/*.js)を出力する。
+    htmlにはキーワードセットの一覧だけを持ち、選択されたキーワードセットのデータファイルをその時に読み込む。
+
+    既存のindex.jsonがある場合は読み込み、今回出力したキーワードセットを追加・更新して作り直す。
+
+    Attributes
+    ----------
+    output_dir : str
+        ダッシュボードの出力先フォルダ
+    plotlyjs : str
+        plotly.jsの読み込み方法。cdn、local(出力先のplotly.min.jsを参照)、inline(htmlに埋め込む)
+    """
+
+    def __init__(self, output_dir: str, plotlyjs: str = 'cdn'):
+        if plotlyjs not in ('cdn', 'local', 'inline'):
+            raise ValueError("plotlyjsにはcdn、local、inlineのいずれかを指定してください")
+        self.output_dir = output_dir
+        self.plotlyjs = plotlyjs
+        os.makedirs(os.path.join(output_dir, DATA_DIRNAME), exist_ok=True)
+        self.__index = {}
+        try:
+            with open(os.path.join(output_dir, INDEX_FILENAME), 'rb') as f:
+                self.__index = {entry["name"]: entry for entry in RankingCodec.loads(f.read())}
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def write(self, keyword: str, datas: dict) -> str:
+        """キーワードセット1つ分のデータファイル出力処理
+
+        Returns
+        -------
+        output_file : str
+            出力したデータファイル名
+        """
+        chart = encode_chart(keyword, datas)
+        filename = data_filename(keyword)
+        output_file = os.path.join(self.output_dir, DATA_DIRNAME, filename)
+        with open(output_file, 'wb') as f:
+            f.write(LOADER_NAME.encode('utf-8') + b"(" + RankingCodec.dumps(chart) + b");\n")
+        last = chart["t0"] + sum(chart["dt"])
+        self.__index[keyword] = {
+            "name": keyword
+            ,"file": DATA_DIRNAME + "/" + filename
+            ,"sites": len(chart["sites"])
+            ,"last": datetime.fromtimestamp(max(chart["t0"], last), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        }
+        return output_file
+
+    def __plotlyjs_tag(self) -> str:
+        if self.plotlyjs == 'cdn':
+            return '<script src="https://cdn.plot.ly/plotly-{}.min.js" charset="utf-8"></script>'.format(get_plotlyjs_version())
+        elif self.plotlyjs == 'local':
+            bundle = os.path.join(self.output_dir, PLOTLYJS_FILENAME)
+            if not os.path.exists(bundle):
+                with open(bundle, "w", encoding="utf-8") as f:
+                    f.write(get_plotlyjs())
+            return '<script src="{}" charset="utf-8"></script>'.format(PLOTLYJS_FILENAME)
+        return '<script type="text/javascript">' + get_plotlyjs() + '</script>'
+
+    def close(self):
+        """キーワードセットの一覧(index.json)とhtmlを書き出す"""
+        entries = sorted(self.__index.values(), key=lambda entry: entry["name"])
+        index = RankingCodec.dumps(entries)
+        with open(os.path.join(self.output_dir, INDEX_FILENAME), 'wb') as f:
+            f.write(index)
+        # scriptタグの中に埋め込むため</を閉じタグとみなされないようにする
+        index_js = index.decode('utf-8').replace("</", "<\\/")
+        with open(os.path.join(self.output_dir, HTML_FILENAME), 'w', encoding='utf-8') as f:
+            f.write(HTML_TEMPLATE.replace("{{PLOTLYJS}}", self.__plotlyjs_tag()).replace("{{INDEX}}", index_js))
+
+
+def write_dashboard(plotdatas, output_dir: str, plotlyjs: str = 'cdn', manifest = None):
+    """ダッシュボード出力処理
+
+    Parameters
+    ----------
+    plotdatas : dict or iterator
+        グラフの名前をキーとしたグラフのデータ(RankingPlot.plot_datasと同じ)
+    output_dir : str
+        ダッシュボードの出力先フォルダ
+    plotlyjs : str
+        plotly.jsの読み込み方法
+    manifest : PlotManifest
+        指定した場合は出力したデータファイルを記録する
+    """
+    writer = DashboardWriter(output_dir, plotlyjs)
+    if isinstance(plotdatas, dict):
+        plotdatas = plotdatas.items()
+    try:
+        for keyword, datas in plotdatas:
+            output_file = writer.write(keyword, datas)
+            if manifest is not None:
+                manifest.done(keyword, output_file)
+    finally:
+        writer.close()
+
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>ランキング</title>
+{{PLOTLYJS}}
+<style>
+body { margin: 0; font-family: sans-serif; display: flex; height: 100vh; }
+#side { width: 320px; display: flex; flex-direction: column; border-right: 1px solid #ccc; }
+#filter { margin: 8px; padding: 4px; }
+#keywords { flex: 1; margin: 0 8px 8px; }
+#chart { flex: 1; }
+</style>
+</head>
+<body>
+<div id="side">
+<input id="filter" type="search" placeholder="キーワードで絞り込み">
+<select id="keywords" size="2"></select>
+</div>
+<div id="chart"></div>
+<script type="text/javascript">
+var RankingDashboard = (function () {
+    var index = {{INDEX}};
+    var cache = {};
+    var current = null;
+
+    function formatDate(seconds) {
+        // 出力時にUTCとみなした日時をそのままの文字列に戻す
+        return new Date(seconds * 1000).toISOString().slice(0, 19).replace("T", " ");
+    }
+
+    function nullIfZero(values) {
+        return values.map(function (v) { return v === 0 ? null : v; });
+    }
+
+    function pick(x, idx) {
+        // 線ごとに日付がある場合は日付の位置から取り出す
+        return idx ? idx.map(function (j) { return x[j]; }) : x;
+    }
+
+    function draw(chart) {
+        var x = [];
+        var t = chart.t0;
+        for (var i = 0; i < chart.dt.length; i++) {
+            t += chart.dt[i];
+            x.push(formatDate(t));
+        }
+        var traces = chart.sites.map(function (site, i) {
+            return { type: "scatter", x: pick(x, chart.idx && chart.idx[i]), y: nullIfZero(chart.ranks[i]), name: site };
+        });
+        if (chart.depth.some(function (d) { return d !== 0; })) {
+            // 調査深さより深い順位は調べていないため、線が途切れていても「ランク外」とは限らない
+            traces.push({ type: "scatter", x: pick(x, chart.depth_idx), y: nullIfZero(chart.depth), name: "調査深さ",
+                          mode: "lines", line: { color: "gray", dash: "dot" } });
+        }
+        Plotly.react("chart", traces, {
+            title: { text: chart.name },
+            xaxis: { title: { text: "日付" }, tickformat: "%Y-%m-%d", dtick: 86400000 },
+            yaxis: { title: { text: "順位" }, autorange: "reversed", dtick: 5 }
+        });
+    }
+
+    function show(name) {
+        current = name;
+        if (cache[name]) {
+            draw(cache[name]);
+            return;
+        }
+        var entry = index.filter(function (e) { return e.name === name; })[0];
+        var script = document.createElement("script");
+        script.src = entry.file.split("/").map(encodeURIComponent).join("/");
+        script.onload = function () { document.head.removeChild(script); };
+        document.head.appendChild(script);
+    }
+
+    function load(chart) {
+        cache[chart.name] = chart;
+        if (chart.name === current) {
+            draw(chart);
+        }
+    }
+
+    function fill(filter) {
+        var select = document.getElementById("keywords");
+        select.innerHTML = "";
+        index.forEach(function (entry) {
+            if (filter && entry.name.indexOf(filter) < 0) {
+                return;
+            }
+            var option = document.createElement("option");
+            option.value = entry.name;
+            option.text = entry.name.replace(/\\t/g, " ") + " (" + entry.last.slice(0, 10) + ")";
+            select.appendChild(option);
+        });
+    }
+
+    document.getElementById("filter").addEventListener("input", function (e) { fill(e.target.value); });
+    document.getElementById("keywords").addEventListener("change", function (e) { show(e.target.value); });
+    fill("");
+
+    return { load: load, show: show };
+})();
+</script>
+</body>
+</html>
+"""
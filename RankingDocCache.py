@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+from sqlalchemy import func
+from sqlalchemy.orm import scoped_session
+from RankingModels import TDoc, TRanking
+
+
+class DocCache:
+    """ドキュメントIDキャッシュ
+
+    URLからドキュメントID・タイトル・自ページフラグを引くプロセス内のLRUキャッシュ。
+    同じURLが何度も検索結果に出てくるため、t_docへの問い合わせをキャッシュで省略する。
+    タイトルか自ページフラグが変わったときだけデータベースへの書き込みをおこなう。
+
+    トランザクションがロールバックされたときに採番されていないidが残らないように、
+    resolveで得たエントリはいったん保留にし、commitを呼んだときにキャッシュに反映する。
+
+    Attributes
+    ----------
+    maxsize : int
+        キャッシュするURLの最大件数。超えた場合は最も古く参照されたものから追い出す
+    hits : int
+        キャッシュにヒットした回数
+    misses : int
+        キャッシュにヒットしなかった(またはデータが変わっていた)回数
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__pending = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def normalize_url(link_url: str) -> str:
+        """URL正規化処理
+
+        キャッシュのキーおよびデータベースに登録するURLを正規化する。
+        検索結果のURLには前後に空白が入っていることがあるため取り除く。
+
+        Parameters
+        ----------
+        link_url : str
+            検索結果から取得したURL
+
+        Returns
+        -------
+        link_url : str
+            正規化したURL
+        """
+        return link_url.strip()
+
+    def __put(self, link_url: str, entry: tuple):
+        """キャッシュ登録処理(ロックを取得した状態で呼ぶこと)"""
+        self.__entries[link_url] = entry
+        self.__entries.move_to_end(link_url)
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+
+    def resolve(self, t_docs: list, session: scoped_session) -> dict:
+        """ドキュメントID解決処理
+
+        キャッシュにヒットしタイトルと自ページフラグが変わっていないドキュメントはそのままidを返し、
+        それ以外のドキュメントだけをまとめて登録更新する。commitはおこなわない。
+
+        Parameters
+        ----------
+        t_docs : list[TDoc]
+            登録更新対象のデータのリスト(link_urlは正規化済みで重複していないこと)
+        session : scoped_session
+            データベースへの接続セッション
+
+        Returns
+        -------
+        doc_id_dic : dict[str, int]
+            URLをキーとしたドキュメントIDのディクショナリ
+        """
+        doc_id_dic = {}
+        upsert_docs = []
+        with self.__lock:
+            for t_doc in t_docs:
+                entry = self.__entries.get(t_doc.link_url)
+                if entry is not None and entry[1] == t_doc.title and entry[2] == int(t_doc.mypage_flg):
+                    self.__entries.move_to_end(t_doc.link_url)
+                    self.hits = self.hits + 1
+                    doc_id_dic[t_doc.link_url] = entry[0]
+                else:
+                    self.misses = self.misses + 1
+                    upsert_docs.append(t_doc)
+
+        if len(upsert_docs) > 0:
+            ret_t_docs = TDoc.upsert_all(upsert_docs, session, commit=False)
+            with self.__lock:
+                for t_doc in ret_t_docs:
+                    doc_id_dic[t_doc.link_url] = t_doc.id
+                    self.__pending[t_doc.link_url] = (t_doc.id, t_doc.title, int(t_doc.mypage_flg))
+        return doc_id_dic
+
+    def commit(self):
+        """保留中のエントリをキャッシュに反映する(データベースのcommit後に呼ぶこと)"""
+        with self.__lock:
+            for link_url, entry in self.__pending.items():
+                self.__put(link_url, entry)
+            self.__pending.clear()
+
+    def rollback(self):
+        """保留中のエントリを破棄する(データベースのrollback時に呼ぶこと)"""
+        with self.__lock:
+            self.__pending.clear()
+
+    def warm(self, session: scoped_session, limit: int) -> int:
+        """キャッシュ暖機処理
+
+        ランキングに登場した回数の多いドキュメントから順にlimit件をキャッシュに読み込む。
+
+        Parameters
+        ----------
+        session : scoped_session
+            データベースへの接続セッション
+        limit : int
+            読み込む最大件数
+
+        Returns
+        -------
+        count : int
+            読み込んだ件数
+        """
+        ranking_count = session.query(
+            TRanking.doc_id
+            ,func.count(TRanking.id).label("cnt")
+        ).group_by(
+            TRanking.doc_id
+        ).subquery()
+
+        result = session.query(
+            TDoc.id
+            ,TDoc.link_url
+            ,TDoc.title
+            ,TDoc.mypage_flg
+        ).join(
+            ranking_count, TDoc.id == ranking_count.c.doc_id
+        ).order_by(
+            ranking_count.c.cnt.desc()
+        ).limit(min(limit, self.maxsize)).all()
+
+        # 登場回数の少ない順に入れ、多いものほど追い出されにくくする
+        with self.__lock:
+            for raw in reversed(result):
+                self.__put(raw.link_url, (raw.id, raw.title, int(raw.mypage_flg)))
+        return len(result)
+
+    def clear(self):
+        """キャッシュと統計情報をクリアする"""
+        with self.__lock:
+            self.__entries.clear()
+            self.__pending.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """統計情報取得処理
+
+        Returns
+        -------
+        stats : dict
+            hits, misses, hit_rate, size, maxsizeを持つディクショナリ
+        """
+        with self.__lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "size": len(self.__entries),
+                "maxsize": self.maxsize,
+            }
+
+
+# プロセス全体で共有するキャッシュ
+doc_cache = DocCache()
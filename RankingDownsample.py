@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+import statistics
+from datetime import datetime, timedelta
+
+# 時間で区切るときの単位
+BUCKETS = ("hour", "day", "week")
+# 区切った中の順位のまとめ方
+AGGREGATES = {
+    "min": min,
+    "median": statistics.median,
+    "max": max,
+}
+
+
+def __to_datetimes(dates) -> list[datetime]:
+    """日付の配列をdatetimeのリストにする(datetimeのリストとdatetime64の配列のどちらも受け付ける)"""
+    if hasattr(dates, "astype"):
+        return dates.astype("datetime64[us]").tolist()
+    return list(dates)
+
+
+def __to_values(values) -> list:
+    """順位の配列をNone(記録なし)と数値のリストにする(NaNもNoneにする)"""
+    return [None if v is None or v != v else v for v in values]
+
+
+def __bucket_start(d: datetime, bucket: str) -> datetime:
+    """日時が含まれる区切りの開始日時"""
+    if bucket == "hour":
+        return d.replace(minute=0, second=0, microsecond=0)
+    start = d.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        # 月曜日始まり
+        start = start - timedelta(days=start.weekday())
+    return start
+
+
+def bucket_datas(datas: dict, bucket: str, aggregate: str = "median") -> dict:
+    """時間区切りによる間引き処理
+
+    日付を時間・日・週で区切り、区切りごとにサイトの順位を1つにまとめる。
+    調査深さは区切りの中で最も浅いもの(その深さまではすべての検索で調べている)にする。
+
+    Parameters
+    ----------
+    datas : dict
+        日付、サイト、調査深さを持つディクショナリ(selectRankingの値と同じ形)
+    bucket : str
+        hour, day, weekのいずれか
+    aggregate : str
+        min, median, maxのいずれか
+
+    Returns
+    -------
+    datas : dict
+        区切りの開始日時を日付とした同じ形のディクショナリ
+    """
+    if bucket not in BUCKETS:
+        raise ValueError("区切りにはhour、day、weekのいずれかを指定してください")
+    func = AGGREGATES[aggregate]
+    dates = __to_datetimes(datas["日付"])
+
+    # 区切りは元の日付と同じ順(新しい順)に並べる
+    positions = {}
+    starts = []
+    members = []
+    for i, d in enumerate(dates):
+        start = __bucket_start(d, bucket)
+        position = positions.get(start)
+        if position is None:
+            position = len(starts)
+            positions[start] = position
+            starts.append(start)
+            members.append([])
+        members[position].append(i)
+
+    def aggregate_values(values, reducer):
+        values = __to_values(values)
+        ret = []
+        for indexes in members:
+            present = [values[i] for i in indexes if values[i] is not None]
+            ret.append(reducer(present) if len(present) > 0 else None)
+        return ret
+
+    return {
+        "日付": starts
+        ,"サイト": {site: aggregate_values(rank, func) for site, rank in datas["サイト"].items()}
+        ,"調査深さ": aggregate_values(datas.get("調査深さ", [None] * len(dates)), min)
+    }
+
+
+def __lttb_indexes(xs: list, ys: list, threshold: int) -> list[int]:
+    """Largest-Triangle-Three-Bucketsで残す点の位置を選ぶ"""
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        # 両端だけを残す
+        return [0, n - 1][:threshold]
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 次の区間の平均を3点目とし、今の区間から三角形の面積が最大になる点を選ぶ
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        max_area = -1
+        max_index = start
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > max_area:
+                max_area = area
+                max_index = j
+        selected.append(max_index)
+        a = max_index
+    selected.append(n - 1)
+    return selected
+
+
+def __lttb_trace(seconds: list, values: list, threshold: int) -> list[int]:
+    """1つの線で残す点の位置を選ぶ
+
+    記録のある点が続く区間ごとに、区間の点数に応じて残す点の数を割り当ててLTTBで選ぶ。
+    途切れ(ランク外)は記録のない点を1つ残して表すが、残す途切れは間隔の長いものからthresholdの1/4までにし、
+    それ以外の途切れの前後は1つの区間として間引く。途切れが多い線でも残す点の数はthresholdに収まる。
+
+    Returns
+    -------
+    indexes : list[int]
+        残す点の位置(元の並び順)。記録のない位置は線の途切れを表す
+    """
+    runs = []
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        if len(runs) > 0 and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    if len(runs) == 0:
+        return []
+
+    gaps = sorted(range(len(runs) - 1), key=lambda g: -abs(seconds[runs[g + 1][0]] - seconds[runs[g][-1]]))
+    kept_gaps = set(gaps[:threshold // 4])
+    merged = [list(runs[0])]
+    for g in range(len(runs) - 1):
+        if g in kept_gaps:
+            merged.append(list(runs[g + 1]))
+        else:
+            merged[-1].extend(runs[g + 1])
+
+    # 区間ごとに両端を残し、残りの点の数を区間の長さに応じて割り当てる
+    counts = [min(len(run), 2) for run in merged]
+    extra = max(threshold - len(kept_gaps) - sum(counts), 0)
+    rest = sum(len(run) - count for run, count in zip(merged, counts))
+    if rest > 0:
+        counts = [count + extra * (len(run) - count) // rest for run, count in zip(merged, counts)]
+
+    indexes = []
+    for k, (run, count) in enumerate(zip(merged, counts)):
+        chosen = __lttb_indexes([seconds[i] for i in run], [values[i] for i in run], count)
+        indexes.extend(run[j] for j in chosen)
+        if k < len(merged) - 1:
+            # 途切れの最初の位置(記録なし)
+            indexes.append(run[-1] + 1)
+    return indexes
+
+
+def lttb_datas(datas: dict, threshold: int) -> dict:
+    """LTTBによる間引き処理
+
+    サイトごと(と調査深さ)にLTTBで残す点を選び、線ごとに別の日付を持たせる。
+    線ごとに間引くため、残す点の数はサイトの数が多くても1つの線あたりthreshold以下になる。
+    線が途切れているところ(ランク外)は間引きでつながらないように記録のない点として残す。
+
+    Parameters
+    ----------
+    datas : dict
+        日付、サイト、調査深さを持つディクショナリ(selectRankingの値と同じ形)
+    threshold : int
+        1つの線あたりに残す点の数
+
+    Returns
+    -------
+    datas : dict
+        日付(いずれかの線で残した日付)、サイト、調査深さに加えて、
+        サイト日付(サイトごとの日付)、調査深さ日付を持つディクショナリ。サイト、調査深さの値は線ごとの日付と同じ長さになる
+    """
+    dates = __to_datetimes(datas["日付"])
+    if len(dates) <= threshold:
+        return datas
+    seconds = [d.timestamp() for d in dates]
+
+    used = set()
+
+    def select_trace(values):
+        values = __to_values(values)
+        indexes = __lttb_trace(seconds, values, threshold)
+        used.update(indexes)
+        return [dates[i] for i in indexes], [values[i] for i in indexes]
+
+    site_dic = {}
+    site_dates = {}
+    for site, rank in datas["サイト"].items():
+        site_dates[site], site_dic[site] = select_trace(rank)
+    depth_dates, depth = select_trace(datas.get("調査深さ", [None] * len(dates)))
+    return {
+        "日付": [dates[i] for i in sorted(used)]
+        ,"サイト": site_dic
+        ,"調査深さ": depth
+        ,"サイト日付": site_dates
+        ,"調査深さ日付": depth_dates
+    }
+
+
+def downsample(plotdatas, bucket: str = None, aggregate: str = "median", lttb: int = None):
+    """グラフのデータの間引き処理
+
+    selectRankingのディクショナリかiterRankingのイテレータを受け取り、
+    キーワードセットごとに間引いた(グラフの名前, データ)を1つずつ返す。
+    bucketとlttbの両方を指定した場合は時間で区切ってからLTTBで間引く。
+
+    Parameters
+    ----------
+    plotdatas : dict or iterator
+        グラフの名前をキーとしたグラフのデータ
+    bucket : str
+        hour, day, weekのいずれか。Noneのときは時間で区切らない
+    aggregate : str
+        区切った中の順位のまとめ方(min, median, max)
+    lttb : int
+        LTTBで1つの線あたりに残す点の数。Noneのときは使わない
+
+    Yields
+    ------
+    graph_keyword : str
+        グラフの名前
+    datas : dict
+        間引いたグラフのデータ
+    """
+    if isinstance(plotdatas, dict):
+        plotdatas = plotdatas.items()
+    for keyword, datas in plotdatas:
+        if bucket is not None:
+            datas = bucket_datas(datas, bucket, aggregate)
+        if lttb is not None:
+            datas = lttb_datas(datas, lttb)
+        yield keyword, datas
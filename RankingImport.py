@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import time
+import pprint
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from RankingModels import TSearchM, TRankingSummary, open_db
+from RankingCheckAPI import load_response, slim_response, ingest
+import RankingArchive
+
+# 日付のフォルダ名(save_responseが作成するYYYY-MM-DD)
+DAY_DIR_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# 1プロセスあたりに先読みするファイル数(メモリ上にたまる解析結果の上限)
+PREFETCH_PER_PROCESS = 4
+
+
+def iter_archive_files(base_dir: str, since: str = None, until: str = None):
+    """保存済みjson列挙処理
+
+    base_dirの下の日付のフォルダ(YYYY-MM-DD/Data/response-*.json)を日付順、ファイル名順に列挙する。
+    フォルダごとに読み込むため、ファイル数が多くても一度にすべてのファイル名を持たない。
+    フォルダにresponses.ndjson.gzがある場合は、ファイルの後にアーカイブ内のレコードの位置指定子を追記順に列挙する。
+
+    Parameters
+    ----------
+    base_dir : str
+        save_responseのoutput_base_dirに指定したフォルダ
+    since : str
+        この日付(YYYY-MM-DD)以降のフォルダだけを対象にする。Noneのときは制限しない
+    until : str
+        この日付(YYYY-MM-DD)以前のフォルダだけを対象にする。Noneのときは制限しない
+
+    Yields
+    ------
+    output_file : str
+        保存済みjsonのファイル名(またはアーカイブ内のレコードの位置指定子)
+    """
+    days = sorted(entry.name for entry in os.scandir(base_dir) if entry.is_dir() and DAY_DIR_PATTERN.match(entry.name))
+    for day in days:
+        if since is not None and day < since:
+            continue
+        if until is not None and day > until:
+            continue
+        data_dir = os.path.join(base_dir, day, "Data")
+        if not os.path.isdir(data_dir):
+            continue
+        names = sorted(entry.name for entry in os.scandir(data_dir) if entry.name.startswith("response-") and entry.name.endswith(".json"))
+        for name in names:
+            yield os.path.join(data_dir, name)
+        path = os.path.join(data_dir, RankingArchive.ARCHIVE_NAME)
+        if os.path.exists(path):
+            yield from RankingArchive.iter_locators(path)
+
+
+def parse_file(output_file: str) -> dict:
+    """保存済みjson解析処理
+
+    保存済みjsonを読み込み、DB登録に必要な項目だけを残して返す。
+    プロセスプールのワーカープロセスで呼ばれる。
+
+    Parameters
+    ----------
+    output_file : str
+        保存済みjsonのファイル名(またはアーカイブ内のレコードの位置指定子)
+
+    Returns
+    -------
+    parsed : dict
+        file, search_time, keywords, max_ranking, responseを持つディクショナリ。
+        responseはslim_responseで縮小したもの
+    """
+    ranking_json = load_response(output_file)
+    response = slim_response(ranking_json["response"])
+    keywords = ranking_json["keywords"]
+    if keywords is None:
+        # キーワードを記録していない古いjsonは検索文字列から復元する
+        for res in response:
+            search_terms = res["queries"].get("request", [{}])[0].get("searchTerms")
+            if search_terms is not None:
+                keywords = search_terms.split()
+                break
+    if keywords is None or len(keywords) == 0:
+        raise ValueError("{}: キーワードがわかりません".format(output_file))
+    return {
+        "file": output_file,
+        "search_time": ranking_json["search_time"],
+        "keywords": keywords,
+        "max_ranking": ranking_json["max_ranking"],
+        "response": response,
+    }
+
+
+def __rebuild_summaries(session, keywords_list: list[str]) -> int:
+    """登録したキーワードセットの最新順位集計を作り直し、キーワードセットごとにcommitする"""
+    count = 0
+    for i in range(0, len(keywords_list), 500):
+        search_m_ids = [raw.id for raw in session.query(TSearchM.id).filter(TSearchM.keywords.in_(keywords_list[i:i + 500]))]
+        for search_m_id in search_m_ids:
+            TRankingSummary.rebuild(session, search_m_id)
+            session.commit()
+            count = count + 1
+    return count
+
+
+def import_archive(dbfile: str, base_dir: str, my_url: str, processes: int = None, since: str = None, until: str = None,
+                   progress_interval: float = 10, progress_stream = sys.stderr) -> dict:
+    """保存済みjson取り込み処理
+
+    保存済みjsonを順に読み込み、データベースに登録する。
+    jsonの解析はプロセスプールで並行しておこない、登録はこのプロセスで1ファイルずつおこなう。
+    先読みするファイル数を制限しているため、アーカイブ全体の大きさにかかわらずメモリ使用量は一定になる。
+
+    検索は検索マスタと検索日時、ランキングは検索と順位を自然キーとして登録更新するため、
+    同じjsonを何度取り込んでもレコードは増えない。
+
+    最新順位集計はファイルごとには更新せず、すべて登録し終えてから登録したキーワードセットごとに1回だけ作り直す
+    (過去の日時の検索や登録しなおした検索のたびに作り直すと、履歴の長さに比例した処理が検索ごとに発生するため)。
+    途中で中断した場合はRankingLatest.pyの--rebuildで作り直す。
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    base_dir : str
+        save_responseのoutput_base_dirに指定したフォルダ
+    my_url : str
+        自サイトのURL
+    processes : int
+        jsonを解析するプロセス数。Noneのときはコア数
+    since : str
+        この日付(YYYY-MM-DD)以降のフォルダだけを対象にする
+    until : str
+        この日付(YYYY-MM-DD)以前のフォルダだけを対象にする
+    progress_interval : float
+        0より大きいとき、その秒数ごとに進捗をprogress_streamに出力する
+    progress_stream : TextIO
+        進捗と終了時の集計の出力先。Noneのときは出力しない
+
+    Returns
+    -------
+    stats : dict
+        files(処理したファイル数)、imported(登録したファイル数)、errors(失敗したファイル数)、
+        rankings(登録したランキング数)、summaries(集計を作り直したキーワードセット数)、
+        elapsed(経過秒数)、files_per_sec(1秒あたりのファイル数)を持つディクショナリ
+    """
+    stats = {"files": 0, "imported": 0, "errors": 0, "rankings": 0, "summaries": 0}
+    # 登録したキーワードセット(検索マスタのkeywords)
+    touched = set()
+    started = time.monotonic()
+    last_progress = started
+
+    def format_stats():
+        elapsed = time.monotonic() - started
+        stats["elapsed"] = elapsed
+        stats["files_per_sec"] = stats["files"] / elapsed if elapsed > 0 else 0.0
+        return "[IMPORT] {elapsed:.0f}s files={files} imported={imported} errors={errors} rankings={rankings} summaries={summaries} files/sec={files_per_sec:.1f}".format(**stats)
+
+    engine, session = open_db(dbfile)
+    try:
+        if processes is None:
+            processes = os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            window = processes * PREFETCH_PER_PROCESS
+            pending = deque()
+            files = iter_archive_files(base_dir, since, until)
+            while True:
+                # 先読みの上限まで解析を投入する
+                for output_file in files:
+                    pending.append((output_file, executor.submit(parse_file, output_file)))
+                    if len(pending) >= window:
+                        break
+                if len(pending) == 0:
+                    break
+                output_file, future = pending.popleft()
+                stats["files"] = stats["files"] + 1
+                try:
+                    parsed = future.result()
+                    ranking = ingest(session, parsed["keywords"], parsed["response"], my_url, parsed["max_ranking"],
+                                     parsed["search_time"], replace=True, summary=False)
+                    touched.add("\t".join(parsed["keywords"]))
+                    stats["imported"] = stats["imported"] + 1
+                    stats["rankings"] = stats["rankings"] + ranking
+                except Exception:
+                    stats["errors"] = stats["errors"] + 1
+                    (exc_type, exc_value, exc_traceback) = sys.exc_info()
+                    t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+                    t.insert(0,"[ERROR]:{}".format(output_file))
+                    pprint.pprint(t, width=120,stream=sys.stderr)
+                if progress_stream is not None and progress_interval > 0 and time.monotonic() - last_progress >= progress_interval:
+                    last_progress = time.monotonic()
+                    progress_stream.write(format_stats() + "\n")
+                    progress_stream.flush()
+        stats["summaries"] = __rebuild_summaries(session, sorted(touched))
+    finally:
+        session.close()
+        engine.dispose()
+
+    line = format_stats()
+    if progress_stream is not None:
+        progress_stream.write(line + "\n")
+        progress_stream.flush()
+    return stats
+
+
+def main(argv: list[str]):
+    """メイン処理
+
+    コマンドラインからの引数を受取り変数にセットし取り込み処理を呼び出す
+
+    Parameters
+    ----------
+    argv : list[str]
+        コマンドラインから入力された文字の配列
+    """
+    skip = False
+    dbfile="ranking.sqlite3"
+    url=""
+    base_dir="."
+    processes = None
+    since = None
+    until = None
+    progress_interval = 10
+    try:
+        for i,arg in enumerate(argv):
+            if skip == False and i > 0:
+                if arg == '-db':
+                    dbfile = argv[i+1]
+                    skip = True
+                elif arg == '-u':
+                    url = argv[i+1]
+                    skip = True
+                elif arg == '-p':
+                    processes = int(argv[i+1])
+                    if processes <= 0:
+                        raise ValueError("pオプションの値は正の整数を指定してください")
+                    skip = True
+                elif arg == '--since':
+                    since = argv[i+1]
+                    skip = True
+                elif arg == '--until':
+                    until = argv[i+1]
+                    skip = True
+                elif arg == '--progress':
+                    progress_interval = int(argv[i+1])
+                    skip = True
+                else:
+                    base_dir = arg
+            else:
+                skip = False
+    except (IndexError, ValueError) as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        t.insert(0,"[ERROR]:引数の形がちがいます")
+        t.insert(1,"py RankingImport.py [-db DBファイル名] [-u URL] [-p プロセス数] [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--progress 秒] [jsonの保存先フォルダ]")
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+
+    stats = import_archive(dbfile, base_dir, url, processes, since, until, progress_interval)
+    if stats["errors"] > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv)
+    except Exception as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import threading
+from datetime import datetime
+
+# キーワードセットの状態(後ろほど処理が進んでいる)
+FETCHED = "fetched"
+ARCHIVED = "archived"
+INGESTED = "ingested"
+STATES = (FETCHED, ARCHIVED, INGESTED)
+
+
+class RunJournal:
+    """実行ジャーナル
+
+    一括検索でキーワードセットごとに取得済み(fetched)、保存済み(archived)、登録済み(ingested)の
+    状態を1行1レコードのjson(追記のみ)でファイルに記録する。
+    途中で異常終了しても、再実行時にファイルを読み直せばどのキーワードセットがどこまで終わったかがわかる。
+
+    書き込みごとにflushとfsyncをおこなうため、異常終了しても記録済みの行は失われない。
+    最後の行が書きかけで壊れている場合は読み飛ばす。
+
+    Attributes
+    ----------
+    path : str
+        ジャーナルファイル名
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        Parameters
+        ----------
+        path : str
+            ジャーナルファイル名
+        resume : bool
+            Trueのとき既存のジャーナルを読み込んで続きから記録する。
+            Falseのときは既存のジャーナルを消して新しく記録する
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__states = {}
+        if resume:
+            self.__load()
+        dirname = os.path.dirname(path)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        self.__file = open(path, 'a' if resume else 'w', encoding='UTF-8')
+
+    @staticmethod
+    def key(keywords: list[str]) -> str:
+        """キーワードセットを識別するキー(検索マスタのkeywordsと同じタブ区切り)"""
+        return "\t".join(keywords)
+
+    def __load(self):
+        """既存のジャーナルを読み込み、キーワードセットごとの最新の状態を復元する"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='UTF-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 異常終了で書きかけになった行
+                    continue
+                if record.get("state") not in STATES:
+                    continue
+                current = self.__states.get(record["keywords"])
+                if current is not None and STATES.index(current["state"]) > STATES.index(record["state"]):
+                    continue
+                self.__states[record["keywords"]] = record
+
+    def record(self, keywords: list[str], state: str, **values):
+        """状態記録処理
+
+        Parameters
+        ----------
+        keywords : list[str]
+            検索キーワードの配列
+        state : str
+            FETCHED, ARCHIVED, INGESTEDのいずれか
+        values : dict
+            状態とあわせて記録する値(保存したファイル名、検索日時、登録した順位など)
+        """
+        if state not in STATES:
+            raise ValueError("不明な状態です: {}".format(state))
+        record = dict(values)
+        record["keywords"] = self.key(keywords)
+        record["state"] = state
+        record["recorded_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        line = json.dumps(record, ensure_ascii=False)
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__states[record["keywords"]] = record
+
+    def state(self, keywords: list[str]) -> dict:
+        """状態取得処理
+
+        Parameters
+        ----------
+        keywords : list[str]
+            検索キーワードの配列
+
+        Returns
+        -------
+        record : dict
+            最後に記録したレコード(keywords, state, recorded_atと記録した値)。記録がない場合はNone
+        """
+        with self.__lock:
+            return self.__states.get(self.key(keywords))
+
+    def counts(self) -> dict:
+        """状態ごとのキーワードセット数"""
+        with self.__lock:
+            ret = {state: 0 for state in STATES}
+            for record in self.__states.values():
+                ret[record["state"]] = ret[record["state"]] + 1
+            return ret
+
+    def close(self):
+        """ジャーナルファイルを閉じる"""
+        with self.__lock:
+            self.__file.close()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+
+def read_keyword_sets(lines) -> list[dict]:
+    """キーワードファイル読み込み処理
+
+    1行に1つのキーワードセットが書かれたファイルを読み込む。
+    行ごとに以下のどちらかの形式で記述できる。空行と#で始まる行は読み飛ばす。
+
+    - TSV: キーワードをタブ区切りで並べる
+    - JSONL: キーワードの配列、または{"keywords": [...], "url": "...", "max_ranking": 数値}のオブジェクト
+      (url, max_rankingは省略可能でコマンドラインの値より優先される)
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        キーワードファイルの各行(ファイルオブジェクトや標準入力)
+
+    Returns
+    -------
+    keyword_sets : list[dict]
+        keywords, url, max_rankingを持つディクショナリのリスト(url, max_rankingは省略時None)
+    """
+    keyword_sets = []
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        if line.startswith("{") or line.startswith("["):
+            data = json.loads(line)
+            if isinstance(data, list):
+                data = {"keywords": data}
+        else:
+            data = {"keywords": line.split("\t")}
+        keywords = [str(keyword).strip() for keyword in data.get("keywords", []) if len(str(keyword).strip()) > 0]
+        if len(keywords) == 0:
+            raise ValueError("{}行目: キーワードがありません".format(line_no))
+        keyword_sets.append({
+            "keywords": keywords,
+            "url": data.get("url"),
+            "max_ranking": data.get("max_ranking"),
+        })
+    return keyword_sets
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import pprint
+import traceback
+from RankingModels import TSearchM, TDoc, TRankingSummary, open_db
+
+
+def select_latest(session, keywords: list[str] = None, mypage_only: bool = False, include_dropped: bool = False) -> list[dict]:
+    """最新順位取得処理
+
+    最新順位集計テーブルから、キーワードセットごとのドキュメントの最新の順位と1つ前の順位を取得する。
+    ランキングの履歴は読まないため、処理量は返す行数に比例する。
+
+    Parameters
+    ----------
+    session : scoped_session
+        データベース接続のセッション
+    keywords : list[str]
+        対象のキーワード。Noneか空のときはすべてのキーワードセット
+    mypage_only : bool
+        Trueのとき自サイトのドキュメントだけにする
+    include_dropped : bool
+        Trueのとき最新の検索で出てこなかった(1つ前の検索では出てきた)ドキュメントも含める
+
+    Returns
+    -------
+    rows : list[dict]
+        keywords, doc_id, link_url, title, latest_ranking, previous_ranking, best_ranking, first_seen, last_seenを持つ
+        ディクショナリのリスト。キーワード順、最新の順位順(ランク外は最後)に並ぶ
+    """
+    query = session.query(
+        TSearchM.keywords
+        ,TRankingSummary.doc_id
+        ,TDoc.link_url
+        ,TDoc.title
+        ,TRankingSummary.latest_ranking
+        ,TRankingSummary.previous_ranking
+        ,TRankingSummary.best_ranking
+        ,TRankingSummary.first_seen
+        ,TRankingSummary.last_seen
+    ).join(
+        TRankingSummary,TSearchM.id == TRankingSummary.search_m_id
+    ).join(
+        TDoc,TRankingSummary.doc_id == TDoc.id
+    )
+    if keywords is not None and len(keywords) > 0:
+        query = query.filter(TSearchM.keywords == "\t".join(keywords))
+    if mypage_only:
+        query = query.filter(TDoc.mypage_flg == True)
+    if include_dropped:
+        query = query.filter(TRankingSummary.latest_ranking.is_not(None) | TRankingSummary.previous_ranking.is_not(None))
+    else:
+        query = query.filter(TRankingSummary.latest_ranking.is_not(None))
+    query = query.order_by(
+        TSearchM.keywords
+        ,TRankingSummary.latest_ranking.is_(None)
+        ,TRankingSummary.latest_ranking
+        ,TRankingSummary.previous_ranking
+    )
+    return [row._asdict() for row in query]
+
+
+def __format(value) -> str:
+    return "" if value is None else str(value)
+
+
+def main(argv: list[str]):
+    """メイン処理
+
+    コマンドラインからの引数を受取り変数にセットし最新順位をタブ区切りで出力する
+
+    Parameters
+    ----------
+    argv : list[str]
+        コマンドラインから入力された文字の配列
+    """
+    skip = False
+    dbfile="ranking.sqlite3"
+    keywords = []
+    mypage_only = False
+    include_dropped = False
+    rebuild = False
+    try:
+        for i,arg in enumerate(argv):
+            if skip == False and i > 0:
+                if arg == '-db':
+                    dbfile = argv[i+1]
+                    skip = True
+                elif arg == '--mypage':
+                    mypage_only = True
+                elif arg == '--dropped':
+                    include_dropped = True
+                elif arg == '--rebuild':
+                    rebuild = True
+                else:
+                    keywords.append(arg)
+            else:
+                skip = False
+    except IndexError as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        t.insert(0,"[ERROR]:引数の形がちがいます")
+        t.insert(1,"py RankingLatest.py [-db DBファイル名] [--mypage] [--dropped] [--rebuild] [キーワード1] [キーワード2] [キーワード3] …")
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+
+    engine, session = open_db(dbfile)
+    try:
+        if rebuild:
+            TRankingSummary.rebuild(session)
+            session.commit()
+        columns = ["keywords", "latest_ranking", "previous_ranking", "best_ranking", "first_seen", "last_seen", "doc_id", "link_url", "title"]
+        print("\t".join(columns))
+        for row in select_latest(session, keywords, mypage_only, include_dropped):
+            row["keywords"] = row["keywords"].replace("\t", " ")
+            print("\t".join(__format(row[column]) for column in columns))
+    finally:
+        session.close()
+        engine.dispose()
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv)
+    except Exception as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
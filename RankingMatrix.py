@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from datetime import datetime
+from sqlalchemy import select
+from RankingModels import TSearchM, TSearch, TRanking, TDoc
+
+# read_sqlで1回に読み込む行数
+DEFAULT_CHUNKSIZE = 100000
+# 日付軸を取得するときに1回に指定する検索マスタIDの数
+AXES_CHUNK_SIZE = 500
+
+
+class RankingMatrix:
+    """順位行列
+
+    1つのキーワードセットの順位の履歴を、サイト×日付の密な行列で持つ。
+    ランク外(その検索で出てこなかった)のところはNaNになる。
+    順位は100位以下の整数のためfloat32で持ち、Pythonのint/Noneのリストの半分程度のメモリで済む。
+
+    Attributes
+    ----------
+    search_m_id : int
+        検索マスタID
+    keywords : str
+        タブ区切りの検索キーワード
+    dates : numpy.ndarray
+        検索日時(datetime64)。新しい順
+    depth : numpy.ndarray
+        検索ごとの調査深さ(float32)。不明な場合はNaN
+    doc_ids : numpy.ndarray
+        サイト(ドキュメント)のID。最新の検索で上位のものから順に並ぶ
+    titles : list[str]
+        サイトのタイトル(doc_idsと同じ順)
+    values : numpy.ndarray
+        順位(float32)の行列。行がサイト、列が検索日時
+    """
+
+    def __init__(self, search_m_id: int, keywords: str, dates: np.ndarray, depth: np.ndarray, doc_ids: np.ndarray, titles: list[str], values: np.ndarray):
+        self.search_m_id = search_m_id
+        self.keywords = keywords
+        self.dates = dates
+        self.depth = depth
+        self.doc_ids = doc_ids
+        self.titles = titles
+        self.values = values
+
+    @property
+    def name(self) -> str:
+        """グラフの名前(selectRankingのキーと同じ[検索マスタID]キーワード)"""
+        return '[' + str(self.search_m_id) + ']' + self.keywords
+
+    def site_labels(self) -> list[str]:
+        """サイトの表示名([ドキュメントID]タイトル)のリスト"""
+        return ['[' + str(doc_id) + ']' + title for doc_id, title in zip(self.doc_ids.tolist(), self.titles)]
+
+    def to_plot_data(self) -> dict:
+        """plot_datasに渡す形式(selectRankingの値と同じ形)に変換する
+
+        Returns
+        -------
+        plot_data : dict
+            日付、サイト(表示名をキーとした順位の配列)、調査深さを持つディクショナリ。
+            配列はコピーせず行列の行をそのまま使う
+        """
+        return {
+            "日付": self.dates
+            ,"サイト": dict(zip(self.site_labels(), self.values))
+            ,"調査深さ": self.depth
+        }
+
+    def to_frame(self) -> pd.DataFrame:
+        """サイトの表示名を行、検索日時を列としたDataFrameに変換する"""
+        return pd.DataFrame(self.values, index=self.site_labels(), columns=pd.DatetimeIndex(self.dates, name="search_datetime"))
+
+
+def __keyword_filter(stmt, keywords: list[str], search_m_ids: list[int] = None):
+    """キーワードや検索マスタIDが指定されている場合は検索マスタで絞り込む"""
+    if keywords is not None and len(keywords) > 0:
+        stmt = stmt.where(TSearchM.keywords == "\t".join(keywords))
+    if search_m_ids is not None:
+        stmt = stmt.where(TSearchM.id.in_(search_m_ids))
+    return stmt
+
+
+def __range_filter(stmt, since: datetime = None, until: datetime = None):
+    """期間が指定されている場合は検索日時で絞り込む(sinceは含み、untilは含まない)"""
+    if since is not None:
+        stmt = stmt.where(TSearch.search_datetime >= since)
+    if until is not None:
+        stmt = stmt.where(TSearch.search_datetime < until)
+    return stmt
+
+
+def __load_axes(conn, keywords: list[str], search_m_ids: list[int] = None, since: datetime = None, until: datetime = None) -> dict:
+    """検索マスタごとの日付軸(検索ID, 検索日時, 調査深さ)を1回の問い合わせで取得する"""
+    stmt = __range_filter(__keyword_filter(select(
+        TSearch.id
+        ,TSearch.search_m_id
+        ,TSearch.search_datetime
+        ,TSearch.search_depth
+    ).join(
+        TSearchM,TSearchM.id == TSearch.search_m_id
+    ), keywords, search_m_ids), since, until).order_by(
+        TSearch.search_m_id
+        ,TSearch.search_datetime.desc()
+    )
+    frame = pd.read_sql(stmt, conn, parse_dates=["search_datetime"])
+    axes = {}
+    for search_m_id, group in frame.groupby("search_m_id", sort=False):
+        axes[search_m_id] = (
+            pd.Index(group["id"].to_numpy()),
+            group["search_datetime"].to_numpy(),
+            group["search_depth"].to_numpy(dtype=np.float32, na_value=np.nan),
+        )
+    return axes
+
+
+def __load_chunk_axes(conn, frame: pd.DataFrame, since: datetime = None, until: datetime = None) -> dict:
+    """読み込んだランキングの行に含まれる検索マスタの日付軸だけを取得する"""
+    search_m_ids = pd.unique(frame["search_m_id"]).tolist()
+    axes = {}
+    for i in range(0, len(search_m_ids), AXES_CHUNK_SIZE):
+        axes.update(__load_axes(conn, None, search_m_ids[i:i + AXES_CHUNK_SIZE], since, until))
+    return axes
+
+
+def __pivot(group: pd.DataFrame, axis: tuple) -> RankingMatrix:
+    """1つのキーワードセットのランキングの行を順位行列にする"""
+    search_ids, dates, depth = axis
+    columns = search_ids.get_indexer(group["search_id"].to_numpy())
+    # 行は最新の検索で上位のものから出てきた順に並べる
+    rows, doc_ids = pd.factorize(group["doc_id"].to_numpy(), sort=False)
+    titles = group["title"].to_numpy()[np.unique(rows, return_index=True)[1]].tolist()
+    values = np.full((len(doc_ids), len(search_ids)), np.nan, dtype=np.float32)
+    values[rows, columns] = group["ranking"].to_numpy(dtype=np.float32)
+    return RankingMatrix(int(group["search_m_id"].iat[0]), group["keywords"].iat[0], dates, depth, doc_ids, titles, values)
+
+
+def iter_matrices(dbfile: str, keywords: list[str] = None, chunksize: int = DEFAULT_CHUNKSIZE, search_m_ids: list[int] = None,
+                  since: datetime = None, until: datetime = None):
+    """順位行列列挙処理
+
+    ランキング・検索・ドキュメントを結合した行をread_sqlでchunksize行ずつ読み込み、
+    キーワードセットごとの順位行列にして返す。
+    日付軸は読み込んだ行に含まれるキーワードセットの分だけをその都度取得するため、
+    一度に持つランキングの行と日付軸はchunksize行と1つのキーワードセット分だけになる。
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    keywords : list[str]
+        対象のキーワード。Noneか空のときはすべてのキーワードセット
+    chunksize : int
+        1回に読み込む行数
+    search_m_ids : list[int]
+        対象の検索マスタID。Noneのときは絞り込まない
+    since : datetime
+        この日時以降の検索だけを読み込む。Noneのときは絞り込まない
+    until : datetime
+        この日時より前の検索だけを読み込む。Noneのときは絞り込まない
+
+    Yields
+    ------
+    matrix : RankingMatrix
+        キーワード順に並んだキーワードセットごとの順位行列(ランキングが1件もないキーワードセットは返さない)
+    """
+    engine = sqlalchemy.create_engine("sqlite:///" + dbfile, echo=False)
+    try:
+        with engine.connect() as conn:
+            stmt = __range_filter(__keyword_filter(select(
+                TSearchM.keywords
+                ,TSearch.search_m_id
+                ,TRanking.search_id
+                ,TRanking.doc_id
+                ,TDoc.title
+                ,TRanking.ranking
+            ).join(
+                TSearch,TSearchM.id == TSearch.search_m_id
+            ).join(
+                TRanking,TSearch.id == TRanking.search_id
+            ).join(
+                TDoc,TRanking.doc_id == TDoc.id
+            ), keywords, search_m_ids), since, until).order_by(
+                TSearchM.keywords
+                ,TSearch.search_datetime.desc()
+                ,TRanking.ranking
+            )
+
+            carry = None
+            for chunk in pd.read_sql(stmt, conn, chunksize=chunksize):
+                if carry is not None:
+                    chunk = pd.concat([carry, chunk], ignore_index=True)
+                # キーワード順に並んでいるため、最後のキーワードセットだけは次の読み込みに続いている可能性がある
+                last = chunk["search_m_id"].iat[-1]
+                tail = chunk["search_m_id"].to_numpy() == last
+                carry = chunk[tail]
+                done = chunk[~tail]
+                if len(done) == 0:
+                    continue
+                axes = __load_chunk_axes(conn, done, since, until)
+                for search_m_id, group in done.groupby("search_m_id", sort=False):
+                    yield __pivot(group, axes[search_m_id])
+            if carry is not None and len(carry) > 0:
+                axes = __load_chunk_axes(conn, carry, since, until)
+                yield __pivot(carry, axes[carry["search_m_id"].iat[0]])
+    finally:
+        engine.dispose()
+
+
+def load_matrices(dbfile: str, keywords: list[str] = None, chunksize: int = DEFAULT_CHUNKSIZE,
+                  since: datetime = None, until: datetime = None) -> dict:
+    """順位行列読み込み処理
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    keywords : list[str]
+        対象のキーワード。Noneか空のときはすべてのキーワードセット
+    chunksize : int
+        1回に読み込む行数
+    since : datetime
+        この日時以降の検索だけを読み込む。Noneのときは絞り込まない
+    until : datetime
+        この日時より前の検索だけを読み込む。Noneのときは絞り込まない
+
+    Returns
+    -------
+    matrices : dict[str, RankingMatrix]
+        グラフの名前([検索マスタID]キーワード)をキーとした順位行列
+    """
+    return {matrix.name: matrix for matrix in iter_matrices(dbfile, keywords, chunksize, since=since, until=until)}
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import pprint
+import traceback
+import sqlalchemy
+from sqlalchemy import text
+from RankingModels import Base, TDoc, TRankingSummary
+
+# 自然キーが重複しているレコードを寄せる設定
+# (テーブル名, 自然キーの列, 子テーブル名, 子テーブルの外部キー列, 重複分の子レコードを削除するか)
+# 削除しない場合は子レコードの外部キーを残すレコード(最小のid)に付け替える
+DEDUP_TARGETS = [
+    ('t_search_m', ['keywords'], 't_search', 'search_m_id', False),
+    ('t_search', ['search_m_id', 'search_datetime'], 't_ranking', 'search_id', True),
+    ('t_doc', ['link_url_hash'], 't_ranking', 'doc_id', False),
+]
+
+
+def __add_columns(conn) -> list[str]:
+    """列追加処理
+
+    モデルに定義されていてデータベースに存在しない列をALTER TABLEで追加する。
+    SQLiteではNOT NULL制約付きの列を追加できないため、NULL許容で追加する。
+
+    Parameters
+    ----------
+    conn : Connection
+        データベース接続
+
+    Returns
+    -------
+    steps : list[str]
+        実施した処理のリスト
+    """
+    steps = []
+    inspector = sqlalchemy.inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        exists_columns = set(column["name"] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in exists_columns:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text("ALTER TABLE {} ADD COLUMN {} {}".format(table.name, column.name, column_type)))
+            steps.append("列追加: {}.{}".format(table.name, column.name))
+    return steps
+
+
+def __fill_url_hash(conn) -> list[str]:
+    """URLハッシュ設定処理
+
+    link_url_hashが未設定のドキュメントにURLのハッシュを設定する。
+
+    Parameters
+    ----------
+    conn : Connection
+        データベース接続
+
+    Returns
+    -------
+    steps : list[str]
+        実施した処理のリスト
+    """
+    result = conn.execute(text("SELECT id, link_url FROM t_doc WHERE link_url_hash IS NULL")).all()
+    if len(result) == 0:
+        return []
+    rows = [{"id": raw.id, "link_url_hash": TDoc.hash_url(raw.link_url)} for raw in result]
+    conn.execute(text("UPDATE t_doc SET link_url_hash = :link_url_hash WHERE id = :id"), rows)
+    return ["URLハッシュ設定: {}件".format(len(rows))]
+
+
+def __dedup(conn) -> list[str]:
+    """重複レコード統合処理
+
+    一意インデックスを作成できるように自然キーが重複しているレコードを最小のidのレコードに統合する。
+
+    Parameters
+    ----------
+    conn : Connection
+        データベース接続
+
+    Returns
+    -------
+    steps : list[str]
+        実施した処理のリスト
+    """
+    steps = []
+    for table_name, key_columns, child_table, child_column, delete_children in DEDUP_TARGETS:
+        join_condition = " AND ".join("t.{0} = k.{0}".format(c) for c in key_columns)
+        result = conn.execute(text(
+            "SELECT t.id, k.keep_id FROM {0} t"
+            " JOIN (SELECT {1}, MIN(id) AS keep_id FROM {0} GROUP BY {1} HAVING COUNT(*) > 1) k"
+            " ON {2} WHERE t.id <> k.keep_id".format(table_name, ", ".join(key_columns), join_condition)
+        )).all()
+        if len(result) == 0:
+            continue
+        rows = [{"id": raw.id, "keep_id": raw.keep_id} for raw in result]
+        if delete_children:
+            conn.execute(text("DELETE FROM {} WHERE {} = :id".format(child_table, child_column)), rows)
+        else:
+            conn.execute(text("UPDATE {0} SET {1} = :keep_id WHERE {1} = :id".format(child_table, child_column)), rows)
+        conn.execute(text("DELETE FROM {} WHERE id = :id".format(table_name)), rows)
+        steps.append("重複統合: {} {}件".format(table_name, len(rows)))
+    return steps
+
+
+def __create_indexes(conn) -> list[str]:
+    """インデックス作成処理
+
+    モデルに定義されていてデータベースに存在しないインデックスを作成する。
+
+    Parameters
+    ----------
+    conn : Connection
+        データベース接続
+
+    Returns
+    -------
+    steps : list[str]
+        実施した処理のリスト
+    """
+    steps = []
+    inspector = sqlalchemy.inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        exists_indexes = set(index["name"] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name in exists_indexes:
+                continue
+            index.create(conn)
+            steps.append("インデックス作成: {}".format(index.name))
+    return steps
+
+
+def __build_summary(conn) -> list[str]:
+    """最新順位集計作成処理
+
+    最新順位集計テーブルが空でランキングがある場合(集計テーブルを追加する前のデータベース)はランキングの履歴から作成する。
+
+    Parameters
+    ----------
+    conn : Connection
+        データベース接続
+
+    Returns
+    -------
+    steps : list[str]
+        実施した処理のリスト
+    """
+    if conn.execute(text("SELECT 1 FROM t_ranking_summary LIMIT 1")).first() is not None:
+        return []
+    if conn.execute(text("SELECT 1 FROM t_ranking LIMIT 1")).first() is None:
+        return []
+    count = TRankingSummary.rebuild(conn)
+    return ["最新順位集計作成: {}件".format(count)]
+
+
+def migrate(dbfile: str) -> list[str]:
+    """マイグレーション処理
+
+    既存のデータベースファイルをその場で現在のモデルの定義に合わせる。
+    テーブル・列の追加、URLハッシュの設定、重複レコードの統合、インデックスの作成、最新順位集計の作成を1トランザクションでおこなう。
+    何度実行しても結果は変わらない。
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+
+    Returns
+    -------
+    steps : list[str]
+        実施した処理のリスト
+    """
+    connect_string = "sqlite:///{}".format(dbfile)
+    engine = sqlalchemy.create_engine(connect_string, echo=False) # SQLとデータを出力したい場合はecho=Trueにする
+
+    steps = []
+    try:
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            steps.extend(__add_columns(conn))
+            steps.extend(__fill_url_hash(conn))
+            steps.extend(__dedup(conn))
+            steps.extend(__create_indexes(conn))
+            steps.extend(__build_summary(conn))
+        with engine.connect() as conn:
+            # 新しいインデックスをクエリプランナーに使わせるため統計情報を更新する
+            conn.execute(text("ANALYZE"))
+            conn.commit()
+    finally:
+        engine.dispose()
+    return steps
+
+
+def main(argv: list[str]):
+    """メイン処理
+
+    コマンドラインからの引数を受取り変数にセットしマイグレーション処理を呼び出す
+
+    Parameters
+    ----------
+    argv : list[str]
+        コマンドラインから入力された文字の配列
+    """
+    skip = False
+    dbfile="ranking.sqlite3"
+    try:
+        for i,arg in enumerate(argv):
+            if skip == False and i > 0:
+                if arg == '-db':
+                    dbfile = argv[i+1]
+                    skip = True
+                else:
+                    raise IndexError(arg)
+            else:
+                skip = False
+    except IndexError as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        t.insert(0,"[ERROR]:引数の形がちがいます")
+        t.insert(1,"py RankingMigrate.py [-db DBファイル名]")
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+
+    steps = migrate(dbfile)
+    if len(steps) == 0:
+        print("{}: 変更はありません".format(dbfile))
+    for step in steps:
+        print("{}: {}".format(dbfile, step))
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv)
+    except Exception as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
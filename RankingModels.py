@@ -1,12 +1,135 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import Column, Integer, String, Date, Float, DateTime
+import hashlib
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.sql.schema import UniqueConstraint
 
 Base = declarative_base()
 
+# 一括登録更新時に1文で登録するレコード数
+# (SQLiteのバインド変数の上限に引っかからないように分割する)
+UPSERT_CHUNK_SIZE = 200
+
+
+def open_db(dbfile: str, drop_flg: bool = False):
+    """データベース接続処理
+
+    SQLiteのデータベースファイルに接続し、テーブルが存在しない場合は作成する。
+    複数回の検索で同じエンジン・セッションを使いまわす場合に用いる。
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    drop_flg : bool
+        TrueのときテーブルをいったんDROPして作成しなおす
+
+    Returns
+    -------
+    engine : Engine
+        データベースエンジン。使い終わったらdispose()を呼ぶこと
+    session : scoped_session
+        データベース接続のセッション
+    """
+    connect_string = "sqlite:///{}".format(dbfile)
+    engine = sqlalchemy.create_engine(connect_string, echo=False) # SQLとデータを出力したい場合はecho=Trueにする
+
+    session = scoped_session(
+                sessionmaker(
+                    autocommit = False,
+                    autoflush = True,
+                    bind = engine))
+
+    Base.query = session.query_property()
+
+    if drop_flg:
+        Base.metadata.drop_all(engine)
+
+    Base.metadata.create_all(engine)
+    return engine, session
+
+
+def _dialect_insert(session: scoped_session):
+    """INSERT ... ON CONFLICT文の生成関数取得処理
+
+    接続先のデータベースに対応したON CONFLICT句を持つinsert関数を返す。
+    SQLiteとPostgreSQLに対応している。
+
+    Parameters
+    ----------
+    session: scoped_session
+        データベースへの接続セッション
+
+    Returns
+    -------
+    insert: function
+        sqlalchemy.dialects.sqlite.insertまたはsqlalchemy.dialects.postgresql.insert
+    """
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        return sqlite.insert
+    elif dialect_name == 'postgresql':
+        return postgresql.insert
+    raise NotImplementedError("{}はON CONFLICTによる登録更新に対応していません".format(dialect_name))
+
+
+# 接続先のデータベースごとの最新順位集計の登録更新文
+_summary_upserts = {}
+
+
+def _summary_upsert(session: scoped_session):
+    """最新順位集計のINSERT ... ON CONFLICT文取得処理
+
+    キーワードセットとドキュメントの組が登録済みなら今回の順位、最高順位(小さいほう)、最後に出てきた日時を更新する文を返す。
+    文は接続先のデータベースごとに1回だけ作成する。
+
+    Parameters
+    ----------
+    session: scoped_session
+        データベースへの接続セッション
+
+    Returns
+    -------
+    stmt: Insert
+        1レコード分のバインド変数を持つ文(executemanyで実行する)
+    """
+    dialect_name = session.get_bind().dialect.name
+    stmt = _summary_upserts.get(dialect_name)
+    if stmt is None:
+        table = TRankingSummary.__table__
+        stmt = _dialect_insert(session)(table)
+        # 2つの値の小さいほう(SQLiteは引数2つのmin、PostgreSQLはleast)
+        least = sqlalchemy.func.min if dialect_name == 'sqlite' else sqlalchemy.func.least
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.search_m_id, table.c.doc_id],
+            set_={
+                "latest_ranking": stmt.excluded.latest_ranking,
+                "best_ranking": least(table.c.best_ranking, stmt.excluded.best_ranking),
+                "last_seen": stmt.excluded.last_seen,
+                "latest_search_id": stmt.excluded.latest_search_id,
+            }
+        )
+        _summary_upserts[dialect_name] = stmt
+    return stmt
+
+
+def _chunks(rows: list):
+    """リストをUPSERT_CHUNK_SIZEごとに分割して返す"""
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        yield rows[i:i + UPSERT_CHUNK_SIZE]
+
+
+def _commit(session: scoped_session, commit: bool):
+    """commitがTrueのときcommit、Falseのときはflushのみおこなう"""
+    if commit:
+        session.commit()
+    else:
+        session.flush()
+
 
 class TSearchM(Base):
     """検索マスタ
@@ -25,14 +148,15 @@ class TSearchM(Base):
     """
 
     __tablename__ = 't_search_m'
+    __table_args__ = (Index('ix_t_search_m_keywords', 'keywords', unique=True),{})
     id = Column(Integer, primary_key=True, autoincrement=True)
     keywords = Column(String(256), nullable=False)
 
     @staticmethod
-    def upsert(t_search_m,session: scoped_session ):
+    def upsert(t_search_m,session: scoped_session, commit: bool = True ):
         """登録更新処理
 
-        keywordsで検索しレコードが存在しない場合にINSERTをおこなう。
+        keywordsを自然キーとしてINSERT ... ON CONFLICTで登録する。
         データが変更されていた場合はなにもおこなわない。
         (id以外に項目がkeywordsのみのため処理の必要がない)。
 
@@ -42,19 +166,49 @@ class TSearchM(Base):
             登録更新対象のデータ
         session: scoped_session
             データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう(呼び出し元でトランザクションをまとめる場合)
 
         Returns
         -------
         ret_t_search_m: TSearchM
             処理完了後のレコードが戻る
         """
-        ret_t_search_m = session.query(TSearchM).filter(TSearchM.keywords==t_search_m.keywords).first()
-        if ret_t_search_m is not None:
-            return ret_t_search_m
-        else:
-            session.add(t_search_m)
-            session.commit()
-            return t_search_m # commit後なのでidが採番されている
+        return TSearchM.upsert_all([t_search_m], session, commit)[0]
+
+    @staticmethod
+    def upsert_all(t_search_ms: list, session: scoped_session, commit: bool = True ) -> list:
+        """一括登録更新処理
+
+        keywordsを自然キーとしてINSERT ... ON CONFLICT ... RETURNINGでまとめて登録する。
+        既に存在するレコードも採番済みのidで戻る。
+
+        Parameters
+        ----------
+        t_search_ms: list[TSearchM]
+            登録更新対象のデータのリスト
+        session: scoped_session
+            データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう
+
+        Returns
+        -------
+        ret_t_search_ms: list[TSearchM]
+            処理完了後のレコードのリスト(順番は引数と一致しない)
+        """
+        dialect_insert = _dialect_insert(session)
+        ret_t_search_ms = []
+        for chunk in _chunks(t_search_ms):
+            stmt = dialect_insert(TSearchM).values([{"keywords": t.keywords} for t in chunk])
+            # DO NOTHINGでは既存行がRETURNINGで戻らないため同じ値で更新する
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TSearchM.keywords],
+                set_={"keywords": stmt.excluded.keywords}
+            ).returning(TSearchM)
+            ret_t_search_ms.extend(session.scalars(stmt.execution_options(populate_existing=True)).all())
+        _commit(session, commit)
+        return ret_t_search_ms
 
 
 class TSearch(Base):
@@ -71,20 +225,24 @@ class TSearch(Base):
         検索マスタID 外部キー(検索.id)
     search_datetime : datetime
         検索日時
+    search_depth : int
+        実際に調べた順位。これより深い順位は調べていない(ランク外かどうか不明)。
+        NULLのときは不明(調べる予定だった順位まで調べた扱い)
     """
 
     __tablename__ = 't_search'
+    __table_args__ = (Index('ix_t_search_search_m_id_search_datetime', 'search_m_id', 'search_datetime', unique=True),{})
     id = Column(Integer, primary_key=True, autoincrement=True)
     search_m_id = Column(Integer, nullable=False)
     search_datetime = Column(DateTime, nullable=False)
+    search_depth = Column(Integer)
 
     @staticmethod
-    def upsert(t_search,session: scoped_session ):
+    def upsert(t_search,session: scoped_session, commit: bool = True ):
         """登録更新処理
 
-        search_datetimeで検索しレコードが存在しない場合にINSERTをおこなう。
-        データが変更されていた場合はなにもおこなわない。
-        (id以外に項目がsearch_datetimeのみのため処理の必要がない)。
+        search_m_idとsearch_datetimeを自然キーとしてINSERT ... ON CONFLICTで登録する。
+        データが存在する場合は調査深さを更新する。
 
         Parameters
         ----------
@@ -92,19 +250,49 @@ class TSearch(Base):
             登録更新対象のデータ
         session: scoped_session
             データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう(呼び出し元でトランザクションをまとめる場合)
 
         Returns
         -------
         ret_t_search: TSearch
             処理完了後のレコードが戻る
         """
-        ret_t_search = session.query(TSearch).filter(TSearch.search_datetime==t_search.search_datetime).first()
-        if ret_t_search is not None:
-            return ret_t_search
-        else:
-            session.add(t_search)
-            session.commit()
-            return t_search # commit後なのでidが採番されている
+        return TSearch.upsert_all([t_search], session, commit)[0]
+
+    @staticmethod
+    def upsert_all(t_searches: list, session: scoped_session, commit: bool = True ) -> list:
+        """一括登録更新処理
+
+        search_m_idとsearch_datetimeを自然キーとしてINSERT ... ON CONFLICT ... RETURNINGでまとめて登録する。
+
+        Parameters
+        ----------
+        t_searches: list[TSearch]
+            登録更新対象のデータのリスト
+        session: scoped_session
+            データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう
+
+        Returns
+        -------
+        ret_t_searches: list[TSearch]
+            処理完了後のレコードのリスト(順番は引数と一致しない)
+        """
+        dialect_insert = _dialect_insert(session)
+        ret_t_searches = []
+        for chunk in _chunks(t_searches):
+            stmt = dialect_insert(TSearch).values([
+                {"search_m_id": t.search_m_id, "search_datetime": t.search_datetime, "search_depth": t.search_depth} for t in chunk
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TSearch.search_m_id, TSearch.search_datetime],
+                set_={"search_depth": stmt.excluded.search_depth}
+            ).returning(TSearch)
+            ret_t_searches.extend(session.scalars(stmt.execution_options(populate_existing=True)).all())
+        _commit(session, commit)
+        return ret_t_searches
 
 class TRanking(Base):
     """ランキング
@@ -125,7 +313,11 @@ class TRanking(Base):
         順位
     """
     __tablename__ = 't_ranking'
-    __table_args__ = (UniqueConstraint('search_id','ranking'),{})    
+    __table_args__ = (
+        UniqueConstraint('search_id','ranking'),
+        Index('ix_t_ranking_search_id_doc_id', 'search_id', 'doc_id'),
+        Index('ix_t_ranking_doc_id', 'doc_id'),
+        {})
     id = Column(Integer, primary_key=True, autoincrement=True)
     search_id = Column(Integer, nullable=False)
     doc_id = Column(Integer, nullable=False)
@@ -154,10 +346,10 @@ class TRanking(Base):
         return t_ranking
 
     @staticmethod
-    def upsert(t_ranking,session: scoped_session ):
+    def upsert(t_ranking,session: scoped_session, commit: bool = True ):
         """登録更新処理
 
-        search_idとrankingで検索しレコードが存在しない場合にINSERTをおこなう。
+        search_idとrankingを自然キーとしてINSERT ... ON CONFLICTで登録する。
         データが変更されていた場合はUPDATE処理をおこなう。
 
         Parameters
@@ -166,21 +358,77 @@ class TRanking(Base):
             登録更新対象のデータ
         session: scoped_session
             データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう
 
         Returns
         -------
         ret_t_ranking: TRanking
             処理完了後のレコードが戻る
         """
-        ret_t_ranking = session.query(TRanking).filter(TRanking.search_id==t_ranking.search_id).filter(TRanking.ranking==t_ranking.ranking).first()
-        if ret_t_ranking is None:
-            session.add(t_ranking)
-            session.commit()
-            return t_ranking
-        elif ret_t_ranking.doc_id != t_ranking.doc_id:
-            ret_t_ranking.doc_id = t_ranking.doc_id
-            session.commit()
-        return ret_t_ranking
+        return TRanking.upsert_all([t_ranking], session, commit)[0]
+
+    @staticmethod
+    def upsert_all(t_rankings: list, session: scoped_session, commit: bool = True ) -> list:
+        """一括登録更新処理
+
+        search_idとrankingを自然キーとしてINSERT ... ON CONFLICT DO UPDATE ... RETURNINGでまとめて登録更新する。
+
+        Parameters
+        ----------
+        t_rankings: list[TRanking]
+            登録更新対象のデータのリスト
+        session: scoped_session
+            データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう
+
+        Returns
+        -------
+        ret_t_rankings: list[TRanking]
+            処理完了後のレコードのリスト(順番は引数と一致しない)
+        """
+        dialect_insert = _dialect_insert(session)
+        ret_t_rankings = []
+        for chunk in _chunks(t_rankings):
+            stmt = dialect_insert(TRanking).values([
+                {"search_id": t.search_id, "doc_id": t.doc_id, "ranking": t.ranking} for t in chunk
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TRanking.search_id, TRanking.ranking],
+                set_={"doc_id": stmt.excluded.doc_id}
+            ).returning(TRanking)
+            ret_t_rankings.extend(session.scalars(stmt.execution_options(populate_existing=True)).all())
+        _commit(session, commit)
+        return ret_t_rankings
+
+    @staticmethod
+    def bulk_insert(t_rankings: list, session: scoped_session ):
+        """一括登録処理
+
+        t_rankingのリストを1回のexecutemanyでINSERTする。
+        commitはおこなわないため呼び出し元でトランザクションを確定させること。
+
+        Parameters
+        ----------
+        t_rankings: list[TRanking]
+            登録対象データのリスト
+        session: scoped_session
+            データベースへの接続セッション
+
+        Returns
+        -------
+        count: int
+            登録した件数
+        """
+        if len(t_rankings) == 0:
+            return 0
+        rows = [
+            {"search_id": t.search_id, "doc_id": t.doc_id, "ranking": t.ranking}
+            for t in t_rankings
+        ]
+        session.execute(TRanking.__table__.insert(), rows)
+        return len(rows)
 
     @staticmethod
     def hasRanking(t_ranking,session: scoped_session ):
@@ -219,22 +467,44 @@ class TDoc(Base):
         ドキュメントID 自動採番
     link_url : str
         ドキュメントのURL、自然キー
+    link_url_hash : str
+        ドキュメントのURLのSHA-1(16進数40桁)。
+        2083文字のURLに直接インデックスを張らずに済むよう、URLでの検索はこの列でおこなう
     title : str
         検索結果から取得したページのタイトル
     mypage_flg : bool
         自分のページかどうかのフラグ。自ページのときTrue
     """
     __tablename__ = 't_doc'
+    __table_args__ = (Index('ix_t_doc_link_url_hash', 'link_url_hash', unique=True),{})
     id = Column(Integer, primary_key=True, autoincrement=True)
     link_url = Column(String(2083), nullable=False)
+    link_url_hash = Column(String(40), nullable=False,
+                           default=lambda context: TDoc.hash_url(context.get_current_parameters()["link_url"]))
     title = Column(String(128))
     mypage_flg = Column(Integer, nullable=False)
 
     @staticmethod
-    def upsert(t_doc,session: scoped_session ):
+    def hash_url(link_url: str) -> str:
+        """URLハッシュ値取得処理
+
+        Parameters
+        ----------
+        link_url: str
+            ドキュメントのURL
+
+        Returns
+        -------
+        link_url_hash: str
+            URLのSHA-1の16進数文字列
+        """
+        return hashlib.sha1(link_url.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def upsert(t_doc,session: scoped_session, commit: bool = True ):
         """登録更新処理
 
-        URLで検索しレコードが存在しない場合にINSERTをおこなう。
+        URLを自然キーとしてINSERT ... ON CONFLICTで登録する。
         データが変更されていた場合はUPDATE処理をおこなう。
 
         Parameters
@@ -243,20 +513,212 @@ class TDoc(Base):
             登録更新対象のデータ
         session: scoped_session
             データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう
 
         Returns
         -------
         ret_t_doc: TDoc
             処理完了後のレコードが戻る
         """
-        ret_t_doc = session.query(TDoc).filter(TDoc.link_url==t_doc.link_url).first()
-        if ret_t_doc is None:
-            session.add(t_doc)
-            session.commit()
-            return t_doc
-        elif ret_t_doc.title != t_doc.title or ret_t_doc.mypage_flg != t_doc.mypage_flg:
-            ret_t_doc.title = t_doc.title
-            ret_t_doc.mypage_flg = t_doc.mypage_flg
-            session.commit()
-        return ret_t_doc
+        return TDoc.upsert_all([t_doc], session, commit)[0]
+
+    @staticmethod
+    def upsert_all(t_docs: list, session: scoped_session, commit: bool = True ) -> list:
+        """一括登録更新処理
+
+        URLのハッシュを自然キーとしてINSERT ... ON CONFLICT DO UPDATE ... RETURNINGでまとめて登録更新する。
+        タイトルと自ページフラグが変わっていないレコードは更新せず、あとからまとめて検索して返す。
 
+        Parameters
+        ----------
+        t_docs: list[TDoc]
+            登録更新対象のデータのリスト(link_urlは重複していないこと)
+        session: scoped_session
+            データベースへの接続セッション
+        commit: bool
+            Falseのときはcommitせずflushのみおこなう
+
+        Returns
+        -------
+        ret_t_docs: list[TDoc]
+            処理完了後のレコードのリスト(順番は引数と一致しない)
+        """
+        dialect_insert = _dialect_insert(session)
+        ret_t_docs = []
+        for chunk in _chunks(t_docs):
+            rows = [
+                {"link_url": t.link_url, "link_url_hash": TDoc.hash_url(t.link_url), "title": t.title, "mypage_flg": t.mypage_flg}
+                for t in chunk
+            ]
+            stmt = dialect_insert(TDoc).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TDoc.link_url_hash],
+                set_={"title": stmt.excluded.title, "mypage_flg": stmt.excluded.mypage_flg},
+                where=TDoc.title.is_distinct_from(stmt.excluded.title) | TDoc.mypage_flg.is_distinct_from(stmt.excluded.mypage_flg)
+            ).returning(TDoc)
+            returned = session.scalars(stmt.execution_options(populate_existing=True)).all()
+            ret_t_docs.extend(returned)
+
+            # 変更がなく更新されなかったレコードはRETURNINGで戻らないので検索する
+            returned_hashes = set(t.link_url_hash for t in returned)
+            unchanged_hashes = [row["link_url_hash"] for row in rows if row["link_url_hash"] not in returned_hashes]
+            if len(unchanged_hashes) > 0:
+                ret_t_docs.extend(session.query(TDoc).filter(TDoc.link_url_hash.in_(unchanged_hashes)).all())
+        _commit(session, commit)
+        return ret_t_docs
+
+
+class TRankingSummary(Base):
+    """最新順位集計
+
+    データベースの最新順位集計テーブルに対応するオブジェクト。
+    キーワードセットとドキュメントごとに最新の検索での順位、1つ前の検索での順位、最高順位、初めて・最後に出てきた日時を持つ。
+    ランキングの登録と同じトランザクションでapplyを呼び出して更新するため、
+    「今それぞれのドキュメントが何位か」をランキングの履歴を集計せずに取得できる。
+
+    Attributes
+    ----------
+    search_m_id : int
+        検索マスタID 外部キー(検索マスタ.id)
+    doc_id : int
+        ドキュメントID 外部キー(ドキュメント.id)
+    latest_ranking : int
+        最新の検索での順位。最新の検索で出てこなかった場合はNULL
+    previous_ranking : int
+        1つ前の検索での順位。1つ前の検索で出てこなかった場合はNULL
+    best_ranking : int
+        これまでの最高順位
+    first_seen : datetime
+        初めて出てきた検索の検索日時
+    last_seen : datetime
+        最後に出てきた検索の検索日時
+    latest_search_id : int
+        このレコードを最後に更新した検索のID(同じ検索を登録しなおした場合の判定に使う)
+    """
+    __tablename__ = 't_ranking_summary'
+    __table_args__ = (
+        Index('ix_t_ranking_summary_search_m_id_latest_ranking', 'search_m_id', 'latest_ranking'),
+        {})
+    search_m_id = Column(Integer, primary_key=True)
+    doc_id = Column(Integer, primary_key=True)
+    latest_ranking = Column(Integer)
+    previous_ranking = Column(Integer)
+    best_ranking = Column(Integer, nullable=False)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False)
+    latest_search_id = Column(Integer, nullable=False)
+
+    @staticmethod
+    def apply(t_search, t_rankings: list, session: scoped_session):
+        """集計更新処理
+
+        登録した検索のランキングを集計に反映する。commitはおこなわないため、ランキングの登録と同じトランザクションで呼び出すこと。
+        キーワードセットの最新の検索であれば、前回出てきたドキュメントの順位を1つ前の順位にずらしてから今回の順位で登録更新する
+        (更新するのは前回・今回に出てきたドキュメントの行だけ)。
+        過去の日時の検索を後から登録した場合や、同じ検索を登録しなおした場合はそのキーワードセットの集計を作り直す。
+
+        Parameters
+        ----------
+        t_search: TSearch
+            登録した検索
+        t_rankings: list[TRanking]
+            登録したランキングのリスト
+        session: scoped_session
+            データベースへの接続セッション
+        """
+        newer = session.query(TSearch.id).filter(
+            TSearch.search_m_id == t_search.search_m_id,
+            TSearch.id != t_search.id,
+            TSearch.search_datetime >= t_search.search_datetime
+        ).first()
+        applied = session.query(TRankingSummary.doc_id).filter(
+            TRankingSummary.search_m_id == t_search.search_m_id,
+            TRankingSummary.latest_search_id == t_search.id
+        ).first()
+        if newer is not None or applied is not None:
+            TRankingSummary.rebuild(session, t_search.search_m_id)
+            return
+
+        table = TRankingSummary.__table__
+        session.execute(table.update().where(
+            table.c.search_m_id == t_search.search_m_id,
+            (table.c.latest_ranking.is_not(None)) | (table.c.previous_ranking.is_not(None))
+        ).values(
+            previous_ranking=table.c.latest_ranking,
+            latest_ranking=None,
+            latest_search_id=t_search.id
+        ))
+
+        # 同じドキュメントが2回出てきた場合は上の順位を使う
+        ranks = {}
+        for t in t_rankings:
+            if t.doc_id not in ranks or t.ranking < ranks[t.doc_id]:
+                ranks[t.doc_id] = t.ranking
+        if len(ranks) == 0:
+            return
+        rows = [
+            {"search_m_id": t_search.search_m_id, "doc_id": doc_id, "latest_ranking": ranking, "previous_ranking": None,
+             "best_ranking": ranking, "first_seen": t_search.search_datetime, "last_seen": t_search.search_datetime,
+             "latest_search_id": t_search.id}
+            for doc_id, ranking in ranks.items()
+        ]
+        # 文は毎回同じものを使い、1回のexecutemanyで登録更新する(コンパイル済みの文がキャッシュされる)
+        session.execute(_summary_upsert(session), rows)
+
+    @staticmethod
+    def rebuild(session, search_m_id: int = None) -> int:
+        """集計作成処理
+
+        ランキングの履歴から集計を作り直す。commitはおこなわない。
+
+        Parameters
+        ----------
+        session: scoped_session or Connection
+            データベースへの接続セッション
+        search_m_id: int
+            作り直すキーワードセットの検索マスタID。Noneのときはすべてのキーワードセット
+
+        Returns
+        -------
+        count: int
+            作成したレコード数
+        """
+        where = "" if search_m_id is None else " WHERE s.search_m_id = :search_m_id"
+        params = {} if search_m_id is None else {"search_m_id": search_m_id}
+        session.execute(sqlalchemy.text(
+            "DELETE FROM t_ranking_summary" + ("" if search_m_id is None else " WHERE search_m_id = :search_m_id")
+        ), params)
+        result = session.execute(sqlalchemy.text(
+            "INSERT INTO t_ranking_summary (search_m_id, doc_id, best_ranking, first_seen, last_seen, latest_search_id)"
+            " SELECT s.search_m_id, r.doc_id, MIN(r.ranking), MIN(s.search_datetime), MAX(s.search_datetime), 0"
+            " FROM t_ranking r JOIN t_search s ON s.id = r.search_id" + where +
+            " GROUP BY s.search_m_id, r.doc_id"
+        ), params)
+        # 最新の検索(OFFSET 0)と1つ前の検索(OFFSET 1)の順位を入れる
+        for column, offset in (("latest_ranking", 0), ("previous_ranking", 1)):
+            session.execute(sqlalchemy.text(
+                "UPDATE t_ranking_summary SET {0} = ("
+                " SELECT MIN(r.ranking) FROM t_ranking r WHERE r.doc_id = t_ranking_summary.doc_id AND r.search_id = ("
+                "  SELECT s.id FROM t_search s WHERE s.search_m_id = t_ranking_summary.search_m_id"
+                "  ORDER BY s.search_datetime DESC LIMIT 1 OFFSET {1}))".format(column, offset) +
+                ("" if search_m_id is None else " WHERE search_m_id = :search_m_id")
+            ), params)
+        # latest_search_idはapplyで最後に更新される検索にする。
+        # 最新か1つ前の検索に出てきたドキュメントは最新の検索、それ以外は最後に出てきた検索から2つ後の検索
+        # (1つ後で最新の順位が、2つ後で1つ前の順位が空になり、それ以降は更新されない)
+        and_search_m_id = "" if search_m_id is None else " AND search_m_id = :search_m_id"
+        session.execute(sqlalchemy.text(
+            "UPDATE t_ranking_summary SET latest_search_id = ("
+            " SELECT s.id FROM t_search s WHERE s.search_m_id = t_ranking_summary.search_m_id"
+            " ORDER BY s.search_datetime DESC LIMIT 1)"
+            " WHERE (latest_ranking IS NOT NULL OR previous_ranking IS NOT NULL)" + and_search_m_id
+        ), params)
+        session.execute(sqlalchemy.text(
+            "UPDATE t_ranking_summary SET latest_search_id = ("
+            " SELECT s.id FROM t_search s WHERE s.search_m_id = t_ranking_summary.search_m_id"
+            " AND s.search_datetime >= t_ranking_summary.last_seen"
+            " ORDER BY s.search_datetime LIMIT 1 OFFSET 2)"
+            " WHERE latest_ranking IS NULL AND previous_ranking IS NULL" + and_search_m_id
+        ), params)
+        return result.rowcount
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import csv
+import pprint
+import traceback
+from sqlalchemy import text, func
+from RankingModels import TSearch, open_db
+import RankingCodec
+
+# 上位何位までの出入りを見るかの既定値
+DEFAULT_TOP = 10
+# 何位以上の変動を出力するかの既定値
+DEFAULT_THRESHOLD = 5
+# 前回どの検索まで処理したかを記録するファイル名の既定値
+DEFAULT_STATE_FILE = "movers-state.json"
+REPORT_FORMATS = ('csv', 'json')
+REPORT_COLUMNS = ["keywords", "search_datetime", "prev_search_datetime", "event", "previous_ranking", "ranking", "delta",
+                  "doc_id", "link_url", "title", "mypage_flg"]
+
+# 新しい検索ごとに、同じキーワードセットの1つ前の検索(LAG)との順位の差を求める。
+# 対象の検索は登録順(検索ID)で区切る。並行検索では検索日時の順に登録されるとは限らないため、検索日時では区切らない。
+# 1つ前の検索は(検索日時, 検索ID)の順で求める。
+# 今回出てきたドキュメント(前回は出てこなかった場合もある)と、前回出てきて今回出てこなかったドキュメントを合わせ、
+# 上位への出入り・大きな変動・自サイトの変動だけを残す
+MOVEMENT_SQL = """
+WITH t AS (
+    SELECT id, search_m_id, search_datetime
+    FROM t_search
+    WHERE id > :after_id AND id <= :upto_id
+), s AS (
+    SELECT id, search_m_id, search_datetime
+        ,LAG(id) OVER (PARTITION BY search_m_id ORDER BY search_datetime, id) AS prev_id
+        ,LAG(search_datetime) OVER (PARTITION BY search_m_id ORDER BY search_datetime, id) AS prev_datetime
+    FROM t_search
+    WHERE search_m_id IN (SELECT search_m_id FROM t)
+), n AS (
+    SELECT s.* FROM s JOIN t ON t.id = s.id WHERE s.prev_id IS NOT NULL
+), m AS (
+    SELECT n.search_m_id, n.search_datetime, n.prev_datetime, r.doc_id, p.ranking AS previous_ranking, r.ranking
+    FROM n
+    JOIN t_ranking r ON r.search_id = n.id
+    LEFT JOIN t_ranking p ON p.search_id = n.prev_id AND p.doc_id = r.doc_id
+    UNION ALL
+    SELECT n.search_m_id, n.search_datetime, n.prev_datetime, p.doc_id, p.ranking AS previous_ranking, NULL AS ranking
+    FROM n
+    JOIN t_ranking p ON p.search_id = n.prev_id
+    LEFT JOIN t_ranking r ON r.search_id = n.id AND r.doc_id = p.doc_id
+    WHERE r.id IS NULL
+), e AS (
+    SELECT m.*
+        ,CASE
+            WHEN m.ranking <= :top AND (m.previous_ranking IS NULL OR m.previous_ranking > :top) THEN 'enter'
+            WHEN m.previous_ranking <= :top AND (m.ranking IS NULL OR m.ranking > :top) THEN 'leave'
+            WHEN m.previous_ranking - m.ranking >= :threshold THEN 'up'
+            WHEN m.ranking - m.previous_ranking >= :threshold THEN 'down'
+            WHEN d.mypage_flg = :true AND COALESCE(m.ranking, 0) <> COALESCE(m.previous_ranking, 0) THEN 'mypage'
+        END AS event
+        ,d.link_url, d.title, d.mypage_flg
+    FROM m
+    JOIN t_doc d ON d.id = m.doc_id
+)
+SELECT sm.keywords, e.search_datetime, e.prev_datetime AS prev_search_datetime, e.event
+    ,e.previous_ranking, e.ranking, e.previous_ranking - e.ranking AS delta
+    ,e.doc_id, e.link_url, e.title, e.mypage_flg
+FROM e
+JOIN t_search_m sm ON sm.id = e.search_m_id
+WHERE e.event IS NOT NULL
+ORDER BY sm.keywords, e.search_datetime, e.event, COALESCE(e.ranking, e.previous_ranking)
+"""
+
+
+def detect_movements(conn, after_id: int, upto_id: int, top: int = DEFAULT_TOP, threshold: int = DEFAULT_THRESHOLD) -> list[dict]:
+    """順位変動検出処理
+
+    検索IDがafter_idより大きくupto_id以下の検索(前回より後に登録された検索)について、
+    同じキーワードセットの1つ前の日時の検索からの順位の変動を1回のSQLで求める。
+
+    Parameters
+    ----------
+    conn : Connection or scoped_session
+        データベース接続
+    after_id : int
+        この検索IDより後の検索を対象にする(前回の処理済みの検索ID)
+    upto_id : int
+        この検索IDまでを対象にする
+    top : int
+        上位何位までの出入りを見るか
+    threshold : int
+        何位以上の変動を出力するか
+
+    Returns
+    -------
+    movements : list[dict]
+        REPORT_COLUMNSを持つディクショナリのリスト。eventは
+        enter(上位に入った)、leave(上位から外れた)、up(threshold位以上上がった)、down(threshold位以上下がった)、
+        mypage(自サイトのそれ以外の変動)のいずれか。deltaは上がった場合に正の数になる
+    """
+    result = conn.execute(text(MOVEMENT_SQL), {"after_id": after_id, "upto_id": upto_id, "top": top, "threshold": threshold, "true": True})
+    return [dict(row._mapping) for row in result]
+
+
+def load_watermark(state_file: str) -> int:
+    """処理済みの検索ID読み込み処理(ファイルがないか壊れている場合は0)"""
+    try:
+        with open(state_file, 'rb') as f:
+            return int(RankingCodec.loads(f.read()).get("last_search_id", 0))
+    except (FileNotFoundError, ValueError, TypeError, AttributeError):
+        return 0
+
+
+def save_watermark(state_file: str, last_search_id: int):
+    """処理済みの検索ID書き込み処理(一時ファイルに書いてから置き換える)"""
+    dirname = os.path.dirname(state_file)
+    if len(dirname) > 0:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = state_file + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(RankingCodec.dumps({"last_search_id": last_search_id}))
+    os.replace(tmp_path, state_file)
+
+
+def write_report(movements: list[dict], output, report_format: str = 'csv'):
+    """レポート出力処理
+
+    Parameters
+    ----------
+    movements : list[dict]
+        detect_movementsの結果
+    output : TextIO
+        出力先
+    report_format : str
+        csvまたはjson
+    """
+    if report_format == 'json':
+        rows = [{column: (str(row[column]) if column.endswith("datetime") and row[column] is not None else row[column])
+                 for column in REPORT_COLUMNS} for row in movements]
+        output.write(RankingCodec.dumps(rows).decode('utf-8') + "\n")
+        return
+    writer = csv.DictWriter(output, fieldnames=REPORT_COLUMNS, extrasaction='ignore', lineterminator="\n")
+    writer.writeheader()
+    for row in movements:
+        row = dict(row)
+        row["keywords"] = row["keywords"].replace("\t", " ")
+        writer.writerow(row)
+
+
+def report_movements(dbfile: str, output, report_format: str = 'csv', state_file: str = DEFAULT_STATE_FILE,
+                     top: int = DEFAULT_TOP, threshold: int = DEFAULT_THRESHOLD, reset: bool = False) -> int:
+    """前回からの順位変動レポート出力処理
+
+    前回処理した検索IDより後に登録された検索だけを対象に順位の変動を求めてレポートを出力し、処理した検索IDを記録する。
+    登録順で区切るため、検索日時の順に登録されなかった検索(並行検索や再開した一括検索、過去の検索の取り込み)も次回に処理する。
+    レポートの出力が終わってから記録するため、途中で失敗した場合は次回に同じ検索をもう一度処理する。
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    output : TextIO
+        出力先
+    report_format : str
+        csvまたはjson
+    state_file : str
+        処理済みの検索IDを記録するファイル名
+    top : int
+        上位何位までの出入りを見るか
+    threshold : int
+        何位以上の変動を出力するか
+    reset : bool
+        Trueのとき記録を無視してすべての検索を対象にする
+
+    Returns
+    -------
+    count : int
+        出力した変動の件数
+    """
+    after_id = 0 if reset else load_watermark(state_file)
+    engine, session = open_db(dbfile)
+    try:
+        # 処理中に登録された検索は次回にまわす
+        upto_id = session.query(func.coalesce(func.max(TSearch.id), 0)).scalar()
+        movements = detect_movements(session, after_id, upto_id, top, threshold)
+    finally:
+        session.close()
+        engine.dispose()
+    write_report(movements, output, report_format)
+    save_watermark(state_file, max(after_id, upto_id))
+    return len(movements)
+
+
+def main(argv: list[str]):
+    """メイン処理
+
+    コマンドラインからの引数を受取り変数にセットし順位変動のレポートを出力する
+
+    Parameters
+    ----------
+    argv : list[str]
+        コマンドラインから入力された文字の配列
+    """
+    skip = False
+    dbfile="ranking.sqlite3"
+    state_file = DEFAULT_STATE_FILE
+    output_file = None
+    report_format = 'csv'
+    top = DEFAULT_TOP
+    threshold = DEFAULT_THRESHOLD
+    reset = False
+    try:
+        for i,arg in enumerate(argv):
+            if skip == False and i > 0:
+                if arg == '-db':
+                    dbfile = argv[i+1]
+                    skip = True
+                elif arg == '-o':
+                    output_file = argv[i+1]
+                    skip = True
+                elif arg == '--format':
+                    report_format = argv[i+1]
+                    if report_format not in REPORT_FORMATS:
+                        raise ValueError("formatオプションにはcsvかjsonを指定してください")
+                    skip = True
+                elif arg == '--top':
+                    top = int(argv[i+1])
+                    skip = True
+                elif arg == '-k':
+                    threshold = int(argv[i+1])
+                    if threshold <= 0:
+                        raise ValueError("kオプションの値は正の整数を指定してください")
+                    skip = True
+                elif arg == '--state':
+                    state_file = argv[i+1]
+                    skip = True
+                elif arg == '--reset':
+                    reset = True
+                else:
+                    raise IndexError(arg)
+            else:
+                skip = False
+    except (IndexError, ValueError) as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        t.insert(0,"[ERROR]:引数の形がちがいます")
+        t.insert(1,"py RankingMovers.py [-db DBファイル名] [-o 出力ファイル名] [--format csv|json] [--top 順位] [-k 変動幅] [--state 記録ファイル名] [--reset]")
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+
+    if output_file is None:
+        report_movements(dbfile, sys.stdout, report_format, state_file, top, threshold, reset)
+    else:
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            report_movements(dbfile, f, report_format, state_file, top, threshold, reset)
+
+if __name__ == '__main__':
+    try:
+        main(sys.argv)
+    except Exception as e:
+        (exc_type, exc_value, exc_traceback) = sys.exc_info()
+        t = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        pprint.pprint(t, width=120,stream=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import math
+import statistics
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import scoped_session
+from RankingModels import TSearchM, TSearch, TRanking, TDoc
+
+# 1ページあたりの件数(Custom Search APIの1回の呼び出しで取得できる件数)
+PAGE_SIZE = 10
+# 安定していると判断するのに必要な過去の検索回数
+STABLE_MIN_HISTORY = 3
+# 安定していると判断する順位の変動幅
+STABLE_SPREAD = 2
+# 過去の最低順位に加えて余分に調べる順位
+DEPTH_MARGIN = 5
+
+
+def __select_history(session: scoped_session, search_m_ids: list[int], history: int) -> dict:
+    """自ページ順位履歴取得処理
+
+    検索マスタごとに直近history回の検索について、自ページ(mypage_flg)の最高順位を新しい順に取得する。
+
+    Parameters
+    ----------
+    session : scoped_session
+        データベース接続のセッション
+    search_m_ids : list[int]
+        検索マスタIDのリスト
+    history : int
+        参照する過去の検索回数
+
+    Returns
+    -------
+    history_dic : dict[int, list[int]]
+        検索マスタIDをキーとした自ページの最高順位のリスト(新しい順、ランク外はNone)
+    """
+    mypage_doc_ids = select(TDoc.id).where(TDoc.mypage_flg == 1)
+
+    history_dic = {}
+    chunk_size = 500
+    for i in range(0, len(search_m_ids), chunk_size):
+        chunk = search_m_ids[i:i + chunk_size]
+        ranked = select(
+            TSearch.id
+            ,TSearch.search_m_id
+            ,func.row_number().over(
+                partition_by=TSearch.search_m_id,
+                order_by=TSearch.search_datetime.desc()
+            ).label("rn")
+        ).where(
+            TSearch.search_m_id.in_(chunk)
+        ).subquery()
+
+        stmt = select(
+            ranked.c.search_m_id
+            ,ranked.c.rn
+            ,func.min(TRanking.ranking).label("best")
+        ).outerjoin(
+            TRanking, and_(TRanking.search_id == ranked.c.id, TRanking.doc_id.in_(mypage_doc_ids))
+        ).where(
+            ranked.c.rn <= history
+        ).group_by(
+            ranked.c.search_m_id
+            ,ranked.c.rn
+        ).order_by(
+            ranked.c.search_m_id
+            ,ranked.c.rn
+        )
+        for raw in session.execute(stmt):
+            history_dic.setdefault(raw.search_m_id, []).append(raw.best)
+    return history_dic
+
+
+def __evaluate(ranks: list, max_pages: int) -> tuple:
+    """キーワードセット評価処理
+
+    自ページの順位履歴から、必要なページ数と優先度を決める。
+
+    Parameters
+    ----------
+    ranks : list[int]
+        自ページの最高順位の履歴(新しい順、ランク外はNone)。履歴がない場合は空のリスト
+    max_pages : int
+        このキーワードセットで取得できる最大ページ数
+
+    Returns
+    -------
+    pages : int
+        取得したいページ数
+    priority : float
+        優先度(大きいほど先に検索する)
+    reason : str
+        判断の理由
+    """
+    if len(ranks) == 0:
+        # 履歴がないキーワードセットは全体を把握するため最優先で最後まで調べる
+        return max_pages, float("inf"), "new"
+
+    # ランク外は調べた範囲のすぐ外側とみなす
+    out_of_rank = max_pages * PAGE_SIZE + 1
+    values = [out_of_rank if rank is None else rank for rank in ranks]
+
+    if len(values) >= STABLE_MIN_HISTORY and max(values) <= PAGE_SIZE and max(values) - min(values) <= STABLE_SPREAD:
+        # 1ページ目で安定しているので1ページだけ確認する
+        return 1, 0.0, "stable"
+
+    volatility = statistics.pstdev(values) if len(values) > 1 else float(out_of_rank)
+    # 直近の順位が上位ほど変動の影響が大きいので重みをつける
+    priority = volatility + (out_of_rank - values[0]) / out_of_rank
+    if all(rank is None for rank in ranks):
+        return max_pages, priority, "not ranked"
+    pages = min(max_pages, max(1, math.ceil((max(values) + DEPTH_MARGIN) / PAGE_SIZE)))
+    return pages, priority, "volatile"
+
+
+def plan(session: scoped_session, keyword_sets: list[dict], budget: int, max_ranking: int, history: int = 10) -> list[dict]:
+    """検索計画作成処理
+
+    1日のAPI呼び出し回数の予算の範囲で、キーワードセットごとに取得するページ数と検索する順番を決める。
+    過去の検索で自ページが1ページ目で安定しているキーワードセットは1ページだけ、
+    順位の変動が大きいキーワードセットは過去の最低順位まで調べるようにし、変動の大きい順に検索する。
+
+    予算はまず優先度の高い順にすべてのキーワードセットへ1ページずつ割り当て、
+    残りを優先度の高い順に必要なページ数まで割り当てる。1ページも割り当てられないキーワードセットは計画から外す。
+
+    Parameters
+    ----------
+    session : scoped_session
+        データベース接続のセッション
+    keyword_sets : list[dict]
+        read_keyword_setsで読み込んだキーワードセットのリスト
+    budget : int
+        使えるAPI呼び出し回数(ページ数)
+    max_ranking : int
+        何位までランキングを検索するか(キーワードセットにmax_rankingがない場合に使う)
+    history : int
+        参照する過去の検索回数
+
+    Returns
+    -------
+    planned : list[dict]
+        検索する順に並んだキーワードセットのリスト。
+        元のキーワードセットの項目に加えて、割り当てたページ数に合わせたmax_ranking、pages、priority、reasonを持つ。
+        予算が足りず外したキーワードセットはpagesが0で末尾に並ぶ
+    """
+    keywords_list = ["\t".join(keyword_set["keywords"]) for keyword_set in keyword_sets]
+    search_m_dic = {}
+    for i in range(0, len(keywords_list), 500):
+        for raw in session.query(TSearchM.id, TSearchM.keywords).filter(TSearchM.keywords.in_(keywords_list[i:i + 500])):
+            search_m_dic[raw.keywords] = raw.id
+    history_dic = __select_history(session, list(search_m_dic.values()), history)
+
+    candidates = []
+    for keyword_set, keywords in zip(keyword_sets, keywords_list):
+        set_max_ranking = keyword_set.get("max_ranking")
+        set_max_ranking = max_ranking if set_max_ranking is None else int(set_max_ranking)
+        max_pages = max(1, math.ceil(min(set_max_ranking, 100) / PAGE_SIZE))
+        ranks = history_dic.get(search_m_dic.get(keywords), [])
+        pages, priority, reason = __evaluate(ranks, max_pages)
+        candidates.append({"keyword_set": keyword_set, "want": pages, "priority": priority, "reason": reason, "pages": 0, "max_ranking": set_max_ranking})
+
+    # 優先度の高い順(同じ優先度ならファイルの順)
+    candidates.sort(key=lambda candidate: -candidate["priority"])
+
+    remaining = budget
+    for candidate in candidates:
+        if remaining <= 0:
+            break
+        candidate["pages"] = 1
+        remaining = remaining - 1
+    for candidate in candidates:
+        if remaining <= 0:
+            break
+        if candidate["pages"] == 0:
+            continue
+        extra = min(candidate["want"] - candidate["pages"], remaining)
+        candidate["pages"] = candidate["pages"] + extra
+        remaining = remaining - extra
+
+    planned = []
+    skipped = []
+    for candidate in candidates:
+        keyword_set = dict(candidate["keyword_set"])
+        keyword_set["pages"] = candidate["pages"]
+        keyword_set["priority"] = candidate["priority"]
+        keyword_set["reason"] = candidate["reason"]
+        keyword_set["max_ranking"] = min(candidate["max_ranking"], candidate["pages"] * PAGE_SIZE)
+        if candidate["pages"] > 0:
+            planned.append(keyword_set)
+        else:
+            skipped.append(keyword_set)
+    return planned + skipped
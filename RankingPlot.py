@@ -5,12 +5,64 @@ import sys
 import pprint
 import traceback
 import sqlalchemy
+from sqlalchemy import select, func
 from sqlalchemy.orm import scoped_session, sessionmaker
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
 from RankingModels import Base, TSearchM, TSearch, TRanking, TDoc
-from datetime import datetime
+from RankingMatrix import load_matrices, iter_matrices
+from RankingPlotManifest import PlotManifest, MANIFEST_FILENAME
+from RankingDashboard import write_dashboard, DASHBOARD_DIRNAME
+from RankingDownsample import downsample, BUCKETS, AGGREGATES
+from datetime import datetime, timedelta
 
-def selectRanking(dbfile:str, keywords:list[str]):
+# localのときに出力先に書き出すplotly.jsのファイル名
+PLOTLYJS_FILENAME = "plotly.min.js"
+# 1プロセスあたりに先読みするグラフ数(メモリ上にたまるグラフのデータの上限)
+PREFETCH_PER_PROCESS = 4
+# 差分作成のときに1回の問い合わせで絞り込む検索マスタIDの数(SQLiteのバインド変数の上限に引っかからないように分割する)
+INCREMENTAL_CHUNK_SIZE = 500
+
+def __range_filter(query, since:datetime, until:datetime):
+    """期間が指定されている場合は検索日時で絞り込む(sinceは含み、untilは含まない)"""
+    if since is not None:
+        query = query.filter(TSearch.search_datetime >= since)
+    if until is not None:
+        query = query.filter(TSearch.search_datetime < until)
+    return query
+
+def iterRanking(dbfile:str, keywords:list[str], yield_per:int = 1000, search_m_ids:list[int] = None,
+                since:datetime = None, until:datetime = None):
+    """ランキング列挙処理
+
+    キーワードセットごとのグラフのデータを1つずつ返す。
+    日付軸とランキングはどちらもキーワード順に並べてyield_per行ずつ読み込み、
+    2つの結果を同時に読み進めるため、一度に持つのは1つのキーワードセット分だけになる。
+
+    Parameters
+    ----------
+    dbfile : str
+        データベースファイル名
+    keywords : list[str]
+        対象のキーワード。空のときはすべてのキーワードセット
+    yield_per : int
+        1回に読み込む行数
+    search_m_ids : list[int]
+        対象の検索マスタID。Noneのときは絞り込まない
+    since : datetime
+        この日時以降の検索だけを読み込む。Noneのときは絞り込まない
+    until : datetime
+        この日時より前の検索だけを読み込む。Noneのときは絞り込まない
+
+    Yields
+    ------
+    graph_keyword : str
+        グラフの名前([検索マスタID]キーワード)
+    keyword_dic : dict
+        日付、サイト(表示名をキーとした順位のリスト)、調査深さを持つディクショナリ
+    """
 
     connect_string = "sqlite:///" + dbfile
     engine = sqlalchemy.create_engine(connect_string, echo=False) # SQLとデータを出力したい場合はecho=Trueにする
@@ -26,14 +78,39 @@ def selectRanking(dbfile:str, keywords:list[str]):
 
         Base.metadata.create_all(engine)
 
+        searchKeywords = "\t".join(keywords)
+
+        # 検索マスタごとの日付軸をランキングと同じキーワード順で取得する
+        dates = session.query(
+            TSearch.id
+            ,TSearch.search_m_id
+            ,TSearch.search_datetime
+            ,TSearch.search_depth
+        ).join(
+            TSearchM,TSearchM.id == TSearch.search_m_id
+        )
+        if len(keywords) > 0:
+            dates = dates.filter(
+                TSearchM.keywords == searchKeywords
+            )
+        if search_m_ids is not None:
+            dates = dates.filter(
+                TSearchM.id.in_(search_m_ids)
+            )
+        dates = __range_filter(dates, since, until)
+        dates = dates.order_by(
+            TSearchM.keywords
+            ,TSearch.search_datetime.desc()
+        ).yield_per(yield_per)
+
         # ランキングに出でくるサイトを全部洗い出し最新ランキングの高い順に並び替えた上でdictionaryにセット
         # この段階では
         result = session.query(
             TSearchM.keywords
             ,TSearch.search_m_id
+            ,TSearch.id.label("search_id")
             ,TDoc.id
             ,TDoc.title
-            ,TSearch.search_datetime
             ,TRanking.ranking
         ).join(
             TSearch,TSearchM.id == TSearch.search_m_id
@@ -43,56 +120,70 @@ def selectRanking(dbfile:str, keywords:list[str]):
             TDoc,TRanking.doc_id == TDoc.id
         )
         if len(keywords) > 0:
-            searchKeywords = "\t".join(keywords)
             result = result.filter(
                 TSearchM.keywords == searchKeywords
             )
+        if search_m_ids is not None:
+            result = result.filter(
+                TSearchM.id.in_(search_m_ids)
+            )
+        result = __range_filter(result, since, until)
 
         result = result.order_by(
             TSearchM.keywords
             ,TSearch.search_datetime.desc()
             ,TRanking.ranking
             ,TDoc.title
-        ).all()
+        ).yield_per(yield_per)
 
-        graph_dic={}
+        date_rows = iter(dates)
+        date_raw = next(date_rows, None)
+        graph_keyword=None
+        keyword_dic=None
+        search_m_id=None
         for raw in result:
-            graph_keyword='['+str(raw.search_m_id)+']'+ raw.keywords
-            if graph_keyword not in graph_dic:
-                # キーワードが存在しない場合。新しいグラフの描画
-                # 日付を取得
-                date_axis=[]
-                result = session.query(
-                    TSearch.search_datetime
-                ).filter(
-                    TSearch.search_m_id == raw.search_m_id
-                ).order_by(
-                    TSearch.search_datetime.desc()
-                ).all()
+            if raw.search_m_id != search_m_id:
+                # キーワードが変わった場合。前のグラフを返して新しいグラフの描画
+                # (キーワード順に並んでいるため同じキーワードの行は連続する)
+                if keyword_dic is not None:
+                    yield graph_keyword, keyword_dic
+                search_m_id = raw.search_m_id
+                graph_keyword='['+str(raw.search_m_id)+']'+ raw.keywords
 
-                for dates in result:
-                    date_axis.append(dates.search_datetime)
+                # ランキングのないキーワードセットの日付軸は読み飛ばす
+                while date_raw is not None and date_raw.search_m_id != search_m_id:
+                    date_raw = next(date_rows, None)
+                # 検索IDから日付軸の位置を引けるようにしておく
+                date_axis=[]
+                depth_axis=[]
+                position_dic={}
+                while date_raw is not None and date_raw.search_m_id == search_m_id:
+                    position_dic[date_raw.id] = len(date_axis)
+                    date_axis.append(date_raw.search_datetime)
+                    depth_axis.append(date_raw.search_depth)
+                    date_raw = next(date_rows, None)
 
                 site_dic={}
                 keyword_dic={
                     "日付": date_axis
                     ,"サイト": site_dic
+                    ,"調査深さ": depth_axis
                 }
 
-                graph_dic[graph_keyword]=keyword_dic
-
             title = '[' + str(raw.id) + ']' + raw.title
-            
-            if title not in site_dic:
+
+            ranking_updown = site_dic.get(title)
+            if ranking_updown is None:
                 # ここでランキング順位をすべてNoneでリセットしておく
                 # python 3.7以降はdictが順序を保持するようになったためシンプルに突っ込む
                 ranking_updown = [None] * len(date_axis)
                 site_dic[title] = ranking_updown
 
-            # 順位を取得
-            ranking_updown = site_dic[title]
             # 日付と同じインデックス(順番の配列)に順位を入れる
-            ranking_updown[date_axis.index(raw.search_datetime)] = raw.ranking
+            ranking_updown[position_dic[raw.search_id]] = raw.ranking
+
+        if keyword_dic is not None:
+            yield graph_keyword, keyword_dic
 
     except Exception:
         raise
@@ -100,63 +191,319 @@ def selectRanking(dbfile:str, keywords:list[str]):
         session.close()
     finally:
         engine.dispose()
-    return graph_dic
-
-def plot_datas(plotdatas:dict, output_base_dir:str = '.'):
-    dttime = datetime.now()
-    output_dir = os.path.join(output_base_dir,dttime.strftime('%Y-%m-%d'),"Plot")
-    for keyword, datas in plotdatas.items():
-        fig = go.Figure()
-        for key, data in datas.items():
-            if key == "日付":
-                xvalues = data
-            elif key == "サイト":
-                site_dic = data
-
-        for site, rank in site_dic.items():
-            fig.add_trace(go.Scatter(
-                x=xvalues,
-                y=rank,
-                name=site
-            ))
-        fig.update_yaxes(autorange='reversed',dtick=5)
-        fig.update_xaxes(tickformat="%Y-%m-%d",dtick='1 Day')
-        fig.update_layout(title=keyword,xaxis_title="日付",yaxis_title="順位")
-        filename=keyword.replace("\t","_") + ".html"
-
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        with open(output_dir + os.sep + filename,"w") as f:
-            f.write(fig.to_html(full_html=True, include_plotlyjs='cdn'))
+
+def selectRanking(dbfile:str, keywords:list[str], since:datetime = None, until:datetime = None):
+    return dict(iterRanking(dbfile, keywords, since=since, until=until))
+
+def selectLatestSearches(dbfile:str, keywords:list[str]) -> dict:
+    """キーワードセットごとの最新の検索取得処理
+
+    Returns
+    -------
+    latest : dict
+        グラフの名前([検索マスタID]キーワード)をキーとし、
+        search_m_id(検索マスタID)、last_search_id(最新の検索ID)、search_datetime(最新の検索日時)を持つディクショナリ
+    """
+    engine = sqlalchemy.create_engine("sqlite:///" + dbfile, echo=False)
+    try:
+        with engine.connect() as conn:
+            stmt = select(
+                TSearchM.id
+                ,TSearchM.keywords
+                ,func.max(TSearch.id).label("last_search_id")
+                ,func.max(TSearch.search_datetime).label("search_datetime")
+            ).join(
+                TSearch,TSearchM.id == TSearch.search_m_id
+            )
+            if len(keywords) > 0:
+                stmt = stmt.where(TSearchM.keywords == "\t".join(keywords))
+            stmt = stmt.group_by(TSearchM.id, TSearchM.keywords)
+            latest = {}
+            for raw in conn.execute(stmt):
+                latest['['+str(raw.id)+']'+ raw.keywords] = {
+                    "search_m_id": raw.id
+                    ,"last_search_id": raw.last_search_id
+                    ,"search_datetime": raw.search_datetime
+                }
+    finally:
+        engine.dispose()
+    return latest
+
+def __has_depth(depth) -> bool:
+    """調査深さが1つでも記録されているか(リストのNoneとRankingMatrixのNaNはどちらも記録なし)"""
+    return any(d is not None and d == d for d in depth)
+
+def render_chart(keyword:str, datas:dict, output_dir:str, plotlyjs='cdn') -> str:
+    """グラフ1つ分のhtml出力処理
+
+    プロセスプールからも呼び出せるように、1つのキーワードセットのグラフの作成から書き出しまでをおこなう。
+
+    Parameters
+    ----------
+    keyword : str
+        グラフの名前([検索マスタID]キーワード)
+    datas : dict
+        日付、サイト、調査深さを持つディクショナリ。
+        サイト日付(サイトごとの日付)、調査深さ日付がある場合は線ごとにその日付を使う(RankingDownsample.lttb_datas)
+    output_dir : str
+        出力先フォルダ
+    plotlyjs : str or bool
+        fig.to_htmlのinclude_plotlyjsに渡す値
+
+    Returns
+    -------
+    output_file : str
+        出力したhtmlファイル名
+    """
+    fig = go.Figure()
+    depth = []
+    site_dates = {}
+    depth_dates = None
+    for key, data in datas.items():
+        if key == "日付":
+            xvalues = data
+        elif key == "サイト":
+            site_dic = data
+        elif key == "調査深さ":
+            depth = data
+        elif key == "サイト日付":
+            site_dates = data
+        elif key == "調査深さ日付":
+            depth_dates = data
+
+    for site, rank in site_dic.items():
+        fig.add_trace(go.Scatter(
+            x=site_dates.get(site, xvalues),
+            y=rank,
+            name=site
+        ))
+    if __has_depth(depth):
+        # 調査深さより深い順位は調べていないため、線が途切れていても「ランク外」とは限らない
+        fig.add_trace(go.Scatter(
+            x=xvalues if depth_dates is None else depth_dates,
+            y=depth,
+            name="調査深さ",
+            mode="lines",
+            line=dict(color="gray", dash="dot")
+        ))
+    fig.update_yaxes(autorange='reversed',dtick=5)
+    fig.update_xaxes(tickformat="%Y-%m-%d",dtick='1 Day')
+    fig.update_layout(title=keyword,xaxis_title="日付",yaxis_title="順位")
+    filename=keyword.replace("\t","_") + ".html"
+
+    output_file = output_dir + os.sep + filename
+    with open(output_file,"w") as f:
+        f.write(fig.to_html(full_html=True, include_plotlyjs=plotlyjs))
+    return output_file
+
+def __include_plotlyjs(output_dir:str, plotlyjs:str):
+    """plotlyjsオプションの値をfig.to_htmlのinclude_plotlyjsの値にする
+
+    localのときは出力先フォルダにplotly.min.jsを1つだけ書き出し、各htmlからはそれを参照する。
+    """
+    if plotlyjs == 'cdn':
+        return 'cdn'
+    elif plotlyjs == 'inline':
+        return True
+    elif plotlyjs == 'local':
+        bundle = os.path.join(output_dir, PLOTLYJS_FILENAME)
+        if not os.path.exists(bundle):
+            with open(bundle, "w", encoding="utf-8") as f:
+                f.write(get_plotlyjs())
+        return PLOTLYJS_FILENAME
+    raise ValueError("plotlyjsにはcdn、local、inlineのいずれかを指定してください")
+
+def plot_output_dir(output_base_dir:str = '.', dated:bool = True) -> str:
+    """グラフの出力先フォルダ(output_base_dirの下の日付/Plot。datedがFalseのときは日付を付けないPlot)
+
+    ダッシュボードや前回の出力を引き継ぐincrementalの出力は、日付が変わっても同じ場所を使うため日付を付けない。
+    """
+    if not dated:
+        return os.path.join(output_base_dir,"Plot")
+    return os.path.join(output_base_dir,datetime.now().strftime('%Y-%m-%d'),"Plot")
+
+def plot_datas(plotdatas, output_base_dir:str = '.', processes:int = None, plotlyjs:str = 'cdn', manifest:PlotManifest = None, dated:bool = True):
+    """グラフ出力処理
+
+    plotdatasにはselectRankingのディクショナリか、iterRankingのように(グラフの名前, データ)を返すイテレータを渡す。
+    イテレータの場合は1つずつ受け取ってhtmlを書き出すため、グラフ1つ分のメモリしか使わない。
+
+    Parameters
+    ----------
+    plotdatas : dict or iterator
+        グラフの名前をキーとしたグラフのデータ
+    output_base_dir : str
+        出力先のフォルダ(この下の日付/PlotかPlotに出力する)
+    processes : int
+        グラフを作成するプロセス数。Noneか1のときはこのプロセスで順に作成する
+    plotlyjs : str
+        plotly.jsの読み込み方法。cdn(CDNを参照)、local(出力先のplotly.min.jsを参照)、inline(htmlごとに埋め込む)
+    manifest : PlotManifest
+        指定した場合は出力したグラフを記録する
+    dated : bool
+        Falseのときは日付/PlotではなくPlotに出力する
+    """
+    output_dir = plot_output_dir(output_base_dir, dated)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    include_plotlyjs = __include_plotlyjs(output_dir, plotlyjs)
+
+    if isinstance(plotdatas, dict):
+        plotdatas = plotdatas.items()
+
+    if processes is None or processes <= 1:
+        for keyword, datas in plotdatas:
+            output_file = render_chart(keyword, datas, output_dir, include_plotlyjs)
+            if manifest is not None:
+                manifest.done(keyword, output_file)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # 先読みの上限までしか投入しないため、イテレータを渡した場合もメモリ使用量は増えない
+        window = processes * PREFETCH_PER_PROCESS
+        pending = deque()
+
+        def wait_first():
+            keyword, future = pending.popleft()
+            output_file = future.result()
+            if manifest is not None:
+                manifest.done(keyword, output_file)
+
+        for keyword, datas in plotdatas:
+            pending.append((keyword, executor.submit(render_chart, keyword, datas, output_dir, include_plotlyjs)))
+            if len(pending) >= window:
+                wait_first()
+        while len(pending) > 0:
+            wait_first()
 
 def main(argv: list[str]):
 
     skip = False
     dbfile="ranking.sqlite3"
     keywords = []
+    pandas_flg = False
+    stream_flg = False
+    processes = None
+    plotlyjs = 'cdn'
+    incremental_flg = False
+    dashboard_flg = False
+    since = None
+    until = None
+    days = None
+    bucket = None
+    aggregate = "median"
+    lttb = None
     try:
         for i,arg in enumerate(argv):
             if skip == False and i > 0:
                 if arg == '-db':
                     dbfile = argv[i+1]
                     skip = True
+                elif arg == '--pandas':
+                    pandas_flg = True
+                elif arg == '--stream':
+                    stream_flg = True
+                elif arg == '--incremental':
+                    incremental_flg = True
+                elif arg == '--dashboard':
+                    dashboard_flg = True
+                elif arg == '--since':
+                    since = datetime.strptime(argv[i+1], '%Y-%m-%d')
+                    days = None
+                    skip = True
+                elif arg == '--until':
+                    # 指定した日の終わりまでを含める
+                    until = datetime.strptime(argv[i+1], '%Y-%m-%d') + timedelta(days=1)
+                    skip = True
+                elif arg == '--days':
+                    days = int(argv[i+1])
+                    if days <= 0:
+                        raise ValueError("daysオプションの値は正の整数を指定してください")
+                    since = datetime.now() - timedelta(days=days)
+                    skip = True
+                elif arg == '--bucket':
+                    bucket = argv[i+1]
+                    if bucket not in BUCKETS:
+                        raise ValueError("bucketオプションにはhour、day、weekのいずれかを指定してください")
+                    skip = True
+                elif arg == '--agg':
+                    aggregate = argv[i+1]
+                    if aggregate not in AGGREGATES:
+                        raise ValueError("aggオプションにはmin、median、maxのいずれかを指定してください")
+                    skip = True
+                elif arg == '--lttb':
+                    lttb = int(argv[i+1])
+                    if lttb < 3:
+                        raise ValueError("lttbオプションの値は3以上の整数を指定してください")
+                    skip = True
+                elif arg == '-p':
+                    processes = int(argv[i+1])
+                    if processes <= 0:
+                        raise ValueError("pオプションの値は正の整数を指定してください")
+                    skip = True
+                elif arg == '--plotlyjs':
+                    plotlyjs = argv[i+1]
+                    if plotlyjs not in ('cdn', 'local', 'inline'):
+                        raise ValueError("plotlyjsオプションにはcdn、local、inlineのいずれかを指定してください")
+                    skip = True
                 else:
                     keywords.append(arg)
             else:
                 skip = False
 
-        graph_dic=selectRanking(dbfile, keywords)
-        plot_datas(graph_dic)
-
-    except IndexError as e:
+    except (IndexError, ValueError) as e:
         (exc_type, exc_value, exc_traceback) = sys.exc_info()
         t = traceback.format_exception(exc_type, exc_value, exc_traceback)
         t.insert(0,"[ERROR]:引数の形がちがいます")
-        t.insert(1,"py RankingPlot.py [-db DBファイル名] [キーワード1] [キーワード2] [キーワード3] …")
+        t.insert(1,"py RankingPlot.py [-db DBファイル名] [--pandas] [--stream] [-p プロセス数] [--plotlyjs cdn|local|inline] [--incremental] [--dashboard] [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--days 日数] [--bucket hour|day|week] [--agg min|median|max] [--lttb 点数] [キーワード1] [キーワード2] [キーワード3] …")
         pprint.pprint(t, width=120,stream=sys.stderr)
         sys.exit(1)
 
+    # ダッシュボードは既存の一覧に追加していくため、日付ごとのフォルダではなく常に同じフォルダに出力する
+    dashboard_dir = os.path.join(plot_output_dir(dated=False), DASHBOARD_DIRNAME)
+
+    def render(graph_dic, manifest=None):
+        if bucket is not None or lttb is not None:
+            # 点が多すぎるとhtmlの作成もブラウザでの表示も遅くなるため間引く
+            graph_dic = downsample(graph_dic, bucket, aggregate, lttb)
+        if dashboard_flg:
+            # 1つのhtmlとキーワードセットごとのデータファイルを出力する
+            write_dashboard(graph_dic, dashboard_dir, plotlyjs, manifest)
+        else:
+            # incrementalでは前回のグラフを引き継ぐため、日付を付けないフォルダに出力する
+            plot_datas(graph_dic, processes=processes, plotlyjs=plotlyjs, manifest=manifest, dated=manifest is None)
+
+    if incremental_flg:
+        # 前回から新しい検索があるキーワードセットだけを読み込んでグラフを作り直す
+        # 期間や間引きの指定が前回と違う場合はすべて作り直す
+        # daysオプションから求めたsinceは実行するたびに変わるため、日数のほうを作成条件として記録する
+        options = {"since": str(since) if days is None else None, "days": days, "until": str(until), "bucket": bucket, "agg": aggregate, "lttb": lttb}
+        manifest = PlotManifest(os.path.join(dashboard_dir if dashboard_flg else plot_output_dir(dated=False), MANIFEST_FILENAME), plotlyjs, options)
+        search_m_ids = manifest.plan(selectLatestSearches(dbfile, keywords))
+        chunks = [search_m_ids[i:i + INCREMENTAL_CHUNK_SIZE] for i in range(0, len(search_m_ids), INCREMENTAL_CHUNK_SIZE)]
+        if pandas_flg:
+            graph_dic=((matrix.name, matrix.to_plot_data()) for chunk in chunks for matrix in iter_matrices(dbfile, keywords, search_m_ids=chunk, since=since, until=until))
+        else:
+            graph_dic=(graph for chunk in chunks for graph in iterRanking(dbfile, keywords, search_m_ids=chunk, since=since, until=until))
+        try:
+            render(graph_dic, manifest)
+        finally:
+            # 途中で失敗しても出力済みのグラフは記録しておく
+            manifest.save()
+        return
+
+    if stream_flg and pandas_flg:
+        # キーワードセットごとに行列を作ってはグラフを書き出す
+        graph_dic=((matrix.name, matrix.to_plot_data()) for matrix in iter_matrices(dbfile, keywords, since=since, until=until))
+    elif stream_flg:
+        graph_dic=iterRanking(dbfile, keywords, since=since, until=until)
+    elif pandas_flg:
+        # サイト×日付の順位をNumPyの行列で持つ(ランク外はNaN)
+        graph_dic={name: matrix.to_plot_data() for name, matrix in load_matrices(dbfile, keywords, since=since, until=until).items()}
+    else:
+        graph_dic=selectRanking(dbfile, keywords, since, until)
+    render(graph_dic)
+
 if __name__ == '__main__':
     try:
         main(sys.argv)
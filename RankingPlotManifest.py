@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import RankingCodec
+
+# グラフの出力先フォルダに作成するマニフェストのファイル名
+MANIFEST_FILENAME = "plot-manifest.json"
+
+
+def file_hash(path: str) -> str:
+    """ファイルのSHA-256(16進数)。ファイルがない場合はNone"""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class PlotManifest:
+    """グラフのマニフェスト
+
+    キーワードセットごとに、最後にグラフにした検索(検索ID、検索日時)と出力したhtmlファイルのハッシュを記録する。
+    前回から新しい検索がないキーワードセットはグラフを作り直さずに済むようにする。
+
+    出力したhtmlが消されたり書き換えられたりした場合(ハッシュが一致しない場合)は作り直す対象にする。
+    plotly.jsの読み込み方法やグラフの作成条件(期間、間引き方など)が前回と違う場合はすべてのグラフを作り直す対象にする。
+
+    Attributes
+    ----------
+    path : str
+        マニフェストのファイル名
+    plotlyjs : str
+        plotly.jsの読み込み方法(RankingPlot.plot_datasのplotlyjs)
+    options : dict
+        グラフの作成条件
+    """
+
+    def __init__(self, path: str, plotlyjs: str = 'cdn', options: dict = None):
+        """
+        Parameters
+        ----------
+        path : str
+            マニフェストのファイル名
+        plotlyjs : str
+            今回のplotly.jsの読み込み方法
+        options : dict
+            今回のグラフの作成条件(jsonにできる値のみ)
+        """
+        self.path = path
+        self.plotlyjs = plotlyjs
+        self.options = options if options is not None else {}
+        self.__charts = {}
+        self.__planned = {}
+        self.__load()
+
+    def __load(self):
+        """既存のマニフェストを読み込む(ないか壊れている場合は空のまま)"""
+        try:
+            with open(self.path, 'rb') as f:
+                manifest = RankingCodec.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return
+        if manifest.get("plotlyjs") != self.plotlyjs or manifest.get("options", {}) != self.options:
+            return
+        self.__charts = manifest.get("charts", {})
+
+    def plan(self, latest: dict) -> list[int]:
+        """作り直し対象の抽出処理
+
+        Parameters
+        ----------
+        latest : dict
+            グラフの名前([検索マスタID]キーワード)をキーとし、
+            search_m_id(検索マスタID)、last_search_id(最新の検索ID)、search_datetime(最新の検索日時)を持つディクショナリ
+
+        Returns
+        -------
+        search_m_ids : list[int]
+            グラフを作り直すキーワードセットの検索マスタID
+        """
+        output_dir = os.path.dirname(self.path)
+        search_m_ids = []
+        for name, search in latest.items():
+            chart = self.__charts.get(name)
+            if chart is not None and chart["last_search_id"] >= search["last_search_id"] \
+                    and file_hash(os.path.join(output_dir, chart["file"])) == chart["sha256"]:
+                continue
+            self.__planned[name] = search
+            search_m_ids.append(search["search_m_id"])
+        return search_m_ids
+
+    def done(self, name: str, output_file: str):
+        """グラフの出力を記録する
+
+        Parameters
+        ----------
+        name : str
+            グラフの名前
+        output_file : str
+            出力したhtmlファイル名
+        """
+        search = self.__planned.pop(name, None)
+        if search is None:
+            # planで対象にしていないグラフ(マニフェストを使わずに出力した場合など)
+            return
+        chart = dict(search)
+        chart["search_datetime"] = str(chart["search_datetime"])
+        chart["file"] = os.path.relpath(output_file, os.path.dirname(self.path) or ".")
+        chart["sha256"] = file_hash(output_file)
+        self.__charts[name] = chart
+
+    def save(self):
+        """マニフェストを書き出す(一時ファイルに書いてから置き換える)"""
+        dirname = os.path.dirname(self.path)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(RankingCodec.dumps({"plotlyjs": self.plotlyjs, "options": self.options, "charts": self.__charts}))
+        os.replace(tmp_path, self.path)
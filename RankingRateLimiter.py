@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from datetime import date
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限
+
+    1秒あたりrate個のトークンが補充され、最大capacity個までたまる。
+    APIを呼び出す前にacquireでトークンを1つ取得することで、
+    複数スレッドから呼び出しても全体の呼び出し回数が1秒あたりrate回に制限される。
+
+    Attributes
+    ----------
+    rate : float
+        1秒あたりに補充するトークン数(1秒あたりの最大呼び出し回数)
+    capacity : int
+        たまるトークンの最大数(一度に連続で呼び出せる回数)
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        if rate <= 0:
+            raise ValueError("rateは正の数を指定してください")
+        if capacity <= 0:
+            raise ValueError("capacityは正の整数を指定してください")
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = float(capacity)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        """経過時間に応じてトークンを補充する(ロックを取得した状態で呼ぶこと)"""
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    def acquire(self):
+        """トークン取得処理
+
+        トークンを1つ取得する。トークンがない場合は補充されるまで待つ。
+        """
+        while True:
+            with self.__lock:
+                self.__refill()
+                if self.__tokens >= 1:
+                    self.__tokens = self.__tokens - 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+class DailyQuota:
+    """1日あたりの呼び出し回数の上限
+
+    Custom Search APIの1日あたりのクエリ数の上限を超えないように、
+    呼び出す前に必要な回数をreserveで予約し、使わなかった分をreleaseで返す。
+    日付が変わると使用回数は0に戻る。回数はこのプロセス内でのみ数える。
+
+    Attributes
+    ----------
+    limit : int
+        1日あたりの呼び出し回数の上限
+    """
+
+    def __init__(self, limit: int):
+        if limit <= 0:
+            raise ValueError("limitは正の整数を指定してください")
+        self.limit = limit
+        self.__used = 0
+        self.__day = date.today()
+        self.__lock = threading.Lock()
+
+    def __rollover(self):
+        """日付が変わっていたら使用回数を0に戻す(ロックを取得した状態で呼ぶこと)"""
+        today = date.today()
+        if today != self.__day:
+            self.__day = today
+            self.__used = 0
+
+    def reserve(self, count: int) -> bool:
+        """呼び出し回数予約処理
+
+        Parameters
+        ----------
+        count : int
+            予約する呼び出し回数
+
+        Returns
+        -------
+        True: bool
+            予約できた
+        False: bool
+            上限を超えるため予約できなかった
+        """
+        with self.__lock:
+            self.__rollover()
+            if self.__used + count > self.limit:
+                return False
+            self.__used = self.__used + count
+            return True
+
+    def release(self, count: int):
+        """予約したが使わなかった呼び出し回数を返す"""
+        with self.__lock:
+            self.__rollover()
+            self.__used = max(0, self.__used - count)
+
+    def remaining(self) -> int:
+        """今日の残りの呼び出し回数"""
+        with self.__lock:
+            self.__rollover()
+            return self.limit - self.__used
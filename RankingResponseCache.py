@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import RankingCodec
+
+
+class ResponseCache:
+    """APIレスポンスキャッシュ
+
+    Custom Search APIのcse().listのレスポンスを、呼び出しパラメータ(q, cx, lr, num, start)の
+    ハッシュをファイル名としてディスクに保存する。
+    同じパラメータで有効期限内に呼び出す場合はAPIを呼ばずにキャッシュを返すため、
+    途中で失敗した実行のやり直しや同じキーワードセットの重複でクエリを消費しない。
+
+    キャッシュの合計サイズがmax_bytesを超えた場合は、最後に参照された日時(ファイルの更新日時)の古いものから削除する。
+
+    Attributes
+    ----------
+    cache_dir : str
+        キャッシュを保存するフォルダ
+    ttl : float
+        キャッシュの有効期限(秒)
+    max_bytes : int
+        キャッシュの合計サイズの上限(バイト)
+    hits : int
+        キャッシュにヒットした回数
+    misses : int
+        キャッシュにヒットしなかった回数
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = 86400, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.__total_bytes = sum(size for _, _, size in self.__entries())
+
+    @staticmethod
+    def key(params: dict) -> str:
+        """キャッシュキー取得処理
+
+        Parameters
+        ----------
+        params : dict
+            cse().listの呼び出しパラメータ
+
+        Returns
+        -------
+        key : str
+            パラメータをキー順に並べたjsonのSHA-256
+        """
+        return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def __path(self, key: str) -> str:
+        """キャッシュファイルのパス(1つのフォルダにファイルが集中しないように先頭2文字でフォルダを分ける)"""
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def __entries(self):
+        """キャッシュファイルの(パス, 更新日時, サイズ)を列挙する"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def __remove(self, path: str):
+        """キャッシュファイルを削除する"""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self.__lock:
+            self.__total_bytes = self.__total_bytes - size
+
+    def get(self, params: dict) -> dict:
+        """キャッシュ取得処理
+
+        Parameters
+        ----------
+        params : dict
+            cse().listの呼び出しパラメータ
+
+        Returns
+        -------
+        res : dict
+            キャッシュされたレスポンス。ないか有効期限切れの場合はNone
+        """
+        path = self.__path(self.key(params))
+        try:
+            with open(path, 'rb') as f:
+                cached = RankingCodec.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            with self.__lock:
+                self.misses = self.misses + 1
+            return None
+        if time.time() - cached.get("cached_at", 0) > self.ttl:
+            self.__remove(path)
+            with self.__lock:
+                self.misses = self.misses + 1
+            return None
+        # 最後に参照された日時として更新日時を使う(LRUの追い出し順)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self.__lock:
+            self.hits = self.hits + 1
+        return cached.get("response")
+
+    def put(self, params: dict, res: dict):
+        """キャッシュ登録処理
+
+        一時ファイルに書き込んでから置き換えるため、途中で落ちても壊れたキャッシュは残らない。
+
+        Parameters
+        ----------
+        params : dict
+            cse().listの呼び出しパラメータ
+        res : dict
+            APIのレスポンス
+        """
+        path = self.__path(self.key(params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = RankingCodec.dumps({"cached_at": time.time(), "params": params, "response": res})
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.__lock:
+            self.__total_bytes = self.__total_bytes + len(data) - old_size
+            over = self.__total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """キャッシュ追い出し処理
+
+        合計サイズが上限の9割以下になるまで、最後に参照された日時の古いキャッシュから削除する。
+        """
+        target = self.max_bytes * 0.9
+        for path, _, _ in sorted(self.__entries(), key=lambda entry: entry[1]):
+            with self.__lock:
+                if self.__total_bytes <= target:
+                    return
+            self.__remove(path)
+
+    def stats(self) -> dict:
+        """統計情報取得処理
+
+        Returns
+        -------
+        stats : dict
+            hits, misses, hit_rate, bytes, max_bytesを持つディクショナリ
+        """
+        with self.__lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "bytes": self.__total_bytes,
+                "max_bytes": self.max_bytes,
+            }
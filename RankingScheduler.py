@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import queue
+import threading
+import time
+import traceback
+
+
+class JobSkipped(Exception):
+    """ジョブを実行しなかったことを表す例外(1日のクエリ数の上限に達した場合など)"""
+    pass
+
+
+# キューの終端を表す値
+_END = object()
+
+
+class SearchScheduler:
+    """並行検索スケジューラ
+
+    複数の検索ジョブを上限つきのワーカースレッドで並行して取得し、
+    取得結果は1つの書き込みスレッドだけがデータベースに登録する。
+    SQLiteに複数のスレッドから同時に書き込まないようにするため、書き込みは必ず直列になる。
+
+    ジョブのキューと書き込み待ちのキューはどちらも上限つきのため、
+    取得が書き込みより速くてもメモリ上にたまる結果の数は一定に抑えられる。
+
+    Attributes
+    ----------
+    workers : int
+        取得をおこなうワーカースレッド数
+    queue_size : int
+        ジョブのキューと書き込み待ちのキューの上限
+    """
+
+    def __init__(self, fetch_func, write_func, workers: int = 4, queue_size: int = None, report_func = None):
+        """
+        Parameters
+        ----------
+        fetch_func : Callable[[Any], Any]
+            ジョブを受け取り取得結果を返す関数。ワーカースレッドから並行して呼ばれる。
+            JobSkippedを送出するとそのジョブはスキップ扱いになる
+        write_func : Callable[[Any, Any], Any]
+            ジョブと取得結果を受け取り登録結果を返す関数。書き込みスレッドから1つずつ呼ばれる
+        workers : int
+            取得をおこなうワーカースレッド数
+        queue_size : int
+            キューの上限。Noneのときはworkersの2倍
+        report_func : Callable[[dict], None]
+            ジョブごとの結果(job, result, error, skipped)を受け取る関数。書き込みスレッドから呼ばれる。
+            送出した例外は標準エラーに出力し、残りのジョブはそのまま続ける
+        """
+        self.fetch_func = fetch_func
+        self.write_func = write_func
+        self.workers = workers
+        self.queue_size = queue_size if queue_size is not None else workers * 2
+        self.report_func = report_func
+        self.__job_queue = queue.Queue(maxsize=self.queue_size)
+        self.__write_queue = queue.Queue(maxsize=self.queue_size)
+        self.__lock = threading.Lock()
+        self.__counts = {"submitted": 0, "fetching": 0, "fetched": 0, "written": 0, "failed": 0, "skipped": 0}
+        self.__results = []
+        self.__started = None
+
+    def __count(self, name: str, value: int = 1):
+        with self.__lock:
+            self.__counts[name] = self.__counts[name] + value
+
+    def __worker(self):
+        """ワーカースレッドの処理"""
+        while True:
+            item = self.__job_queue.get()
+            if item is _END:
+                return
+            index, job = item
+            self.__count("fetching")
+            try:
+                fetched = self.fetch_func(job)
+                self.__write_queue.put((index, job, fetched, None))
+            except Exception as e:
+                self.__write_queue.put((index, job, None, e))
+            finally:
+                self.__count("fetching", -1)
+                self.__count("fetched")
+
+    def __writer(self):
+        """書き込みスレッドの処理"""
+        while True:
+            item = self.__write_queue.get()
+            if item is _END:
+                return
+            index, job, fetched, error = item
+            result = None
+            if error is None:
+                try:
+                    result = self.write_func(job, fetched)
+                except Exception as e:
+                    error = e
+            skipped = isinstance(error, JobSkipped)
+            if skipped:
+                self.__count("skipped")
+            elif error is not None:
+                self.__count("failed")
+            else:
+                self.__count("written")
+            job_result = {"job": job, "result": result, "error": error, "skipped": skipped}
+            with self.__lock:
+                self.__results.append((index, job_result))
+            if self.report_func is not None:
+                try:
+                    self.report_func(job_result)
+                except Exception:
+                    # 書き込みスレッドが止まるとワーカーが書き込み待ちのキューで待ち続けるため、出力の失敗は表示だけして続ける
+                    traceback.print_exc(file=sys.stderr)
+
+    def __reporter(self, interval: float, stream, stop: threading.Event):
+        """進捗を一定間隔で出力するスレッドの処理"""
+        while not stop.wait(interval):
+            stream.write(self.format_progress() + "\n")
+            stream.flush()
+
+    def progress(self) -> dict:
+        """進捗取得処理
+
+        Returns
+        -------
+        progress : dict
+            投入済み(submitted)、取得中(fetching)、取得済み(fetched)、登録済み(written)、
+            失敗(failed)、スキップ(skipped)のジョブ数と、ジョブのキューの長さ(job_queue)、
+            書き込み待ちのキューの長さ(write_queue)、経過秒数(elapsed)を持つディクショナリ
+        """
+        with self.__lock:
+            ret = dict(self.__counts)
+        ret["job_queue"] = self.__job_queue.qsize()
+        ret["write_queue"] = self.__write_queue.qsize()
+        ret["elapsed"] = 0.0 if self.__started is None else time.monotonic() - self.__started
+        return ret
+
+    def format_progress(self) -> str:
+        """進捗を1行の文字列にする"""
+        p = self.progress()
+        return "[PROGRESS] {elapsed:.0f}s submitted={submitted} fetching={fetching} written={written} failed={failed} skipped={skipped} job_queue={job_queue} write_queue={write_queue}".format(**p)
+
+    def run(self, jobs, progress_interval: float = 0, progress_stream = sys.stderr) -> list[dict]:
+        """実行処理
+
+        すべてのジョブを実行し、終わるまで待つ。
+
+        Parameters
+        ----------
+        jobs : Iterable
+            ジョブのリスト(fetch_funcとwrite_funcに渡される)
+        progress_interval : float
+            0より大きいとき、その秒数ごとに進捗をprogress_streamに出力する
+        progress_stream : TextIO
+            進捗の出力先
+
+        Returns
+        -------
+        results : list[dict]
+            ジョブを投入した順に並んだ、job, result, error, skippedを持つディクショナリのリスト
+        """
+        self.__started = time.monotonic()
+        workers = [threading.Thread(target=self.__worker, daemon=True) for _ in range(self.workers)]
+        writer = threading.Thread(target=self.__writer, daemon=True)
+        for worker in workers:
+            worker.start()
+        writer.start()
+
+        stop = threading.Event()
+        reporter = None
+        if progress_interval > 0:
+            reporter = threading.Thread(target=self.__reporter, args=(progress_interval, progress_stream, stop), daemon=True)
+            reporter.start()
+
+        try:
+            for index, job in enumerate(jobs):
+                # キューが一杯のときはワーカーが取り出すまで待つ
+                self.__job_queue.put((index, job))
+                self.__count("submitted")
+        finally:
+            for _ in workers:
+                self.__job_queue.put(_END)
+            for worker in workers:
+                worker.join()
+            self.__write_queue.put(_END)
+            writer.join()
+            stop.set()
+            if reporter is not None:
+                reporter.join()
+
+        with self.__lock:
+            results = sorted(self.__results, key=lambda item: item[0])
+        return [job_result for _, job_result in results]
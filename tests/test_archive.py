@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import RankingArchive
+
+
+def append_records(path: str, count: int) -> list[str]:
+    return [RankingArchive.append(path, {"keywords": "k{}".format(i % 2), "n": i}, "k{}".format(i % 2)) for i in range(count)]
+
+
+def test_locators_point_at_byte_ranges(tmp_path):
+    path = RankingArchive.archive_path(str(tmp_path), "2024-01-01")
+    locators = append_records(path, 5)
+
+    offset = 0
+    for i, value in enumerate(locators):
+        parsed_path, parsed_offset, length = RankingArchive.parse_locator(value)
+        assert parsed_path == path
+        # メンバーは隙間なく追記される
+        assert parsed_offset == offset
+        offset = offset + length
+        assert RankingArchive.exists(value)
+        assert RankingArchive.read(value)["n"] == i
+    assert os.path.getsize(path) == offset
+    assert [record["n"] for record in RankingArchive.iter_records(path)] == list(range(5))
+    assert list(RankingArchive.iter_locators(path)) == locators
+    assert RankingArchive.find(path, "k1") == [locators[1], locators[3]]
+    assert RankingArchive.parse_locator("other.json") is None
+
+
+def test_rebuild_index_matches_appended_index(tmp_path):
+    path = RankingArchive.archive_path(str(tmp_path), "2024-01-01")
+    locators = append_records(path, 4)
+    index_path = path + RankingArchive.INDEX_SUFFIX
+    with open(index_path, 'rb') as f:
+        expected = f.read()
+
+    os.remove(index_path)
+    # 索引がない場合もアーカイブを展開して位置を求める
+    assert list(RankingArchive.iter_locators(path)) == locators
+    assert RankingArchive.rebuild_index(path, lambda record: record["keywords"]) == 4
+    with open(index_path, 'rb') as f:
+        assert f.read() == expected
+
+
+def test_rebuild_index_drops_torn_member(tmp_path):
+    path = RankingArchive.archive_path(str(tmp_path), "2024-01-01")
+    locators = append_records(path, 3)
+    # データの追記途中で異常終了した場合
+    with open(path, 'ab') as f:
+        f.write(b"\x1f\x8b\x08\x00")
+    assert RankingArchive.rebuild_index(path, lambda record: record["keywords"]) == 3
+    assert list(RankingArchive.iter_locators(path)) == locators
+    assert [record["n"] for record in RankingArchive.iter_records(path)] == [0, 1, 2]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from RankingDashboard import encode_chart
+from RankingDownsample import bucket_datas, lttb_datas
+
+STARTED = datetime(2024, 1, 1)
+
+
+def test_encode_chart_rounds_bucket_medians():
+    # 1日に2回の検索の中央値は x.5 になる
+    datas = {
+        "日付": [STARTED + timedelta(hours=12 * i) for i in range(4)],
+        "サイト": {"site": [3, 4, 6, None], "other": [1.6, None, None, None]},
+        "調査深さ": [100, 90, 100, 100],
+    }
+    bucketed = bucket_datas(datas, "day", "median")
+    assert bucketed["サイト"]["site"] == [3.5, 6]
+    chart = encode_chart("k", bucketed)
+    assert chart["ranks"] == [[4, 6], [2, 0]]
+    assert chart["depth"] == [90, 100]
+    assert chart["dt"] == [0, 86400]
+
+
+def test_encode_chart_keeps_per_trace_dates():
+    dates = [STARTED + timedelta(hours=i) for i in range(20)]
+    datas = {"日付": dates, "サイト": {"site": [i % 7 + 1 for i in range(20)]}, "調査深さ": [None] * 20}
+    sampled = lttb_datas(datas, 5)
+    chart = encode_chart("k", sampled)
+    t = [chart["t0"] + sum(chart["dt"][:i + 1]) for i in range(len(chart["dt"]))]
+    picked = [t[i] for i in chart["idx"][0]]
+    # 日時はUTCとみなしてUNIX時間にする
+    assert picked == [int((d - datetime(1970, 1, 1)).total_seconds()) for d in sampled["サイト日付"]["site"]]
+    assert len(chart["ranks"][0]) == len(chart["idx"][0]) <= 5
+    assert chart["depth_idx"] == []
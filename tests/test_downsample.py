@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime, timedelta
+from RankingDownsample import lttb_datas, bucket_datas, downsample
+
+THRESHOLD = 100
+
+
+def make_datas(count: int, sites: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+    # selectRankingと同じく新しい順
+    dates = [started + timedelta(hours=count - i) for i in range(count)]
+    site_dic = {}
+    for s in range(sites):
+        rank = 10
+        values = []
+        for _ in range(count):
+            rank = min(max(rank + rng.randint(-2, 2), 1), 50)
+            values.append(rank)
+        site_dic["site{}".format(s)] = values
+    return {"日付": dates, "サイト": site_dic, "調査深さ": [50] * count}
+
+
+def present(values: list) -> int:
+    return sum(1 for v in values if v is not None)
+
+
+def test_lttb_keeps_each_trace_close_to_threshold():
+    datas = make_datas(5000, sites=20)
+    sampled = lttb_datas(datas, THRESHOLD)
+    for site, values in sampled["サイト"].items():
+        assert len(values) == len(sampled["サイト日付"][site])
+        assert THRESHOLD * 0.9 <= len(values) <= THRESHOLD
+    assert THRESHOLD * 0.9 <= len(sampled["調査深さ"]) <= THRESHOLD
+    # 線ごとの日付は元の順(新しい順)のまま
+    for dates in sampled["サイト日付"].values():
+        assert dates == sorted(dates, reverse=True)
+
+
+def test_lttb_keeps_gaps_and_caps_gap_points():
+    datas = make_datas(5000, sites=2)
+    one_gap = datas["サイト"]["site0"]
+    for i in range(2000, 2100):
+        one_gap[i] = None
+    # 1つおきにランク外になる線(途切れを全部残すと2500点になる)
+    datas["サイト"]["site1"] = [v if i % 2 == 0 else None for i, v in enumerate(datas["サイト"]["site1"])]
+
+    sampled = lttb_datas(datas, THRESHOLD)
+    values = sampled["サイト"]["site0"]
+    assert len(values) <= THRESHOLD
+    assert values.count(None) == 1
+    gap = sampled["サイト日付"]["site0"][values.index(None)]
+    assert gap == datas["日付"][2000]
+
+    values = sampled["サイト"]["site1"]
+    assert len(values) <= THRESHOLD
+    assert values.count(None) == THRESHOLD // 4
+    assert present(values) >= THRESHOLD // 2
+
+
+def test_lttb_leaves_short_series_untouched():
+    datas = make_datas(50, sites=3)
+    assert lttb_datas(datas, THRESHOLD) is datas
+
+
+def test_bucket_then_lttb():
+    datas = make_datas(24 * 400, sites=5)
+    keyword, sampled = next(downsample({"k": datas}, bucket="day", aggregate="min", lttb=THRESHOLD))
+    assert keyword == "k"
+    assert len(bucket_datas(datas, "day", "min")["日付"]) in (400, 401)
+    for values in sampled["サイト"].values():
+        assert THRESHOLD * 0.9 <= len(values) <= THRESHOLD
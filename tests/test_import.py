@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime, timedelta
+from RankingModels import TRankingSummary, open_db
+from RankingCheckAPI import save_response
+from RankingImport import import_archive
+
+STARTED = datetime(2024, 1, 1)
+
+
+def make_archive(base_dir: str):
+    rng = random.Random(1)
+    searches = [(keywords, STARTED + timedelta(hours=hour)) for hour in range(24) for keywords in (["a"], ["b", "c"])]
+    # 検索日時の順ではなく保存される場合もある
+    rng.shuffle(searches)
+    for keywords, search_time in searches:
+        items = [{"formattedUrl": "https://example.com/{}".format(d), "title": "doc{}".format(d)} for d in rng.sample(range(1, 30), 10)]
+        save_response(keywords, search_time, [{"items": items}], base_dir)
+
+
+def summary(dbfile: str) -> list[tuple]:
+    engine, session = open_db(dbfile)
+    try:
+        return sorted(
+            (row.search_m_id, row.doc_id, row.latest_ranking, row.previous_ranking, row.best_ranking,
+             row.first_seen, row.last_seen, row.latest_search_id)
+            for row in session.query(TRankingSummary)
+        )
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def test_import_rebuilds_summary_once_per_keyword_set(tmp_path):
+    base_dir = str(tmp_path / "archive")
+    dbfile = str(tmp_path / "ranking.sqlite3")
+    make_archive(base_dir)
+
+    stats = import_archive(dbfile, base_dir, "example.com/1", processes=1, progress_stream=None)
+    assert (stats["imported"], stats["errors"], stats["summaries"]) == (48, 0, 2)
+    imported = summary(dbfile)
+    assert len(imported) > 0
+
+    engine, session = open_db(dbfile)
+    try:
+        TRankingSummary.rebuild(session)
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+    assert summary(dbfile) == imported
+
+    # 取り込みなおしても集計は変わらない
+    stats = import_archive(dbfile, base_dir, "example.com/1", processes=1, progress_stream=None)
+    assert (stats["imported"], stats["summaries"]) == (48, 2)
+    assert summary(dbfile) == imported
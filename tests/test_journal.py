@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from RankingJournal import RunJournal, FETCHED, ARCHIVED, INGESTED
+
+
+def test_resume_keeps_most_advanced_state(tmp_path):
+    path = str(tmp_path / "journal.ndjson")
+    journal = RunJournal(path)
+    journal.record(["a", "b"], FETCHED)
+    journal.record(["a", "b"], ARCHIVED, archive="x.json")
+    journal.record(["c"], FETCHED)
+    journal.record(["d"], INGESTED, search_id=3)
+    # 後から古い状態が記録されても、再開時は最も進んだ状態を使う
+    journal.record(["d"], FETCHED)
+    journal.close()
+
+    resumed = RunJournal(path, resume=True)
+    try:
+        assert resumed.state(["a", "b"])["state"] == ARCHIVED
+        assert resumed.state(["a", "b"])["archive"] == "x.json"
+        assert resumed.state(["c"])["state"] == FETCHED
+        assert resumed.state(["d"])["state"] == INGESTED
+        assert resumed.state(["e"]) is None
+        assert resumed.counts() == {FETCHED: 1, ARCHIVED: 1, INGESTED: 1}
+    finally:
+        resumed.close()
+
+
+def test_resume_skips_torn_and_unknown_lines(tmp_path):
+    path = str(tmp_path / "journal.ndjson")
+    journal = RunJournal(path)
+    journal.record(["a"], INGESTED)
+    journal.close()
+    with open(path, 'a', encoding='UTF-8') as f:
+        f.write('{"keywords": "b", "state": "unknown"}\n')
+        # 異常終了で書きかけになった最後の行
+        f.write('{"keywords": "c", "sta')
+
+    resumed = RunJournal(path, resume=True)
+    try:
+        assert resumed.state(["a"])["state"] == INGESTED
+        assert resumed.state(["b"]) is None
+        assert resumed.state(["c"]) is None
+    finally:
+        resumed.close()
+
+
+def test_resume_appends_and_new_run_truncates(tmp_path):
+    path = str(tmp_path / "journal.ndjson")
+    journal = RunJournal(path)
+    journal.record(["a"], FETCHED)
+    journal.close()
+
+    resumed = RunJournal(path, resume=True)
+    resumed.record(["b"], FETCHED)
+    resumed.close()
+    again = RunJournal(path, resume=True)
+    assert again.counts()[FETCHED] == 2
+    again.close()
+
+    fresh = RunJournal(path)
+    try:
+        assert fresh.state(["a"]) is None
+        assert fresh.counts() == {FETCHED: 0, ARCHIVED: 0, INGESTED: 0}
+    finally:
+        fresh.close()
+    with open(path, encoding='UTF-8') as f:
+        assert f.read() == ""
+
+
+def test_record_rejects_unknown_state(tmp_path):
+    journal = RunJournal(str(tmp_path / "journal.ndjson"))
+    try:
+        with pytest.raises(ValueError):
+            journal.record(["a"], "done")
+    finally:
+        journal.close()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime, timedelta
+import pytest
+
+# --pandasを使う場合だけ必要な依存
+pytest.importorskip("pandas")
+
+import numpy as np
+from RankingModels import TSearchM, TSearch, TRanking, TDoc, open_db
+import RankingMatrix
+
+STARTED = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def dbfile(tmp_path):
+    path = str(tmp_path / "ranking.sqlite3")
+    engine, session = open_db(path)
+    rng = random.Random(1)
+    docs = []
+    for d in range(1, 30):
+        t_doc = TDoc()
+        t_doc.link_url = "https://example.com/{}".format(d)
+        t_doc.title = "doc{}".format(d)
+        t_doc.mypage_flg = False
+        docs.append(TDoc.upsert(t_doc, session, commit=False))
+    for k in range(12):
+        t_search_m = TSearchM()
+        t_search_m.keywords = "kw{:02d}".format(k)
+        t_search_m = TSearchM.upsert(t_search_m, session, commit=False)
+        for day in range(k + 1):
+            t_search = TSearch()
+            t_search.search_m_id = t_search_m.id
+            t_search.search_datetime = STARTED + timedelta(days=day)
+            t_search.search_depth = 10
+            t_search = TSearch.upsert(t_search, session, commit=False)
+            t_rankings = []
+            for ranking, t_doc in enumerate(rng.sample(docs, 5), start=1):
+                t_ranking = TRanking()
+                t_ranking.search_id = t_search.id
+                t_ranking.ranking = ranking
+                t_ranking.doc_id = t_doc.id
+                t_rankings.append(t_ranking)
+            TRanking.bulk_insert(t_rankings, session)
+    session.commit()
+    session.close()
+    engine.dispose()
+    return path
+
+
+def snapshot(matrices) -> list:
+    return [(m.name, m.dates.tolist(), m.depth.tolist(), m.site_labels(), np.nan_to_num(m.values, nan=-1).tolist()) for m in matrices]
+
+
+@pytest.mark.parametrize("chunksize", [1, 4, 7, 1000])
+def test_iter_matrices_does_not_depend_on_chunksize(dbfile, chunksize):
+    expected = snapshot(RankingMatrix.iter_matrices(dbfile, chunksize=100000))
+    assert [name for name, *_ in expected] == ["[{}]kw{:02d}".format(k + 1, k) for k in range(12)]
+    assert snapshot(RankingMatrix.iter_matrices(dbfile, chunksize=chunksize)) == expected
+
+
+def test_iter_matrices_loads_axes_only_for_read_keyword_sets(dbfile, monkeypatch):
+    load_axes = RankingMatrix.__dict__["__load_axes"]
+    loaded = []
+
+    def recording(conn, keywords, search_m_ids=None, since=None, until=None):
+        loaded.append(list(search_m_ids))
+        return load_axes(conn, keywords, search_m_ids, since, until)
+
+    monkeypatch.setitem(RankingMatrix.__dict__, "__load_axes", recording)
+    matrices = RankingMatrix.iter_matrices(dbfile, chunksize=10)
+    first = next(matrices)
+    # 最初の行列を返すまでに、すべてのキーワードセットの日付軸を読み込まない
+    assert first.name == "[1]kw00"
+    assert sum(len(ids) for ids in loaded) <= 2
+    rest = list(matrices)
+    assert len(rest) == 11
+    assert sorted(i for ids in loaded for i in ids) == list(range(1, 13))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+from datetime import datetime, timedelta
+import pytest
+from RankingModels import TSearchM, TSearch, TRanking, TDoc, open_db
+import RankingMovers
+
+STARTED = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def dbfile(tmp_path):
+    path = str(tmp_path / "ranking.sqlite3")
+    engine, session = open_db(path)
+    for d in range(1, 21):
+        t_doc = TDoc()
+        t_doc.link_url = "https://example.com/{}".format(d)
+        t_doc.title = "doc{}".format(d)
+        t_doc.mypage_flg = d == 20
+        TDoc.upsert(t_doc, session)
+    session.close()
+    engine.dispose()
+    return path
+
+
+def ingest(dbfile: str, keywords: str, search_datetime: datetime, doc_ids: list[int]):
+    engine, session = open_db(dbfile)
+    try:
+        t_search_m = TSearchM()
+        t_search_m.keywords = keywords
+        t_search_m = TSearchM.upsert(t_search_m, session, commit=False)
+        t_search = TSearch()
+        t_search.search_m_id = t_search_m.id
+        t_search.search_datetime = search_datetime
+        t_search = TSearch.upsert(t_search, session, commit=False)
+        t_rankings = []
+        for ranking, doc_id in enumerate(doc_ids, start=1):
+            t_ranking = TRanking()
+            t_ranking.search_id = t_search.id
+            t_ranking.ranking = ranking
+            t_ranking.doc_id = doc_id
+            t_rankings.append(t_ranking)
+        TRanking.bulk_insert(t_rankings, session)
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def report(dbfile: str, state_file: str, reset: bool = False) -> list[dict]:
+    output = io.StringIO()
+    RankingMovers.report_movements(dbfile, output, 'csv', state_file, top=3, threshold=5, reset=reset)
+    return list(csv.DictReader(io.StringIO(output.getvalue())))
+
+
+def events(rows: list[dict]) -> list[tuple]:
+    return sorted((row["keywords"], row["event"], int(row["doc_id"])) for row in rows)
+
+
+def test_report_only_new_searches(dbfile, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    ingest(dbfile, "a\tb", STARTED, list(range(1, 11)))
+    ingest(dbfile, "a\tb", STARTED + timedelta(days=1), [10, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+    rows = report(dbfile, state_file)
+    # 10位→1位(enter)、3位→4位(leave)、キーワードのタブは空白にする
+    assert events(rows) == [("a b", "enter", 10), ("a b", "leave", 3)]
+    assert rows[0]["keywords"] == "a b"
+    assert report(dbfile, state_file) == []
+
+    ingest(dbfile, "a\tb", STARTED + timedelta(days=2), [10, 1, 2, 3, 4, 5, 6, 7, 8, 20])
+    assert events(report(dbfile, state_file)) == [("a b", "mypage", 20)]
+
+
+def test_searches_committed_out_of_datetime_order(dbfile, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    for keywords in ("a", "b"):
+        ingest(dbfile, keywords, STARTED, list(range(1, 11)))
+    # 一括検索ではbの検索がaより後に始まっても先に登録されることがある
+    ingest(dbfile, "b", STARTED + timedelta(hours=2), [9, 1, 2, 3, 4, 5, 6, 7, 8, 10])
+    assert events(report(dbfile, state_file)) == [("b", "enter", 9), ("b", "leave", 3)]
+
+    ingest(dbfile, "a", STARTED + timedelta(hours=1), [8, 1, 2, 3, 4, 5, 6, 7, 9, 10])
+    assert events(report(dbfile, state_file)) == [("a", "enter", 8), ("a", "leave", 3)]
+    assert report(dbfile, state_file) == []
+
+
+def test_backfill_is_reported_against_previous_datetime(dbfile, tmp_path):
+    state_file = str(tmp_path / "state.json")
+    ingest(dbfile, "a", STARTED, list(range(1, 11)))
+    ingest(dbfile, "a", STARTED + timedelta(days=2), list(range(1, 11)))
+    assert report(dbfile, state_file) == []
+
+    # 過去の日時の検索を後から取り込むと、次回のレポートで1つ前の日時の検索との変動が出てくる
+    ingest(dbfile, "a", STARTED + timedelta(days=1), [9, 1, 2, 3, 4, 5, 6, 7, 8, 10])
+    rows = report(dbfile, state_file)
+    assert [(row["search_datetime"][:10], row["prev_search_datetime"][:10], row["event"], int(row["doc_id"])) for row in rows] == [
+        ("2024-01-02", "2024-01-01", "enter", 9), ("2024-01-02", "2024-01-01", "leave", 3),
+    ]
+    assert report(dbfile, state_file) == []
+    # resetで処理しなおすと、取り込んだ検索の次の検索の変動も出てくる
+    rows = report(dbfile, state_file, reset=True)
+    assert [(row["search_datetime"][:10], row["event"], int(row["doc_id"])) for row in rows] == [
+        ("2024-01-02", "enter", 9), ("2024-01-02", "leave", 3),
+        ("2024-01-03", "enter", 3), ("2024-01-03", "leave", 9),
+    ]
+
+
+def test_watermark_roundtrip(tmp_path):
+    state_file = str(tmp_path / "state" / "movers.json")
+    assert RankingMovers.load_watermark(state_file) == 0
+    RankingMovers.save_watermark(state_file, 7)
+    assert RankingMovers.load_watermark(state_file) == 7
+    with open(state_file, 'w') as f:
+        f.write('{"last_search_id": 7')
+    assert RankingMovers.load_watermark(state_file) == 0
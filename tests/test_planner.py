@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+import pytest
+from RankingModels import TSearchM, TSearch, TRanking, TDoc, open_db
+import RankingPlanner
+
+# キーワードセットごとの自ページの順位の履歴(古い順、ランク外はNone)
+HISTORY = {
+    "stable": [2, 3, 2],
+    "volatile": [5, 25, 15],
+    "unranked": [None, None, None],
+}
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine, session = open_db(str(tmp_path / "ranking.sqlite3"))
+    mypage = TDoc(link_url="https://example.com/mypage", title="mypage", mypage_flg=True)
+    other = TDoc(link_url="https://example.com/other", title="other", mypage_flg=False)
+    session.add_all([mypage, other])
+    session.flush()
+    started = datetime(2024, 1, 1)
+    for keywords, ranks in HISTORY.items():
+        t_search_m = TSearchM(keywords=keywords)
+        session.add(t_search_m)
+        session.flush()
+        for day, rank in enumerate(ranks):
+            t_search = TSearch(search_m_id=t_search_m.id, search_datetime=started + timedelta(days=day), search_depth=100)
+            session.add(t_search)
+            session.flush()
+            session.add(TRanking(search_id=t_search.id, doc_id=other.id, ranking=1))
+            if rank is not None:
+                session.add(TRanking(search_id=t_search.id, doc_id=mypage.id, ranking=rank))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def keyword_sets() -> list[dict]:
+    return [{"keywords": [keywords], "url": None, "max_ranking": None} for keywords in ["stable", "volatile", "unranked", "new"]]
+
+
+def pages_of(planned: list[dict]) -> dict:
+    return {keyword_set["keywords"][0]: keyword_set["pages"] for keyword_set in planned}
+
+
+def test_plan_allocates_wanted_pages_within_large_budget(session):
+    planned = RankingPlanner.plan(session, keyword_sets(), budget=100, max_ranking=50)
+    assert [keyword_set["keywords"][0] for keyword_set in planned] == ["new", "volatile", "stable", "unranked"]
+    assert {keyword_set["keywords"][0]: keyword_set["reason"] for keyword_set in planned} == \
+        {"new": "new", "volatile": "volatile", "stable": "stable", "unranked": "not ranked"}
+    # 変動の大きいキーワードセットは過去の最低順位(25位)+DEPTH_MARGINまで調べる
+    assert pages_of(planned) == {"new": 5, "volatile": 3, "stable": 1, "unranked": 5}
+    assert {keyword_set["keywords"][0]: keyword_set["max_ranking"] for keyword_set in planned} == \
+        {"new": 50, "volatile": 30, "stable": 10, "unranked": 50}
+
+
+def test_plan_gives_every_set_one_page_before_extra_pages(session):
+    planned = RankingPlanner.plan(session, keyword_sets(), budget=5, max_ranking=50)
+    assert pages_of(planned) == {"new": 2, "volatile": 1, "stable": 1, "unranked": 1}
+    assert sum(keyword_set["pages"] for keyword_set in planned) == 5
+
+
+def test_plan_moves_sets_without_budget_to_the_end(session):
+    planned = RankingPlanner.plan(session, keyword_sets(), budget=2, max_ranking=50)
+    assert [(keyword_set["keywords"][0], keyword_set["pages"]) for keyword_set in planned] == \
+        [("new", 1), ("volatile", 1), ("stable", 0), ("unranked", 0)]
+
+
+def test_plan_respects_per_set_max_ranking(session):
+    sets = keyword_sets()
+    sets[3]["max_ranking"] = 15
+    planned = RankingPlanner.plan(session, sets, budget=100, max_ranking=50)
+    new = [keyword_set for keyword_set in planned if keyword_set["keywords"][0] == "new"][0]
+    assert (new["pages"], new["max_ranking"]) == (2, 15)
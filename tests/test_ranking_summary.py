@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime, timedelta
+import pytest
+from RankingModels import TSearchM, TSearch, TRanking, TRankingSummary, open_db
+
+STARTED = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine, session = open_db(str(tmp_path / "ranking.sqlite3"))
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def ingest(session, keywords: str, search_datetime: datetime, doc_ids: list[int], replace: bool = False):
+    """RankingCheckAPIの__db_upsertと同じ順で検索・ランキング・集計を1トランザクションで登録する"""
+    t_search_m = TSearchM()
+    t_search_m.keywords = keywords
+    t_search_m = TSearchM.upsert(t_search_m, session, commit=False)
+    t_search = TSearch()
+    t_search.search_m_id = t_search_m.id
+    t_search.search_datetime = search_datetime
+    t_search = TSearch.upsert(t_search, session, commit=False)
+    t_rankings = []
+    for ranking, doc_id in enumerate(doc_ids, start=1):
+        t_ranking = TRanking()
+        t_ranking.search_id = t_search.id
+        t_ranking.ranking = ranking
+        t_ranking.doc_id = doc_id
+        t_rankings.append(t_ranking)
+    if replace:
+        session.query(TRanking).filter(TRanking.search_id == t_search.id).delete(synchronize_session=False)
+    TRanking.bulk_insert(t_rankings, session)
+    TRankingSummary.apply(t_search, t_rankings, session)
+    session.commit()
+
+
+def snapshot(session) -> list[tuple]:
+    return sorted(
+        (row.search_m_id, row.doc_id, row.latest_ranking, row.previous_ranking, row.best_ranking,
+         row.first_seen, row.last_seen, row.latest_search_id)
+        for row in session.query(TRankingSummary)
+    )
+
+
+def assert_matches_rebuild(session):
+    applied = snapshot(session)
+    assert len(applied) > 0
+    TRankingSummary.rebuild(session)
+    session.commit()
+    assert snapshot(session) == applied
+
+
+def test_apply_in_order_matches_rebuild(session):
+    rng = random.Random(1)
+    for day in range(20):
+        for keywords in ("a", "b"):
+            ingest(session, keywords, STARTED + timedelta(days=day), rng.sample(range(1, 15), 8))
+    assert_matches_rebuild(session)
+
+
+def test_apply_out_of_order_backfill_matches_rebuild(session):
+    rng = random.Random(2)
+    for day in range(10):
+        ingest(session, "a", STARTED + timedelta(days=day), rng.sample(range(1, 15), 8))
+    # 過去の日時の検索を後から登録する(アーカイブからの取り込みなど)
+    ingest(session, "a", STARTED + timedelta(days=3, hours=5), [1, 2, 3])
+    ingest(session, "a", STARTED - timedelta(days=1), [4, 5, 6])
+    assert_matches_rebuild(session)
+    ingest(session, "a", STARTED + timedelta(days=10), [7, 1])
+    assert_matches_rebuild(session)
+
+
+def test_apply_replace_reingest_matches_rebuild(session):
+    rng = random.Random(3)
+    for day in range(10):
+        ingest(session, "a", STARTED + timedelta(days=day), rng.sample(range(1, 15), 8))
+    # 最新の検索と過去の検索を別のランキングで登録しなおす
+    ingest(session, "a", STARTED + timedelta(days=9), [13, 14], replace=True)
+    assert_matches_rebuild(session)
+    ingest(session, "a", STARTED + timedelta(days=4), [1, 2, 3, 4], replace=True)
+    assert_matches_rebuild(session)
+
+
+def test_apply_empty_search_shifts_latest_to_previous(session):
+    ingest(session, "a", STARTED, [1, 2])
+    ingest(session, "a", STARTED + timedelta(days=1), [])
+    rows = {row.doc_id: row for row in session.query(TRankingSummary)}
+    assert [(rows[doc_id].latest_ranking, rows[doc_id].previous_ranking) for doc_id in (1, 2)] == [(None, 1), (None, 2)]
+    assert_matches_rebuild(session)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from RankingScheduler import SearchScheduler, JobSkipped
+
+# 書き込みスレッドが止まるとrunが終わらなくなるため、この秒数で打ち切って失敗にする
+TIMEOUT = 10
+
+
+def run_with_timeout(scheduler: SearchScheduler, jobs) -> list[dict]:
+    ret = {}
+    thread = threading.Thread(target=lambda: ret.update(results=scheduler.run(jobs)), daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert not thread.is_alive(), "SearchScheduler.runが終わらない"
+    return ret["results"]
+
+
+def test_run_keeps_submission_order():
+    scheduler = SearchScheduler(lambda job: job * 2, lambda job, fetched: fetched + 1, workers=3, queue_size=1)
+    results = run_with_timeout(scheduler, range(20))
+    assert [r["job"] for r in results] == list(range(20))
+    assert [r["result"] for r in results] == [job * 2 + 1 for job in range(20)]
+    assert scheduler.progress()["written"] == 20
+
+
+def test_fetch_and_write_failures_are_reported_per_job():
+    def fetch(job):
+        if job == 1:
+            raise RuntimeError("fetch")
+        if job == 2:
+            raise JobSkipped()
+        return job
+
+    def write(job, fetched):
+        if job == 3:
+            raise RuntimeError("write")
+        return fetched
+
+    scheduler = SearchScheduler(fetch, write, workers=2, queue_size=1)
+    results = run_with_timeout(scheduler, range(5))
+    assert str(results[1]["error"]) == "fetch"
+    assert results[2]["skipped"] is True
+    assert str(results[3]["error"]) == "write"
+    assert [r["result"] for r in results] == [0, None, None, None, 4]
+    progress = scheduler.progress()
+    assert (progress["written"], progress["failed"], progress["skipped"]) == (2, 2, 1)
+
+
+def test_report_failure_does_not_stop_writer(capsys):
+    reported = []
+
+    def report(job_result):
+        reported.append(job_result["job"])
+        raise RuntimeError("report")
+
+    # キューを小さくして、書き込みスレッドが止まればワーカーが書き込み待ちのキューで詰まるようにする
+    scheduler = SearchScheduler(lambda job: job, lambda job, fetched: fetched, workers=2, queue_size=1, report_func=report)
+    results = run_with_timeout(scheduler, range(10))
+    assert len(results) == 10
+    assert sorted(reported) == list(range(10))
+    assert scheduler.progress()["written"] == 10
+    assert "RuntimeError: report" in capsys.readouterr().err
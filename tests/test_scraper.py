@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+import requests
+from RankingCheck import fetch, create_http_session
+
+# ページごとの検索結果のURL(2ページ目の1件目は1ページ目と同じURL)
+PAGES = {
+    1: ["https://example.com/1", "https://example.com/2", "https://example.com/3", "https://example.com/4"],
+    2: ["https://example.com/1", "https://example.com/5", "https://example.com/6", "https://example.com/7"],
+    3: ["https://example.com/8", "https://example.com/9"],
+}
+
+
+def result_page(page: int) -> bytes:
+    """DEFAULT_SELECTORSで取り出せる形の検索結果のhtml"""
+    items = "".join(
+        '<div class="ZINbbc xpd O9g5cc uUPGi"><div><a href="/url?q={0}&amp;sa=U"><h3><div>title {0}</div></h3></a></div></div>'.format(url)
+        for url in PAGES[page]
+    )
+    next_link = '<a aria-label="次のページ" href="/search?start={}">次へ</a>'.format(page * 10) if page + 1 in PAGES else ""
+    return '<html><body>{}{}</body></html>'.format(items, next_link).encode('utf-8')
+
+
+class StandIn:
+    """検索結果の代わりに決まったページを返すローカルのサーバ"""
+
+    def __init__(self, failures: dict = None):
+        # ページごとに503を返す回数
+        self.failures = dict(failures or {})
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                page = int(query.get("start", ["0"])[0]) // 10 + 1
+                stand_in.requests.append((page, query.get("q", [None])[0]))
+                if stand_in.failures.get(page, 0) > 0:
+                    stand_in.failures[page] = stand_in.failures[page] - 1
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = result_page(page)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def http():
+    http = create_http_session(retries=2, backoff=0)
+    yield http
+    http.close()
+
+
+def run_fetch(http, stand_in: StandIn, max_ranking: int, output_base_dir: str) -> list[tuple]:
+    return fetch(http, ["a", "b"], max_ranking, datetime(2024, 1, 1, 12, 0, 0), base_url=stand_in.base_url,
+                 delay=0, output_base_dir=output_base_dir)
+
+
+def test_fetch_follows_next_pages_and_skips_duplicates(http, tmp_path):
+    with StandIn() as stand_in:
+        results = run_fetch(http, stand_in, 100, str(tmp_path))
+    # 2ページ目のexample.com/1は二重計上しない
+    assert [url for url, _ in results] == ["https://example.com/{}".format(i) for i in range(1, 10)]
+    assert results[0][1] == "title https://example.com/1"
+    assert [page for page, _ in stand_in.requests] == [1, 2, 3]
+    assert stand_in.requests[0][1] == " a b"
+    saved = sorted(os.listdir(tmp_path / "2024-01-01" / "120000"))
+    assert saved == ["a_b_0.html", "a_b_4.html", "a_b_7.html"]
+
+
+def test_fetch_stops_at_max_ranking(http, tmp_path):
+    with StandIn() as stand_in:
+        results = run_fetch(http, stand_in, 5, str(tmp_path))
+    assert [url for url, _ in results] == ["https://example.com/{}".format(i) for i in range(1, 6)]
+    # 3ページ目は取得しない
+    assert [page for page, _ in stand_in.requests] == [1, 2]
+
+
+def test_fetch_retries_on_503(http, tmp_path):
+    with StandIn(failures={2: 2}) as stand_in:
+        results = run_fetch(http, stand_in, 100, str(tmp_path))
+    assert len(results) == 9
+    assert [page for page, _ in stand_in.requests] == [1, 2, 2, 2, 3]
+
+
+def test_fetch_raises_when_retries_run_out(http, tmp_path):
+    with StandIn(failures={1: 3}) as stand_in:
+        with pytest.raises(requests.HTTPError):
+            run_fetch(http, stand_in, 100, str(tmp_path))
+    assert len(stand_in.requests) == 3